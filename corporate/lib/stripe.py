@@ -3871,7 +3871,7 @@ class BillingSession(ABC):
         self, channel_name: str, topic: str, message: str
     ) -> None:
         from zerver.actions.message_send import (
-            internal_send_private_message,
+            internal_send_bulk_private_messages,
             internal_send_stream_message,
         )
 
@@ -3889,8 +3889,9 @@ class BillingSession(ABC):
             direct_message = (
                 f":red_circle: Channel named '{channel_name}' doesn't exist.\n\n{topic}:\n{message}"
             )
-            for user in admin_realm.get_human_admin_users():
-                internal_send_private_message(sender, user, direct_message)
+            internal_send_bulk_private_messages(
+                sender, [(user, direct_message) for user in admin_realm.get_human_admin_users()]
+            )
 
 
 class RealmBillingSession(BillingSession):
@@ -4105,7 +4106,7 @@ class RealmBillingSession(BillingSession):
             if error_message != "":
                 raise SupportRequestError(error_message)
 
-        from zerver.actions.message_send import internal_send_private_message
+        from zerver.actions.message_send import internal_send_bulk_private_messages
 
         if self.realm.deactivated:
             raise SupportRequestError("Realm has been deactivated")
@@ -4118,6 +4119,7 @@ class RealmBillingSession(BillingSession):
                 event_type=BillingSessionEventType.SPONSORSHIP_APPROVED, event_time=timezone_now()
             )
         notification_bot = get_system_bot(settings.NOTIFICATION_BOT, self.realm.id)
+        messages = []
         for user in self.realm.get_human_billing_admin_and_realm_owner_users():
             with override_language(user.default_language):
                 # Using variable to make life easier for translators if these details change.
@@ -4132,7 +4134,8 @@ class RealmBillingSession(BillingSession):
                     begin_link="[",
                     end_link="](/help/linking-to-zulip-website)",
                 )
-                internal_send_private_message(notification_bot, user, message)
+            messages.append((user, message))
+        internal_send_bulk_private_messages(notification_bot, messages)
         return f"Sponsorship approved for {self.billing_entity_display_name}; Emailed organization owners and billing admins."
 
     @override
@@ -4,7 +4,7 @@ from collections.abc import Iterable
 from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
 from datetime import timedelta
-from typing import Any
+from typing import Any, TypedDict
 
 from django.conf import settings
 from django.db import transaction
@@ -53,7 +53,7 @@ from zerver.lib.streams import (
     check_stream_access_based_on_stream_post_policy,
 )
 from zerver.lib.string_validation import check_stream_topic
-from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.lib.timestamp import datetime_to_timestamp, timestamp_to_datetime
 from zerver.lib.topic import (
     ORIG_TOPIC,
     RESOLVED_TOPIC_PREFIX,
@@ -93,6 +93,18 @@ class UpdateMessageResult:
     detached_uploads: list[dict[str, Any]]
 
 
+class MessageMoveContinuation(TypedDict):
+    # What the later batches of a move done in batches (see
+    # do_update_message) need to know about the earlier ones.
+    edit_timestamp: int
+    changed_messages_count: int
+    # Messages sent to the original topic after the move started are
+    # not moved, so that a busy topic's move finishes.
+    max_message_id: int
+    target_topic_has_messages: bool
+    has_visible_preexisting_messages: bool
+
+
 def subscriber_info(user_id: int) -> dict[str, Any]:
     return {"id": user_id, "flags": ["read"]}
 
@@ -443,6 +455,7 @@ def do_update_message(
     rendering_result: MessageRenderingResult | None,
     prior_mention_user_ids: set[int],
     mention_data: MentionData | None = None,
+    move_continuation: MessageMoveContinuation | None = None,
 ) -> UpdateMessageResult:
     """
     The main function for message editing.  A message edit event can
@@ -456,8 +469,20 @@ def do_update_message(
 
     With topic edits, propagate_mode determines whether other message
     also have their topics edited.
+
+    Moves of more than settings.MOVE_MESSAGES_BATCH_SIZE other
+    messages only move the oldest batch here, so that a big topic is
+    not locked for minutes; the deferred_work queue processor moves
+    the rest, a batch per transaction, with do_continue_message_move.
+    Clients get an update_message event for each batch, and only the
+    last batch migrates UserTopic rows and sends the notifications
+    about the move.
     """
-    timestamp = timezone_now()
+    if move_continuation is None:
+        timestamp = timezone_now()
+    else:
+        # Every batch of a move shares the timestamp of the edit.
+        timestamp = timestamp_to_datetime(move_continuation["edit_timestamp"])
     target_message.last_edit_time = timestamp
 
     event: dict[str, Any] = {
@@ -696,13 +721,18 @@ def do_update_message(
         target_topic_name: str = topic_name if topic_name is not None else orig_topic_name
 
         assert target_stream.recipient_id is not None
-        target_topic_has_messages = messages_for_topic(
-            realm.id, target_stream.recipient_id, target_topic_name
-        ).exists()
+        if move_continuation is not None:
+            # Earlier batches have put messages there already.
+            target_topic_has_messages = move_continuation["target_topic_has_messages"]
+        else:
+            target_topic_has_messages = messages_for_topic(
+                realm.id, target_stream.recipient_id, target_topic_name
+            ).exists()
 
     changed_messages = Message.objects.filter(id=target_message.id)
     changed_message_ids = [target_message.id]
     changed_messages_count = 1
+    more_messages_to_move = False
     save_changes_for_propagation_mode = lambda: Message.objects.filter(
         id=target_message.id
     ).select_related(*Message.DEFAULT_SELECT_RELATED)
@@ -722,16 +752,32 @@ def do_update_message(
             topic_only_edit_history_event["prev_stream"] = edit_history_event["prev_stream"]
             topic_only_edit_history_event["stream"] = edit_history_event["stream"]
 
-        later_messages, save_changes_for_propagation_mode = update_messages_for_topic_edit(
-            acting_user=user_profile,
-            edited_message=target_message,
-            propagate_mode=propagate_mode,
-            orig_topic_name=orig_topic_name,
-            topic_name=topic_name,
-            new_stream=new_stream,
-            old_stream=stream_being_edited,
-            edit_history_event=topic_only_edit_history_event,
-            last_edit_time=timestamp,
+        # Messages whose topic only changes case still match the
+        # original topic once moved, so such moves can't be batched.
+        batch_size: int | None = settings.MOVE_MESSAGES_BATCH_SIZE
+        if (
+            new_stream is None
+            and topic_name is not None
+            and topic_name.lower() == orig_topic_name.lower()
+        ):
+            batch_size = None
+
+        later_messages, save_changes_for_propagation_mode, more_messages_to_move = (
+            update_messages_for_topic_edit(
+                acting_user=user_profile,
+                edited_message=target_message,
+                propagate_mode=propagate_mode,
+                orig_topic_name=orig_topic_name,
+                topic_name=topic_name,
+                new_stream=new_stream,
+                old_stream=stream_being_edited,
+                edit_history_event=topic_only_edit_history_event,
+                last_edit_time=timestamp,
+                batch_size=batch_size,
+                max_message_id=(
+                    move_continuation["max_message_id"] if move_continuation is not None else None
+                ),
+            )
         )
         changed_messages |= later_messages
         changed_message_ids = list(changed_messages.values_list("id", flat=True))
@@ -873,7 +919,7 @@ def do_update_message(
     # whether we've moved the entire topic, or just part of it. We
     # make that determination here.
     moved_all_visible_messages = False
-    if topic_name is not None or new_stream is not None:
+    if (topic_name is not None or new_stream is not None) and not more_messages_to_move:
         assert stream_being_edited is not None
 
         if propagate_mode == "change_all":
@@ -1048,6 +1094,63 @@ def do_update_message(
 
     send_event_on_commit(user_profile.realm, event, users_to_be_notified)
 
+    if more_messages_to_move:
+        assert stream_being_edited is not None
+        if move_continuation is None:
+            assert stream_being_edited.recipient_id is not None
+            assert target_stream.recipient_id is not None
+            preexisting_topic_messages = messages_for_topic(
+                realm.id, target_stream.recipient_id, target_topic_name
+            ).exclude(id__in=changed_message_ids)
+            # What is left of the original topic is newer than this
+            # batch, so its latest message is the latest one to move.
+            max_message_id = (
+                messages_for_topic(realm.id, stream_being_edited.recipient_id, orig_topic_name)
+                .order_by("-id")
+                .values_list("id", flat=True)
+                .first()
+            )
+            assert max_message_id is not None
+            move_continuation = MessageMoveContinuation(
+                edit_timestamp=event["edit_timestamp"],
+                changed_messages_count=0,
+                max_message_id=max_message_id,
+                target_topic_has_messages=target_topic_has_messages,
+                has_visible_preexisting_messages=bulk_access_stream_messages_query(
+                    user_profile, preexisting_topic_messages, target_stream
+                ).exists(),
+            )
+        move_continuation["changed_messages_count"] += changed_messages_count
+        queue_event_on_commit(
+            "deferred_work",
+            {
+                "type": "continue_message_move",
+                "user_profile_id": user_profile.id,
+                "message_id": target_message.id,
+                "stream_id": stream_being_edited.id,
+                "orig_topic_name": orig_topic_name,
+                "new_stream_id": new_stream.id if new_stream is not None else None,
+                "topic_name": pre_truncation_topic_name,
+                "propagate_mode": propagate_mode,
+                "send_notification_to_old_thread": send_notification_to_old_thread,
+                "send_notification_to_new_thread": send_notification_to_new_thread,
+                "move_continuation": move_continuation,
+            },
+        )
+        return UpdateMessageResult(
+            changed_messages_count, attachment_reference_change.detached_attachments
+        )
+
+    resolved_topic_changed_messages = changed_messages
+    if move_continuation is not None:
+        # The notifications below are about the whole move.
+        changed_messages_count += move_continuation["changed_messages_count"]
+        if stream_being_edited is not None and topic_name is not None:
+            assert stream_being_edited.recipient_id is not None
+            resolved_topic_changed_messages = messages_for_topic(
+                realm.id, stream_being_edited.recipient_id, topic_name
+            )
+
     resolved_topic_message_id = None
     resolved_topic_message_deleted = False
     if topic_name is not None and content is None and new_stream is None:
@@ -1059,7 +1162,7 @@ def do_update_message(
                 stream=stream_being_edited,
                 old_topic_name=orig_topic_name,
                 new_topic_name=topic_name,
-                changed_messages=changed_messages,
+                changed_messages=resolved_topic_changed_messages,
                 pre_truncation_new_topic_name=pre_truncation_topic_name,
             )
         )
@@ -1111,15 +1214,22 @@ def do_update_message(
             # avoid leaking information about whether there are
             # messages in the destination topic's deeper history that
             # the acting user does not have permission to access.
-            preexisting_topic_messages = messages_for_topic(
-                realm.id, stream_for_new_topic.recipient_id, new_topic_name
-            ).exclude(id__in=[*changed_message_ids, resolved_topic_message_id])
+            if move_continuation is not None:
+                # Earlier batches have moved messages there, so we
+                # use what the first batch found.
+                no_visible_preexisting_messages = not move_continuation[
+                    "has_visible_preexisting_messages"
+                ]
+            else:
+                preexisting_topic_messages = messages_for_topic(
+                    realm.id, stream_for_new_topic.recipient_id, new_topic_name
+                ).exclude(id__in=[*changed_message_ids, resolved_topic_message_id])
 
-            visible_preexisting_messages = bulk_access_stream_messages_query(
-                user_profile, preexisting_topic_messages, stream_for_new_topic
-            )
+                visible_preexisting_messages = bulk_access_stream_messages_query(
+                    user_profile, preexisting_topic_messages, stream_for_new_topic
+                )
 
-            no_visible_preexisting_messages = not visible_preexisting_messages.exists()
+                no_visible_preexisting_messages = not visible_preexisting_messages.exists()
 
             if no_visible_preexisting_messages and moved_all_visible_messages:
                 new_thread_notification_string = gettext_lazy(
@@ -1152,6 +1262,60 @@ def do_update_message(
     )
 
 
+@transaction.atomic(savepoint=False)
+def do_continue_message_move(
+    user_profile: UserProfile,
+    message_id: int,
+    stream_id: int,
+    orig_topic_name: str,
+    new_stream_id: int | None,
+    topic_name: str | None,
+    propagate_mode: str,
+    send_notification_to_old_thread: bool,
+    send_notification_to_new_thread: bool,
+    move_continuation: MessageMoveContinuation,
+) -> None:
+    """Moves the next batch of a move that do_update_message did not
+    finish; message_id is the first message of the previous batch."""
+    realm = user_profile.realm
+    stream = get_stream_by_id_in_realm(stream_id, realm)
+    assert stream.recipient_id is not None
+
+    # Moved messages leave the original topic, so what is left there
+    # is exactly what is left to move.
+    messages = messages_for_topic(realm.id, stream.recipient_id, orig_topic_name).filter(
+        id__lte=move_continuation["max_message_id"]
+    )
+    if propagate_mode == "change_later":
+        messages = messages.filter(id__gt=message_id)
+
+    new_stream = None
+    if new_stream_id is not None:
+        new_stream = get_stream_by_id_in_realm(new_stream_id, realm)
+        # Messages the user cannot access are not moved; see
+        # update_messages_for_topic_edit.
+        messages = bulk_access_stream_messages_query(user_profile, messages, stream)
+
+    next_message_id = messages.order_by("id").values_list("id", flat=True).first()
+    if next_message_id is None:
+        # The rest of the messages were deleted or moved in the meantime.
+        return
+
+    do_update_message(
+        user_profile,
+        Message.objects.select_for_update().get(id=next_message_id),
+        new_stream,
+        topic_name,
+        propagate_mode,
+        send_notification_to_old_thread,
+        send_notification_to_new_thread,
+        content=None,
+        rendering_result=None,
+        prior_mention_user_ids=set(),
+        move_continuation=move_continuation,
+    )
+
+
 def check_time_limit_for_change_all_propagate_mode(
     message: Message,
     user_profile: UserProfile,
@@ -16,6 +16,10 @@ from zerver.lib.message import (
     get_raw_unread_data,
 )
 from zerver.lib.queue import queue_event_on_commit
+from zerver.lib.soft_deactivation import (
+    add_missing_deferred_messages,
+    mark_deferred_messages_as_read,
+)
 from zerver.lib.stream_subscription import get_subscribed_stream_recipient_ids_for_user
 from zerver.lib.topic import filter_by_topic_name_via_message
 from zerver.lib.user_message import DEFAULT_HISTORICAL_FLAGS, create_historical_user_messages
@@ -49,6 +53,9 @@ def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = No
     )
     do_clear_mobile_push_notifications_for_ids([user_profile.id], all_push_message_ids)
 
+    with transaction.atomic(durable=True):
+        deferred_count = len(mark_deferred_messages_as_read(user_profile))
+
     batch_size = 2000
     count = 0
     while True:
@@ -98,13 +105,16 @@ def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = No
     )
     send_event_rollback_unsafe(user_profile.realm, event, [user_profile.id])
 
-    return count
+    return count + deferred_count
 
 
 @transaction.atomic(durable=True)
 def do_mark_stream_messages_as_read(
     user_profile: UserProfile, stream_recipient_id: int, topic_name: str | None = None
 ) -> int:
+    if topic_name:
+        add_missing_deferred_messages(user_profile)
+
     query = (
         UserMessage.select_for_update_query()
         .filter(
@@ -123,14 +133,20 @@ def do_mark_stream_messages_as_read(
         )
 
     message_ids = list(query.values_list("message_id", flat=True))
-
-    if len(message_ids) == 0:
-        return 0
-
     count = query.update(
         flags=F("flags").bitor(UserMessage.flags.read),
     )
 
+    if not topic_name:
+        # Rows not yet created for a deferred channel are created as
+        # already read, rather than created and then updated.
+        deferred_message_ids = mark_deferred_messages_as_read(user_profile, stream_recipient_id)
+        message_ids += deferred_message_ids
+        count += len(deferred_message_ids)
+
+    if len(message_ids) == 0:
+        return 0
+
     event = asdict(
         ReadMessagesEvent(
             messages=message_ids,
@@ -274,6 +290,10 @@ def do_update_message_flags(
     flag_target = flagattr if is_adding else 0
 
     with transaction.atomic(durable=True):
+        # Flags on messages in deferred channels must land on the
+        # user's real UserMessage rows, not "historical" ones.
+        add_missing_deferred_messages(user_profile)
+
         if flag == "read" and not is_adding:
             # We have an invariant that all stream messages marked as
             # unread must be in streams the user is subscribed to.
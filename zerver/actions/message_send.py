@@ -1,3 +1,4 @@
+import copy
 import logging
 from collections import defaultdict
 from collections.abc import Callable, Collection, Sequence
@@ -5,13 +6,13 @@ from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
 from datetime import timedelta
 from email.headerregistry import Address
-from typing import Any, TypedDict
+from typing import Any, TypeAlias, TypedDict
 
 import orjson
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from django.db.models import F, Q, QuerySet
+from django.db.models import Q, QuerySet
 from django.utils.html import escape
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
@@ -60,8 +61,9 @@ from zerver.lib.notification_data import (
 from zerver.lib.query_helpers import query_for_ids
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.recipient_users import recipient_for_user_profiles
+from zerver.lib.stage_timing import timed_stage
 from zerver.lib.stream_subscription import (
-    get_subscriptions_for_send_message,
+    get_subscriber_rows_for_send_message,
     num_subscribers_for_stream_id,
 )
 from zerver.lib.stream_topic import StreamTopicTarget
@@ -165,6 +167,22 @@ def render_incoming_message(
     return rendering_result
 
 
+@dataclass
+class SharedRendering:
+    mention_data: MentionData
+    rendering_result: MessageRenderingResult
+    has_link: bool
+    has_image: bool
+
+
+# Rendering a message depends on the realm, the sender, and the
+# content, but not on the recipient, so code sending the same
+# notification to many recipients can pass one of these to
+# check_message to render each distinct content just once.  Keyed
+# by (realm_id, sender_id, content, email_gateway).
+RenderingCache: TypeAlias = dict[tuple[int, int, str, bool], SharedRendering]
+
+
 @dataclass
 class RecipientInfoResult:
     active_user_ids: set[int]
@@ -226,6 +244,7 @@ def get_recipient_info(
     muted_sender_user_ids: set[int] = get_muting_users(sender_id)
     topic_participant_user_ids: set[int] = set()
     sender_muted_stream: bool | None = None
+    subscriber_user_rows: list[ActiveUserDict] = []
 
     if recipient.type == Recipient.PERSONAL:
         # The sender and recipient may be the same id, so
@@ -253,68 +272,54 @@ def get_recipient_info(
             # misses this sender. This is useful when the sender is sending their first message
             # in the topic.
             topic_participant_user_ids.add(sender_id)
-        subscription_rows = (
-            get_subscriptions_for_send_message(
-                realm_id=realm_id,
-                stream_id=stream_topic.stream_id,
-                topic_name=stream_topic.topic_name,
-                possible_stream_wildcard_mention=possible_stream_wildcard_mention,
-                topic_participant_user_ids=topic_participant_user_ids,
-                possibly_mentioned_user_ids=possibly_mentioned_user_ids,
-            )
-            .annotate(
-                user_profile_email_notifications=F(
-                    "user_profile__enable_stream_email_notifications"
-                ),
-                user_profile_push_notifications=F("user_profile__enable_stream_push_notifications"),
-                user_profile_wildcard_mentions_notify=F("user_profile__wildcard_mentions_notify"),
-                followed_topic_email_notifications=F(
-                    "user_profile__enable_followed_topic_email_notifications"
-                ),
-                followed_topic_push_notifications=F(
-                    "user_profile__enable_followed_topic_push_notifications"
-                ),
-                followed_topic_wildcard_mentions_notify=F(
-                    "user_profile__enable_followed_topic_wildcard_mentions_notify"
-                ),
-            )
-            .values(
-                "user_profile_id",
-                "push_notifications",
-                "email_notifications",
-                "wildcard_mentions_notify",
-                "followed_topic_push_notifications",
-                "followed_topic_email_notifications",
-                "followed_topic_wildcard_mentions_notify",
-                "user_profile_email_notifications",
-                "user_profile_push_notifications",
-                "user_profile_wildcard_mentions_notify",
-                "is_muted",
-            )
-            .order_by("user_profile_id")
+        user_id_to_visibility_policy = stream_topic.user_id_to_visibility_policy_dict()
+        subscription_rows = get_subscriber_rows_for_send_message(
+            realm_id,
+            recipient.id,
+            possible_stream_wildcard_mention=possible_stream_wildcard_mention,
+            topic_participant_user_ids=topic_participant_user_ids,
+            possibly_mentioned_user_ids=possibly_mentioned_user_ids,
+            followed_user_ids={
+                user_id
+                for user_id, visibility_policy in user_id_to_visibility_policy.items()
+                if visibility_policy == UserTopic.VisibilityPolicy.FOLLOWED
+            },
         )
 
         message_to_user_id_set = set()
         for row in subscription_rows:
-            message_to_user_id_set.add(row["user_profile_id"])
+            message_to_user_id_set.add(row.user_profile_id)
             # We store the 'sender_muted_stream' information here to avoid db query at
             # a later stage when we perform automatically unmute topic in muted stream operation.
-            if row["user_profile_id"] == sender_id:
-                sender_muted_stream = row["is_muted"]
-
-        user_id_to_visibility_policy = stream_topic.user_id_to_visibility_policy_dict()
+            if row.user_profile_id == sender_id:
+                sender_muted_stream = row.is_muted
+
+        # The cached rows also have the user data which we'd otherwise
+        # fetch below.
+        subscriber_user_rows = [
+            ActiveUserDict(
+                id=row.user_profile_id,
+                enable_online_push_notifications=row.enable_online_push_notifications,
+                enable_offline_email_notifications=row.enable_offline_email_notifications,
+                enable_offline_push_notifications=row.enable_offline_push_notifications,
+                long_term_idle=row.long_term_idle,
+                is_bot=row.is_bot,
+                bot_type=row.bot_type,
+            )
+            for row in subscription_rows
+        ]
 
         def notification_recipients(setting: str) -> set[int]:
             return {
-                row["user_profile_id"]
+                row.user_profile_id
                 for row in subscription_rows
                 if user_allows_notifications_in_StreamTopic(
-                    row["is_muted"],
+                    row.is_muted,
                     user_id_to_visibility_policy.get(
-                        row["user_profile_id"], UserTopic.VisibilityPolicy.INHERIT
+                        row.user_profile_id, UserTopic.VisibilityPolicy.INHERIT
                     ),
-                    row[setting],
-                    row["user_profile_" + setting],
+                    getattr(row, setting),
+                    getattr(row, "user_profile_" + setting),
                 )
             }
 
@@ -323,13 +328,13 @@ def get_recipient_info(
 
         def followed_topic_notification_recipients(setting: str) -> set[int]:
             return {
-                row["user_profile_id"]
+                row.user_profile_id
                 for row in subscription_rows
                 if user_id_to_visibility_policy.get(
-                    row["user_profile_id"], UserTopic.VisibilityPolicy.INHERIT
+                    row.user_profile_id, UserTopic.VisibilityPolicy.INHERIT
                 )
                 == UserTopic.VisibilityPolicy.FOLLOWED
-                and row["followed_topic_" + setting]
+                and getattr(row, "followed_topic_" + setting)
             }
 
         followed_topic_email_user_ids = followed_topic_notification_recipients(
@@ -377,6 +382,7 @@ def get_recipient_info(
     # escaped).  `get_ids_for` will filter these extra user rows
     # for our data structures not related to bots
     user_ids = message_to_user_id_set | possibly_mentioned_user_ids
+    user_ids -= {row["id"] for row in subscriber_user_rows}
 
     if user_ids:
         query: QuerySet[UserProfile, ActiveUserDict] = UserProfile.objects.filter(
@@ -398,7 +404,7 @@ def get_recipient_info(
             user_ids=sorted(user_ids),
             field="id",
         )
-        rows = list(query)
+        rows = sorted([*subscriber_user_rows, *query], key=lambda row: row["id"])
     else:
         # TODO: We should always have at least one user_id as a recipient
         #       of any message we send.  Right now the exception to this
@@ -414,7 +420,7 @@ def get_recipient_info(
         #         realm bots that is still under development.  Once that
         #         effort is complete, we should be able to address this
         #         to-do.
-        rows = []
+        rows = subscriber_user_rows
 
     def get_ids_for(f: Callable[[ActiveUserDict], bool]) -> set[int]:
         """Only includes users on the explicit message to line"""
@@ -571,6 +577,7 @@ def build_message_send_dict(
     limit_unread_user_ids: set[int] | None = None,
     disable_external_notifications: bool = False,
     recipients_for_user_creation_events: dict[UserProfile, set[int]] | None = None,
+    rendering_cache: RenderingCache | None = None,
 ) -> SendMessageRequest:
     """Returns a dictionary that can be passed into do_send_messages.  In
     production, this is always called by check_message, but some
@@ -578,14 +585,20 @@ def build_message_send_dict(
     """
     realm = message.realm
 
-    if mention_backend is None:
-        mention_backend = MentionBackend(realm.id)
+    rendering_key = (realm.id, message.sender_id, message.content, email_gateway)
+    shared_rendering = rendering_cache.get(rendering_key) if rendering_cache is not None else None
 
-    mention_data = MentionData(
-        mention_backend=mention_backend,
-        content=message.content,
-        message_sender=message.sender,
-    )
+    if shared_rendering is not None:
+        mention_data = shared_rendering.mention_data
+    else:
+        if mention_backend is None:
+            mention_backend = MentionBackend(realm.id)
+
+        mention_data = MentionData(
+            mention_backend=mention_backend,
+            content=message.content,
+            message_sender=message.sender,
+        )
 
     if message.is_stream_message():
         stream_id = message.recipient.type_id
@@ -596,26 +609,41 @@ def build_message_send_dict(
     else:
         stream_topic = None
 
-    info = get_recipient_info(
-        realm_id=realm.id,
-        recipient=message.recipient,
-        sender_id=message.sender_id,
-        stream_topic=stream_topic,
-        possibly_mentioned_user_ids=mention_data.get_user_ids(),
-        possible_topic_wildcard_mention=mention_data.message_has_topic_wildcards(),
-        possible_stream_wildcard_mention=mention_data.message_has_stream_wildcards(),
-    )
+    with timed_stage("recipient_info"):
+        info = get_recipient_info(
+            realm_id=realm.id,
+            recipient=message.recipient,
+            sender_id=message.sender_id,
+            stream_topic=stream_topic,
+            possibly_mentioned_user_ids=mention_data.get_user_ids(),
+            possible_topic_wildcard_mention=mention_data.message_has_topic_wildcards(),
+            possible_stream_wildcard_mention=mention_data.message_has_stream_wildcards(),
+        )
 
     # Render our message_dicts.
     assert message.rendered_content is None
 
-    rendering_result = render_incoming_message(
-        message,
-        message.content,
-        realm,
-        mention_data=mention_data,
-        email_gateway=email_gateway,
-    )
+    if shared_rendering is not None:
+        # The rendering result is modified below, so each message
+        # gets its own copy.
+        rendering_result = copy.deepcopy(shared_rendering.rendering_result)
+        message.has_link = shared_rendering.has_link
+        message.has_image = shared_rendering.has_image
+    else:
+        rendering_result = render_incoming_message(
+            message,
+            message.content,
+            realm,
+            mention_data=mention_data,
+            email_gateway=email_gateway,
+        )
+        if rendering_cache is not None:
+            rendering_cache[rendering_key] = SharedRendering(
+                mention_data=mention_data,
+                rendering_result=copy.deepcopy(rendering_result),
+                has_link=message.has_link,
+                has_image=message.has_image,
+            )
     message.rendered_content = rendering_result.rendered_content
     message.rendered_content_version = markdown_version
     links_for_embed = rendering_result.links_for_preview
@@ -718,6 +746,7 @@ def create_user_messages(
     mark_as_read_user_ids: set[int],
     limit_unread_user_ids: set[int] | None,
     topic_participant_user_ids: set[int],
+    defer_user_messages: bool = False,
 ) -> list[UserMessageLite]:
     # These properties on the Message are set via
     # render_message_markdown by code in the Markdown inline patterns
@@ -749,6 +778,9 @@ def create_user_messages(
     #
     # See https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html#soft-deactivation
     # for details on this system.
+    #
+    # Streams with defer_user_messages enabled get the same treatment
+    # for all of their subscribers; see add_missing_deferred_messages.
     user_messages = []
     for user_profile_id in um_eligible_user_ids:
         flags = base_flags
@@ -767,7 +799,7 @@ def create_user_messages(
             flags |= UserMessage.flags.topic_wildcard_mentioned
 
         if (
-            user_profile_id in long_term_idle_user_ids
+            (defer_user_messages or user_profile_id in long_term_idle_user_ids)
             and user_profile_id not in stream_push_user_ids
             and user_profile_id not in stream_email_user_ids
             and user_profile_id not in followed_topic_push_user_ids
@@ -856,7 +888,8 @@ def do_send_messages(
     # Save the message receipts in the database
     user_message_flags: dict[int, dict[int, list[str]]] = defaultdict(dict)
 
-    Message.objects.bulk_create(send_request.message for send_request in send_message_requests)
+    with timed_stage("message_insert"):
+        Message.objects.bulk_create(send_request.message for send_request in send_message_requests)
 
     # Claim attachments in message
     for send_request in send_message_requests:
@@ -914,6 +947,8 @@ def do_send_messages(
             mark_as_read_user_ids=mark_as_read_user_ids,
             limit_unread_user_ids=send_request.limit_unread_user_ids,
             topic_participant_user_ids=send_request.topic_participant_user_ids,
+            defer_user_messages=send_request.stream is not None
+            and send_request.stream.defer_user_messages,
         )
 
         for um in user_messages:
@@ -929,7 +964,8 @@ def do_send_messages(
             recipient_type=send_request.message.recipient.type,
         )
 
-    bulk_insert_ums(ums)
+    with timed_stage("user_message_insert"):
+        bulk_insert_ums(ums)
 
     for send_request in send_message_requests:
         do_widget_post_save_actions(send_request)
@@ -1690,6 +1726,7 @@ def check_message(
     limit_unread_user_ids: set[int] | None = None,
     disable_external_notifications: bool = False,
     archived_channel_notice: bool = False,
+    rendering_cache: RenderingCache | None = None,
 ) -> SendMessageRequest:
     """See
     https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html
@@ -1833,6 +1870,7 @@ def check_message(
         limit_unread_user_ids=limit_unread_user_ids,
         disable_external_notifications=disable_external_notifications,
         recipients_for_user_creation_events=recipients_for_user_creation_events,
+        rendering_cache=rendering_cache,
     )
 
     if (
@@ -1871,6 +1909,7 @@ def _internal_prep_message(
     forged: bool = False,
     forged_timestamp: float | None = None,
     archived_channel_notice: bool = False,
+    rendering_cache: RenderingCache | None = None,
 ) -> SendMessageRequest | None:
     """
     Create a message object and checks it, but doesn't send it or save it to the database.
@@ -1903,6 +1942,7 @@ def _internal_prep_message(
             forged=forged,
             forged_timestamp=forged_timestamp,
             archived_channel_notice=archived_channel_notice,
+            rendering_cache=rendering_cache,
         )
     except JsonableError as e:
         logging.exception(
@@ -1927,6 +1967,7 @@ def internal_prep_stream_message(
     forged: bool = False,
     forged_timestamp: float | None = None,
     archived_channel_notice: bool = False,
+    rendering_cache: RenderingCache | None = None,
 ) -> SendMessageRequest | None:
     """
     See _internal_prep_message for details of how this works.
@@ -1945,6 +1986,7 @@ def internal_prep_stream_message(
         forged=forged,
         forged_timestamp=forged_timestamp,
         archived_channel_notice=archived_channel_notice,
+        rendering_cache=rendering_cache,
     )
 
 
@@ -1975,6 +2017,7 @@ def internal_prep_private_message(
     *,
     mention_backend: MentionBackend | None = None,
     disable_external_notifications: bool = False,
+    rendering_cache: RenderingCache | None = None,
 ) -> SendMessageRequest | None:
     """
     See _internal_prep_message for details of how this works.
@@ -1992,6 +2035,7 @@ def internal_prep_private_message(
         content=content,
         mention_backend=mention_backend,
         disable_external_notifications=disable_external_notifications,
+        rendering_cache=rendering_cache,
     )
 
 
@@ -2014,6 +2058,55 @@ def internal_send_private_message(
     return sent_message_result.message_id
 
 
+def internal_send_bulk_private_messages(
+    sender: UserProfile,
+    messages: Sequence[tuple[UserProfile, str]],
+    *,
+    disable_external_notifications: bool = False,
+    batch_size: int = 100,
+    progress_callback: Callable[[int, int], None] | None = None,
+) -> list[int | None]:
+    """Sends a direct message from sender to each (recipient, content)
+    pair in messages, for notifications sent to many users.
+
+    Each distinct content is only rendered once (per realm), and the
+    messages are sent batch_size at a time, each batch in a single
+    transaction.  After each batch, progress_callback is called with
+    the number of messages sent so far and the total.
+
+    Returns the ID of each message, in the order of messages, or None
+    for messages which were not sent, like internal_send_private_message.
+    """
+    rendering_cache: RenderingCache = {}
+    message_ids: list[int | None] = []
+    sent = 0
+    for start in range(0, len(messages), batch_size):
+        send_requests = [
+            internal_prep_private_message(
+                sender,
+                recipient_user,
+                content,
+                disable_external_notifications=disable_external_notifications,
+                rendering_cache=rendering_cache,
+            )
+            for recipient_user, content in messages[start : start + batch_size]
+        ]
+        # do_send_messages skips the messages which failed to prep.
+        sent_message_ids = iter(
+            sent_message_result.message_id
+            for sent_message_result in do_send_messages(send_requests)
+        )
+        for send_request in send_requests:
+            if send_request is None:
+                message_ids.append(None)
+            else:
+                message_ids.append(next(sent_message_ids))
+                sent += 1
+        if progress_callback is not None:
+            progress_callback(sent, len(messages))
+    return message_ids
+
+
 def internal_send_stream_message(
     sender: UserProfile,
     stream: Stream,
@@ -17,6 +17,7 @@ from zerver.actions.message_send import internal_send_stream_message
 from zerver.lib.cache import (
     cache_delete_many,
     cache_set,
+    delete_stream_recipient_info_caches,
     display_recipient_cache_key,
     to_dict_cache_key_id,
 )
@@ -24,6 +25,7 @@ from zerver.lib.exceptions import JsonableError
 from zerver.lib.mention import silent_mention_syntax_for_user
 from zerver.lib.message import get_last_message_id
 from zerver.lib.queue import queue_event_on_commit
+from zerver.lib.soft_deactivation import mark_users_with_deferred_subscriptions
 from zerver.lib.stream_color import pick_colors
 from zerver.lib.stream_subscription import (
     SubInfo,
@@ -431,6 +433,14 @@ def bulk_add_subs_to_db_with_logging(
     Subscription.objects.bulk_create(info.sub for info in subs_to_add)
     sub_ids = [info.sub.id for info in subs_to_activate]
     Subscription.objects.filter(id__in=sub_ids).update(active=True)
+    delete_stream_recipient_info_caches(
+        {info.sub.recipient_id for info in [*subs_to_add, *subs_to_activate]}
+    )
+    mark_users_with_deferred_subscriptions(
+        info.user
+        for info in [*subs_to_add, *subs_to_activate]
+        if info.stream.deferred_after_message_id is not None
+    )
 
     # Log subscription activities in RealmAuditLog
     event_time = timezone_now()
@@ -1009,6 +1019,9 @@ def bulk_remove_subscriptions(
         Subscription.objects.filter(
             id__in=sub_ids_to_deactivate,
         ).update(active=False)
+        delete_stream_recipient_info_caches(
+            {sub_info.sub.recipient_id for sub_info in subs_to_deactivate}
+        )
         occupied_streams_after = list(get_occupied_streams(realm))
 
         # Log subscription activities in RealmAuditLog
@@ -1158,7 +1171,14 @@ def do_change_stream_permission(
     stream.is_web_public = is_web_public
     stream.invite_only = invite_only
     stream.history_public_to_subscribers = history_public_to_subscribers
-    stream.save(update_fields=["invite_only", "history_public_to_subscribers", "is_web_public"])
+    update_fields = ["invite_only", "history_public_to_subscribers", "is_web_public"]
+    if stream.defer_user_messages and not stream.is_history_public_to_subscribers():
+        # See do_set_stream_defer_user_messages.  Messages which were
+        # already deferred get their UserMessage rows the next time
+        # each subscriber uses Zulip.
+        stream.defer_user_messages = False
+        update_fields.append("defer_user_messages")
+    stream.save(update_fields=update_fields)
 
     realm = stream.realm
 
@@ -1549,6 +1569,35 @@ def send_change_stream_message_retention_days_notification(
         )
 
 
+@transaction.atomic(durable=True)
+def do_set_stream_defer_user_messages(stream: Stream, defer_user_messages: bool) -> None:
+    if defer_user_messages and not stream.is_history_public_to_subscribers():
+        # Access to messages in such channels, and the events about
+        # changes to them, rely on the users' UserMessage rows.
+        raise JsonableError(
+            _("Only channels with history visible to subscribers can defer UserMessage rows.")
+        )
+    stream.defer_user_messages = defer_user_messages
+    update_fields = ["defer_user_messages"]
+    # deferred_after_message_id is left in place when deferral is
+    # disabled again, since messages sent in the meantime may still be
+    # missing UserMessage rows; see add_missing_deferred_messages.
+    if defer_user_messages and stream.deferred_after_message_id is None:
+        stream.deferred_after_message_id = get_last_message_id()
+        update_fields.append("deferred_after_message_id")
+    stream.save(update_fields=update_fields)
+    if defer_user_messages:
+        assert stream.recipient_id is not None
+        mark_users_with_deferred_subscriptions(
+            UserProfile.objects.filter(
+                id__in=Subscription.objects.filter(
+                    recipient_id=stream.recipient_id, active=True
+                ).values("user_profile_id"),
+                has_deferred_subscriptions=False,
+            )
+        )
+
+
 @transaction.atomic(durable=True)
 def do_change_stream_message_retention_days(
     stream: Stream, acting_user: UserProfile, message_retention_days: int | None = None
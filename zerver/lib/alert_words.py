@@ -1,13 +1,23 @@
+import logging
+import secrets
+import time
 from collections.abc import Iterable
+from dataclasses import asdict, dataclass
 
 import ahocorasick
+import orjson
+import redis
 from django.db import transaction
 
+from zerver.lib import cache
 from zerver.lib.cache import (
     cache_with_key,
     realm_alert_words_automaton_cache_key,
     realm_alert_words_cache_key,
+    realm_alert_words_version_cache_key,
 )
+from zerver.lib.redis_utils import get_redis_client
+from zerver.lib.stage_timing import record_stage_time
 from zerver.models import AlertWord, Realm, UserProfile
 from zerver.models.alert_words import flush_realm_alert_words
 
@@ -24,8 +34,41 @@ def alert_words_in_realm(realm: Realm) -> dict[int, list[str]]:
     return user_ids_with_words
 
 
-@cache_with_key(lambda realm: realm_alert_words_automaton_cache_key(realm.id), timeout=3600 * 24)
-def get_alert_word_automaton(realm: Realm) -> ahocorasick.Automaton:
+@dataclass
+class AlertWordAutomatonBuild:
+    realm_id: int
+    word_count: int
+    # Wall-clock time taken to build the automaton, in seconds.
+    duration: float
+    # Memory used by the automaton, as reported by pyahocorasick.
+    total_size: int
+
+
+# The most recent automaton build for each realm, in any process, for
+# monitoring; see get_alert_word_automaton_builds.  Builds are rare,
+# so each is written to Redis as it happens; their durations are also
+# recorded as a stage timing.
+ALERT_WORD_AUTOMATON_BUILDS_REDIS_KEY = "zulip:alert_word_automaton_builds"
+
+redis_client = get_redis_client()
+
+# Automatons unpickled by this process, with the realm alert-word
+# version they were built for.  Bounded, since a process can serve
+# messages in any number of realms; the least recently used realm is
+# evicted first.
+MAX_LOCAL_ALERT_WORD_AUTOMATONS = 100
+local_alert_word_automatons: dict[int, tuple[str, ahocorasick.Automaton | None]] = {}
+
+
+def get_alert_word_automaton_builds() -> list[AlertWordAutomatonBuild]:
+    return [
+        AlertWordAutomatonBuild(**orjson.loads(value))
+        for value in redis_client.hvals(ALERT_WORD_AUTOMATON_BUILDS_REDIS_KEY)
+    ]
+
+
+def build_alert_word_automaton(realm: Realm) -> ahocorasick.Automaton | None:
+    start_time = time.perf_counter()
     user_id_with_words = alert_words_in_realm(realm)
     alert_word_automaton = ahocorasick.Automaton()
     for user_id, alert_words in user_id_with_words.items():
@@ -37,6 +80,31 @@ def get_alert_word_automaton(realm: Realm) -> ahocorasick.Automaton:
             else:
                 alert_word_automaton.add_word(alert_word_lower, (alert_word_lower, {user_id}))
     alert_word_automaton.make_automaton()
+
+    build = AlertWordAutomatonBuild(
+        realm_id=realm.id,
+        word_count=len(alert_word_automaton),
+        duration=time.perf_counter() - start_time,
+        total_size=alert_word_automaton.get_stats()["total_size"],
+    )
+    record_stage_time("alert_word_automaton_build", build.duration)
+    try:
+        redis_client.hset(
+            ALERT_WORD_AUTOMATON_BUILDS_REDIS_KEY, str(realm.id), orjson.dumps(asdict(build))
+        )
+    except redis.RedisError:
+        # As with other statistics, this is not worth failing the
+        # message send which needed the automaton.
+        logging.warning("Failed to record alert word automaton build in Redis", exc_info=True)
+    if build.duration > 1:
+        logging.warning(
+            "Building the alert word automaton for realm %d took %.3fs (%d words, %d bytes)",
+            build.realm_id,
+            build.duration,
+            build.word_count,
+            build.total_size,
+        )
+
     # If the kind is not AHOCORASICK after calling make_automaton, it means there is no key present
     # and hence we cannot call items on the automaton yet. To avoid it we return None for such cases
     # where there is no alert-words in the realm.
@@ -46,6 +114,56 @@ def get_alert_word_automaton(realm: Realm) -> ahocorasick.Automaton:
     return alert_word_automaton
 
 
+def get_alert_word_automaton(realm: Realm) -> ahocorasick.Automaton | None:
+    """The realm's alert word automaton, which is needed to render
+    every message sent in the realm.
+
+    The automaton is built by whichever process first needs it after
+    the realm's alert words change, and shared with other processes
+    via memcached, tagged with the realm's alert-word version; that
+    version is replaced by flush_realm_alert_words.  Each process
+    also keeps the unpickled automaton, so that in the common case
+    only the small version key is fetched, rather than fetching and
+    unpickling an automaton with every alert word in the realm.
+    """
+    version_key = realm_alert_words_version_cache_key(realm.id)
+    automaton_key = realm_alert_words_automaton_cache_key(realm.id)
+
+    local = local_alert_word_automatons.pop(realm.id, None)
+    if local is None:
+        cached = cache.cache_get_many([version_key, automaton_key])
+    else:
+        cached = {}
+        cached_version = cache.cache_get(version_key)
+        if cached_version is not None:
+            cached[version_key] = cached_version
+            if cached_version[0] != local[0]:
+                # Another process has built a newer automaton.
+                cached_automaton = cache.cache_get(automaton_key)
+                if cached_automaton is not None:
+                    cached[automaton_key] = cached_automaton
+
+    if version_key in cached:
+        version = cached[version_key][0]
+        if local is not None and local[0] == version:
+            alert_word_automaton = local[1]
+        elif automaton_key in cached and cached[automaton_key][0][0] == version:
+            alert_word_automaton = cached[automaton_key][0][1]
+        else:
+            alert_word_automaton = build_alert_word_automaton(realm)
+            cache.cache_set(automaton_key, (version, alert_word_automaton), timeout=3600 * 24)
+    else:
+        version = secrets.token_hex(8)
+        cache.cache_set(version_key, version, timeout=3600 * 24)
+        alert_word_automaton = build_alert_word_automaton(realm)
+        cache.cache_set(automaton_key, (version, alert_word_automaton), timeout=3600 * 24)
+
+    if len(local_alert_word_automatons) >= MAX_LOCAL_ALERT_WORD_AUTOMATONS:
+        del local_alert_word_automatons[next(iter(local_alert_word_automatons))]
+    local_alert_word_automatons[realm.id] = (version, alert_word_automaton)
+    return alert_word_automaton
+
+
 def user_alert_words(user_profile: UserProfile) -> list[str]:
     return list(AlertWord.objects.filter(user_profile=user_profile).values_list("word", flat=True))
 
@@ -2,11 +2,15 @@
 import hashlib
 import logging
 import os
+import pickle
+import random
 import re
 import secrets
 import sys
 import time
 import traceback
+import zlib
+from collections import defaultdict
 from collections.abc import Callable, Iterable, Sequence
 from functools import _lru_cache_wrapper, lru_cache, wraps
 from typing import TYPE_CHECKING, Any, Generic, TypeVar
@@ -17,10 +21,21 @@ from django.core.cache.backends.base import BaseCache
 from django.db.models import Q, QuerySet
 from typing_extensions import ParamSpec
 
+from zerver.lib.cache_stats import record_cache_counter, record_cache_request
+
 if TYPE_CHECKING:
     # These modules have to be imported for type annotations but
     # they cannot be imported at runtime due to cyclic dependency.
-    from zerver.models import Attachment, Message, MutedUser, Realm, Stream, SubMessage, UserProfile
+    from zerver.models import (
+        Attachment,
+        Message,
+        MutedUser,
+        Realm,
+        Stream,
+        SubMessage,
+        Subscription,
+        UserProfile,
+    )
 
 MEMCACHED_MAX_KEY_LENGTH = 250
 
@@ -32,6 +47,9 @@ logger = logging.getLogger()
 remote_cache_time_start = 0.0
 remote_cache_total_time = 0.0
 remote_cache_total_requests = 0
+remote_cache_hits = 0
+remote_cache_misses = 0
+coalesced_cache_misses = 0
 
 
 def get_remote_cache_time() -> float:
@@ -42,15 +60,78 @@ def get_remote_cache_requests() -> int:
     return remote_cache_total_requests
 
 
+def get_remote_cache_hits() -> int:
+    return remote_cache_hits
+
+
+def get_remote_cache_misses() -> int:
+    return remote_cache_misses
+
+
+def get_coalesced_cache_misses() -> int:
+    return coalesced_cache_misses
+
+
+def get_local_cache_hits() -> int:
+    return local_cache_hits
+
+
+def get_local_cache_misses() -> int:
+    return local_cache_misses
+
+
 def remote_cache_stats_start() -> None:
     global remote_cache_time_start
     remote_cache_time_start = time.time()
 
 
-def remote_cache_stats_finish() -> None:
+def remote_cache_stats_finish() -> float:
     global remote_cache_total_time, remote_cache_total_requests
+    duration = time.time() - remote_cache_time_start
     remote_cache_total_requests += 1
-    remote_cache_total_time += time.time() - remote_cache_time_start
+    remote_cache_total_time += duration
+    return duration
+
+
+def get_cache_key_family(key: str) -> str:
+    """The part of the key before the first colon, which names the
+    *_cache_key function that made it; a few keys without such a
+    prefix are lumped together."""
+    family = key.split(":", 1)[0]
+    if not re.fullmatch(r"[a-z_]+", family):
+        return "other"
+    return family
+
+
+# Measuring the size of a value means pickling it a second time, so
+# only one in this many sets is measured, and counted this many times.
+CACHE_SET_BYTES_SAMPLE_RATE = 100
+
+
+def record_cache_family_requests(
+    duration: float,
+    *,
+    hit_keys: Iterable[str] = (),
+    missed_keys: Iterable[str] = (),
+    set_items: dict[str, Any] | None = None,
+    deleted_keys: Iterable[str] = (),
+) -> None:
+    """Records a memcached request in the statistics for the family of
+    each of the final keys it involved; see zerver/lib/cache_stats.py."""
+    counts: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for key in hit_keys:
+        counts[get_cache_key_family(key.removeprefix(KEY_PREFIX))]["hits"] += 1
+    for key in missed_keys:
+        counts[get_cache_key_family(key.removeprefix(KEY_PREFIX))]["misses"] += 1
+    for key, val in (set_items or {}).items():
+        family_counts = counts[get_cache_key_family(key.removeprefix(KEY_PREFIX))]
+        family_counts["sets"] += 1
+        if random.randrange(CACHE_SET_BYTES_SAMPLE_RATE) == 0:
+            family_counts["set_bytes"] += CACHE_SET_BYTES_SAMPLE_RATE * len(pickle.dumps(val))
+    for key in deleted_keys:
+        counts[get_cache_key_family(key.removeprefix(KEY_PREFIX))]["deletes"] += 1
+    for family, family_counts in counts.items():
+        record_cache_request(family, duration, **family_counts)
 
 
 def get_or_create_key_prefix() -> str:
@@ -113,13 +194,19 @@ def cache_with_key(
     keyfunc: Callable[ParamT, str],
     cache_name: str | None = None,
     timeout: int | None = None,
+    *,
+    coalesce_misses: bool = False,
 ) -> Callable[[Callable[ParamT, ReturnT]], Callable[ParamT, ReturnT]]:
     """Decorator which applies Django caching to a function.
 
     Decorator argument is a function which computes a cache key
     from the original function's arguments.  You are responsible
     for avoiding collisions with other uses of this decorator or
-    other uses of caching."""
+    other uses of caching.
+
+    Use coalesce_misses for expensive functions whose keys are read
+    by many processes at once, and which are never called from
+    Tornado; see compute_coalesced_cache_miss."""
 
     def decorator(func: Callable[ParamT, ReturnT]) -> Callable[ParamT, ReturnT]:
         @wraps(func)
@@ -138,6 +225,11 @@ def cache_with_key(
             if val is not None:
                 return val[0]
 
+            if coalesce_misses:
+                return compute_coalesced_cache_miss(
+                    key, lambda: func(*args, **kwargs), cache_name, timeout
+                )
+
             val = func(*args, **kwargs)
             if isinstance(val, QuerySet):
                 logging.error(
@@ -145,7 +237,7 @@ def cache_with_key(
                     stack_info=True,
                 )
             else:
-                cache_set(key, val, cache_name=cache_name, timeout=timeout)
+                cache_set(key, val, cache_name=cache_name, timeout=timeout, fill=True)
 
             return val
 
@@ -154,6 +246,80 @@ def cache_with_key(
     return decorator
 
 
+# How long a process may hold the lock for recomputing a missing
+# value, and how long other processes wait for it to finish.
+CACHE_MISS_LOCK_TIMEOUT = 10
+CACHE_MISS_WAIT_TRIES = 20
+CACHE_MISS_WAIT_INTERVAL = 0.05
+
+
+def cache_miss_lock_cache_key(key: str) -> str:
+    return f"cache_miss_lock:{key}"
+
+
+def compute_coalesced_cache_miss(
+    key: str,
+    compute: Callable[[], ReturnT],
+    cache_name: str | None,
+    timeout: int | None,
+) -> ReturnT:
+    """Computes a value missing from the cache in only one process at a
+    time, so that flushing a popular key does not have every process
+    which reads it run the same expensive query at once.
+
+    The process which gets the lock computes the value and stores it.
+    The others wait a little for the new value, before giving up and
+    computing it themselves.  They only return a value stored after
+    they found the key missing, never the value which was flushed,
+    since callers rely on a flush making the next read fresh; e.g., a
+    user who was just deactivated must not receive events sent to a
+    stale list of active users.  The lock expires, in case its holder
+    dies.
+
+    If the key is flushed again while the lock holder is computing the
+    value, the holder may store, and waiters return, a value computed
+    from data read before that second flush.  This is the same race
+    that every cache fill has with a concurrent flush, and lasts only
+    until the next flush of the key.
+
+    Waiting blocks the process, so this must never be called from
+    Tornado, whose IO loop would stall; functions which use
+    coalesce_misses must not be reachable from it."""
+    global coalesced_cache_misses
+    assert not settings.RUNNING_INSIDE_TORNADO
+    cache_backend = get_cache_backend(cache_name)
+    lock_key = KEY_PREFIX + cache_miss_lock_cache_key(key)
+    validate_cache_key(lock_key)
+
+    remote_cache_stats_start()
+    got_lock = cache_backend.add(lock_key, True, timeout=CACHE_MISS_LOCK_TIMEOUT)
+    remote_cache_stats_finish()
+
+    if not got_lock:
+        for _ in range(CACHE_MISS_WAIT_TRIES):
+            time.sleep(CACHE_MISS_WAIT_INTERVAL)
+            remote_cache_stats_start()
+            val = cache_backend.get(KEY_PREFIX + key)
+            remote_cache_stats_finish()
+            if val is not None:
+                coalesced_cache_misses += 1
+                record_cache_counter("coalesced_miss", "waited")
+                return val[0]
+        record_cache_counter("coalesced_miss", "timed_out")
+    else:
+        record_cache_counter("coalesced_miss", "computed")
+
+    try:
+        val = compute()
+        cache_set(key, val, cache_name=cache_name, timeout=timeout, fill=True)
+    finally:
+        if got_lock:
+            remote_cache_stats_start()
+            cache_backend.delete(lock_key)
+            remote_cache_stats_finish()
+    return val
+
+
 class InvalidCacheKeyError(Exception):
     pass
 
@@ -184,8 +350,148 @@ def validate_cache_key(key: str) -> None:
         raise InvalidCacheKeyError(f"Cache key too long: {key} Length: {len(key)}")
 
 
+# Keys in these families (the part of the key before the first
+# colon) are hot enough that a memcached round trip for each use adds
+# up, so if settings.LOCAL_CACHE_SIZE is set, each process also keeps
+# copies of them, for at most the given number of seconds.
+#
+# Each family's keys are split into LOCAL_CACHE_VERSION_BUCKETS
+# buckets, each with a version key in memcached.  Changing or deleting
+# a key deletes its bucket's version key as well; filling a key after
+# a miss does not, since no process can have a copy of an older value
+# which was not deleted.  A process checks all of the versions, with
+# a single round trip, the first time it uses its local cache in each
+# request (see expire_local_cache_versions), and again whenever they
+# are more than LOCAL_CACHE_VERSION_MAX_AGE seconds old, for the sake
+# of long-running loops which are not split into requests.  It ignores
+# copies made under an older version; so copies are never staler than
+# a memcached read at the start of the request, or a second ago, and a
+# change only discards other processes' copies of the keys in its
+# bucket.
+LOCAL_CACHE_KEY_FAMILIES: dict[str, int] = {
+    "display_recipient_dict": 300,
+    "realm_user_dicts": 300,
+    "user_profile_by_id": 300,
+}
+LOCAL_CACHE_VERSION_BUCKETS = 32
+LOCAL_CACHE_VERSION_MAX_AGE = 1
+
+# Final key => (expiry time, family version, pickled value), in
+# least-recently-used order.  Values are stored pickled, so that
+# callers get their own copy of them, as they do from memcached.
+local_cache: dict[str, tuple[float, str, bytes]] = {}
+local_cache_versions: dict[str, str] = {}
+local_cache_versions_fetched_at = 0.0
+local_cache_hits = 0
+local_cache_misses = 0
+
+
+def local_cache_version_cache_key(family: str, bucket: int) -> str:
+    return f"local_cache_version:{family}:{bucket}"
+
+
+def get_local_cache_version_key(key: str, family: str) -> str:
+    bucket = zlib.crc32(key.encode()) % LOCAL_CACHE_VERSION_BUCKETS
+    return local_cache_version_cache_key(family, bucket)
+
+
+def get_local_cache_family(key: str, cache_name: str | None) -> str | None:
+    if settings.LOCAL_CACHE_SIZE == 0 or cache_name is not None:
+        return None
+    family = get_cache_key_family(key)
+    if family not in LOCAL_CACHE_KEY_FAMILIES:
+        return None
+    return family
+
+
+def expire_local_cache_versions() -> None:
+    """Called at the end of every request and queue event, so that the
+    next one checks the family versions again before using the local
+    cache."""
+    local_cache_versions.clear()
+
+
+def get_local_cache_versions() -> dict[str, str]:
+    global local_cache_versions_fetched_at
+    now = time.monotonic()
+    if (
+        local_cache_versions
+        and now - local_cache_versions_fetched_at < LOCAL_CACHE_VERSION_MAX_AGE
+    ):
+        return local_cache_versions
+
+    version_keys = {
+        KEY_PREFIX + local_cache_version_cache_key(family, bucket): family
+        for family in LOCAL_CACHE_KEY_FAMILIES
+        for bucket in range(LOCAL_CACHE_VERSION_BUCKETS)
+    }
+    cache_backend = get_cache_backend(None)
+    remote_cache_stats_start()
+    versions = cache_backend.get_many(list(version_keys))
+    remote_cache_stats_finish()
+
+    new_versions = {key: secrets.token_hex(8) for key in version_keys if key not in versions}
+    if new_versions:
+        remote_cache_stats_start()
+        cache_backend.set_many(new_versions)
+        remote_cache_stats_finish()
+        versions.update(new_versions)
+
+    for key in version_keys:
+        local_cache_versions[key.removeprefix(KEY_PREFIX)] = versions[key]
+    local_cache_versions_fetched_at = now
+    return local_cache_versions
+
+
+def local_cache_get(final_key: str, version: str) -> Any:
+    global local_cache_hits, local_cache_misses
+    entry = local_cache.pop(final_key, None)
+    if entry is not None:
+        expiry_time, entry_version, pickled_value = entry
+        if entry_version == version and time.monotonic() < expiry_time:
+            local_cache[final_key] = entry
+            local_cache_hits += 1
+            record_cache_counter("local", "hit")
+            return pickle.loads(pickled_value)  # noqa: S301
+    local_cache_misses += 1
+    record_cache_counter("local", "miss")
+    return None
+
+
+def local_cache_set(final_key: str, family: str, version: str, val: Any) -> None:
+    local_cache.pop(final_key, None)
+    local_cache[final_key] = (
+        time.monotonic() + LOCAL_CACHE_KEY_FAMILIES[family],
+        version,
+        pickle.dumps(val),
+    )
+    while len(local_cache) > settings.LOCAL_CACHE_SIZE:
+        del local_cache[next(iter(local_cache))]
+
+
+def drop_local_cache_copies(keys: Iterable[str], cache_name: str | None) -> list[str]:
+    """Drops this process's copies of keys which are being written or
+    deleted, and returns the version keys which must be deleted along
+    with them so that other processes drop theirs."""
+    version_keys: dict[str, None] = {}
+    for key in keys:
+        family = get_local_cache_family(key, cache_name)
+        if family is not None:
+            local_cache.pop(KEY_PREFIX + key, None)
+            version_keys[KEY_PREFIX + get_local_cache_version_key(key, family)] = None
+    return list(version_keys)
+
+
+# Pass fill=True when storing a value just computed after a miss,
+# rather than one which changed; other processes' local copies of the
+# key are then left alone.
 def cache_set(
-    key: str, val: Any, cache_name: str | None = None, timeout: int | None = None
+    key: str,
+    val: Any,
+    cache_name: str | None = None,
+    timeout: int | None = None,
+    *,
+    fill: bool = False,
 ) -> None:
     final_key = KEY_PREFIX + key
     validate_cache_key(final_key)
@@ -193,27 +499,85 @@ def cache_set(
     remote_cache_stats_start()
     cache_backend = get_cache_backend(cache_name)
     cache_backend.set(final_key, (val,), timeout=timeout)
-    remote_cache_stats_finish()
+    duration = remote_cache_stats_finish()
+    record_cache_family_requests(duration, set_items={final_key: (val,)})
+
+    version_keys = drop_local_cache_copies([key], cache_name)
+    if version_keys and not fill:
+        remote_cache_stats_start()
+        cache_backend.delete_many(version_keys)
+        remote_cache_stats_finish()
 
 
 def cache_get(key: str, cache_name: str | None = None) -> Any:
+    global remote_cache_hits, remote_cache_misses
     final_key = KEY_PREFIX + key
     validate_cache_key(final_key)
 
+    family = get_local_cache_family(key, cache_name)
+    if family is not None:
+        # The version must be fetched before the value.
+        version = get_local_cache_versions()[get_local_cache_version_key(key, family)]
+        ret = local_cache_get(final_key, version)
+        if ret is not None:
+            return ret
+
     remote_cache_stats_start()
     cache_backend = get_cache_backend(cache_name)
     ret = cache_backend.get(final_key)
-    remote_cache_stats_finish()
+    duration = remote_cache_stats_finish()
+
+    if ret is None:
+        remote_cache_misses += 1
+        record_cache_family_requests(duration, missed_keys=[final_key])
+    else:
+        remote_cache_hits += 1
+        record_cache_family_requests(duration, hit_keys=[final_key])
+        if family is not None:
+            local_cache_set(final_key, family, version, ret)
     return ret
 
 
 def cache_get_many(keys: list[str], cache_name: str | None = None) -> dict[str, Any]:
+    global remote_cache_hits, remote_cache_misses
     keys = [KEY_PREFIX + key for key in keys]
     for key in keys:
         validate_cache_key(key)
-    remote_cache_stats_start()
-    ret = get_cache_backend(cache_name).get_many(keys)
-    remote_cache_stats_finish()
+
+    ret: dict[str, Any] = {}
+    # Final key => (family, version), for keys we may copy locally.
+    local_keys: dict[str, tuple[str, str]] = {}
+    remote_keys = keys
+    if settings.LOCAL_CACHE_SIZE != 0 and cache_name is None:
+        remote_keys = []
+        for key in keys:
+            family = get_local_cache_family(key.removeprefix(KEY_PREFIX), cache_name)
+            if family is not None:
+                version_key = get_local_cache_version_key(key.removeprefix(KEY_PREFIX), family)
+                version = get_local_cache_versions()[version_key]
+                val = local_cache_get(key, version)
+                if val is not None:
+                    ret[key] = val
+                    continue
+                local_keys[key] = (family, version)
+            remote_keys.append(key)
+
+    # We only skip memcached if every key was found locally.
+    if remote_keys or not keys:
+        remote_cache_stats_start()
+        remote_ret = get_cache_backend(cache_name).get_many(remote_keys)
+        duration = remote_cache_stats_finish()
+        remote_cache_hits += len(remote_ret)
+        remote_cache_misses += len(remote_keys) - len(remote_ret)
+        record_cache_family_requests(
+            duration,
+            hit_keys=remote_ret.keys(),
+            missed_keys=[key for key in remote_keys if key not in remote_ret],
+        )
+        for key, val in remote_ret.items():
+            if key in local_keys:
+                local_cache_set(key, *local_keys[key], val)
+        ret.update(remote_ret)
     return {key.removeprefix(KEY_PREFIX): value for key, value in ret.items()}
 
 
@@ -235,21 +599,37 @@ def safe_cache_get_many(keys: list[str], cache_name: str | None = None) -> dict[
 
 
 def cache_set_many(
-    items: dict[str, Any], cache_name: str | None = None, timeout: int | None = None
+    items: dict[str, Any],
+    cache_name: str | None = None,
+    timeout: int | None = None,
+    *,
+    fill: bool = False,
 ) -> None:
     new_items = {}
     for key in items:
         new_key = KEY_PREFIX + key
         validate_cache_key(new_key)
         new_items[new_key] = items[key]
+    version_keys = drop_local_cache_copies(items.keys(), cache_name)
     items = new_items
     remote_cache_stats_start()
-    get_cache_backend(cache_name).set_many(items, timeout=timeout)
-    remote_cache_stats_finish()
+    cache_backend = get_cache_backend(cache_name)
+    cache_backend.set_many(items, timeout=timeout)
+    duration = remote_cache_stats_finish()
+    record_cache_family_requests(duration, set_items=items)
+
+    if version_keys and not fill:
+        remote_cache_stats_start()
+        cache_backend.delete_many(version_keys)
+        remote_cache_stats_finish()
 
 
 def safe_cache_set_many(
-    items: dict[str, Any], cache_name: str | None = None, timeout: int | None = None
+    items: dict[str, Any],
+    cache_name: str | None = None,
+    timeout: int | None = None,
+    *,
+    fill: bool = False,
 ) -> None:
     """Variant of cache_set_many that drops saving any keys that fail
     validation, rather than throwing an exception visible to the
@@ -258,7 +638,7 @@ def safe_cache_set_many(
         # Almost always the keys will all be correct, so we just try
         # to do normal cache_set_many to avoid the overhead of
         # validating all the keys here.
-        return cache_set_many(items, cache_name, timeout)
+        return cache_set_many(items, cache_name, timeout, fill=fill)
     except InvalidCacheKeyError:
         stack_trace = traceback.format_exc()
 
@@ -266,25 +646,33 @@ def safe_cache_set_many(
         log_invalid_cache_keys(stack_trace, bad_keys)
 
         good_items = {key: items[key] for key in good_keys}
-        return cache_set_many(good_items, cache_name, timeout)
+        return cache_set_many(good_items, cache_name, timeout, fill=fill)
 
 
 def cache_delete(key: str, cache_name: str | None = None) -> None:
     final_key = KEY_PREFIX + key
     validate_cache_key(final_key)
 
+    version_keys = drop_local_cache_copies([key], cache_name)
     remote_cache_stats_start()
-    get_cache_backend(cache_name).delete(final_key)
-    remote_cache_stats_finish()
+    if version_keys:
+        get_cache_backend(cache_name).delete_many([final_key, *version_keys])
+    else:
+        get_cache_backend(cache_name).delete(final_key)
+    duration = remote_cache_stats_finish()
+    record_cache_family_requests(duration, deleted_keys=[final_key])
 
 
 def cache_delete_many(items: Iterable[str], cache_name: str | None = None) -> None:
+    items = list(items)
     keys = [KEY_PREFIX + item for item in items]
     for key in keys:
         validate_cache_key(key)
+    version_keys = drop_local_cache_copies(items, cache_name)
     remote_cache_stats_start()
-    get_cache_backend(cache_name).delete_many(keys)
-    remote_cache_stats_finish()
+    get_cache_backend(cache_name).delete_many([*keys, *version_keys])
+    duration = remote_cache_stats_finish()
+    record_cache_family_requests(duration, deleted_keys=keys)
 
 
 def filter_good_and_bad_keys(keys: list[str]) -> tuple[list[str], list[str]]:
@@ -371,7 +759,7 @@ def generic_bulk_cached_fetch(
         items_for_remote_cache[key] = (setter(item),)
         cached_objects[key] = item
     if len(items_for_remote_cache) > 0:
-        safe_cache_set_many(items_for_remote_cache)
+        safe_cache_set_many(items_for_remote_cache, fill=True)
     return {
         object_id: cached_objects[cache_keys[object_id]]
         for object_id in object_ids
@@ -535,6 +923,53 @@ def delete_display_recipient_cache(user_profile: "UserProfile") -> None:
     cache_delete_many(keys)
 
 
+def stream_recipient_info_cache_key(recipient_id: int) -> str:
+    return f"stream_recipient_info:{recipient_id}"
+
+
+def stream_recipient_info_version_cache_key(realm_id: int) -> str:
+    return f"stream_recipient_info_version:{realm_id}"
+
+
+# The UserProfile fields included in the stream_recipient_info cache.
+stream_recipient_info_user_fields = [
+    "bot_type",
+    "enable_followed_topic_email_notifications",
+    "enable_followed_topic_push_notifications",
+    "enable_followed_topic_wildcard_mentions_notify",
+    "enable_offline_email_notifications",
+    "enable_offline_push_notifications",
+    "enable_online_push_notifications",
+    "enable_stream_email_notifications",
+    "enable_stream_push_notifications",
+    "is_active",
+    "is_bot",
+    "long_term_idle",
+    "wildcard_mentions_notify",
+]
+
+
+def delete_stream_recipient_info_caches(recipient_ids: Iterable[int]) -> None:
+    cache_delete_many(
+        stream_recipient_info_cache_key(recipient_id) for recipient_id in recipient_ids
+    )
+
+
+def bump_stream_recipient_info_version(realm_id: int) -> None:
+    """Invalidates the stream_recipient_info caches for every stream in
+    the realm, for changes to a user which might affect any of the
+    streams they are subscribed to, without having to look up which
+    those are."""
+    cache_delete(stream_recipient_info_version_cache_key(realm_id))
+
+
+# Called by models/streams.py to flush the stream_recipient_info cache
+# whenever we save or delete a Subscription object.  Bulk changes to
+# subscriptions call delete_stream_recipient_info_caches directly.
+def flush_subscription(*, instance: "Subscription", **kwargs: object) -> None:
+    cache_delete(stream_recipient_info_cache_key(instance.recipient_id))
+
+
 def changed(update_fields: Sequence[str] | None, fields: list[str]) -> bool:
     if update_fields is None:
         # adds/deletes should invalidate the cache
@@ -570,6 +1005,10 @@ def flush_user_profile(
     if changed(update_fields, ["email", "full_name", "id", "is_mirror_dummy"]):
         delete_display_recipient_cache(user_profile)
 
+    # New users have no subscriptions yet.
+    if not kwargs.get("created") and changed(update_fields, stream_recipient_info_user_fields):
+        bump_stream_recipient_info_version(user_profile.realm_id)
+
     # Invalidate our bots_in_realm info dict if any bot has
     # changed the fields in the dict or become (in)active
     if user_profile.is_bot and changed(update_fields, bot_dict_fields):
@@ -605,6 +1044,7 @@ def flush_realm(
         cache_delete(bot_dicts_in_realm_cache_key(realm.id))
         cache_delete(realm_alert_words_cache_key(realm.id))
         cache_delete(realm_alert_words_automaton_cache_key(realm.id))
+        cache_delete(realm_alert_words_version_cache_key(realm.id))
         cache_delete(active_non_guest_user_ids_cache_key(realm.id))
         cache_delete(realm_rendered_description_cache_key(realm))
         cache_delete(realm_text_description_cache_key(realm))
@@ -621,6 +1061,10 @@ def realm_alert_words_automaton_cache_key(realm_id: int) -> str:
     return f"realm_alert_words_automaton:{realm_id}"
 
 
+def realm_alert_words_version_cache_key(realm_id: int) -> str:
+    return f"realm_alert_words_version:{realm_id}"
+
+
 def realm_rendered_description_cache_key(realm: "Realm") -> str:
     return f"realm_rendered_description:{realm.string_id}"
 
@@ -662,8 +1106,15 @@ def flush_used_upload_space_cache(
         cache_delete(get_realm_used_upload_space_cache_key(attachment.owner.realm_id))
 
 
+# The encoding of cached message dicts; see zerver/lib/message_cache.py.
+# It is part of the key, so that values in an older encoding, which a
+# development environment's cache can hold across upgrades, are never
+# read.
+MESSAGE_CACHE_FORMAT_VERSION = 1
+
+
 def to_dict_cache_key_id(message_id: int) -> str:
-    return f"message_dict:{message_id}"
+    return f"message_dict:v{MESSAGE_CACHE_FORMAT_VERSION}:{message_id}"
 
 
 def to_dict_cache_key(message: "Message", realm_id: int | None = None) -> str:
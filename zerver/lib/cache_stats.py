@@ -0,0 +1,156 @@
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import redis
+
+from zerver.lib.redis_utils import get_redis_client
+from zerver.lib.stage_timing import STAGE_TIME_BUCKET_LABELS, StageHistogram
+
+# Statistics on our use of memcached for each family of cache keys,
+# named by the part of a key before its first colon, which is unique
+# to the *_cache_key function which made it (see
+# get_cache_key_family in zerver/lib/cache.py).  Like stage timings,
+# each process accumulates them and adds them to totals in Redis,
+# which are shown by `manage.py cache_stats` and exported by
+# /api/internal/metrics.
+#
+# Caches other than memcached, such as the per-process local cache and
+# per-request memoization, only count events (e.g. hits and misses),
+# by the name of the cache; those counters are flushed along with the
+# memcached statistics.
+
+CACHE_STATS_FLUSH_INTERVAL = 10
+CACHE_STATS_REDIS_KEY = "zulip:cache_stats"
+CACHE_COUNTERS_REDIS_KEY = "zulip:cache_counters"
+
+# Cleared by Tornado, like stage_timing.flush_inline.
+flush_inline = True
+
+redis_client = get_redis_client()
+
+
+@dataclass
+class CacheFamilyStats:
+    hits: int = 0
+    misses: int = 0
+    sets: int = 0
+    set_bytes: int = 0
+    deletes: int = 0
+    # Of the memcached requests involving keys in the family.
+    latency: StageHistogram = field(default_factory=StageHistogram)
+
+    def unexplained_misses(self) -> int:
+        """Misses beyond the one expected after each delete, which
+        are a sign of keys being evicted or expiring before use."""
+        return max(0, self.misses - self.deletes)
+
+
+unflushed_cache_stats: dict[str, CacheFamilyStats] = defaultdict(CacheFamilyStats)
+unflushed_cache_counters: dict[tuple[str, str], int] = defaultdict(int)
+last_flush_time = time.monotonic()
+
+
+def record_cache_request(
+    family: str,
+    duration: float,
+    *,
+    hits: int = 0,
+    misses: int = 0,
+    sets: int = 0,
+    set_bytes: int = 0,
+    deletes: int = 0,
+) -> None:
+    stats = unflushed_cache_stats[family]
+    stats.hits += hits
+    stats.misses += misses
+    stats.sets += sets
+    stats.set_bytes += set_bytes
+    stats.deletes += deletes
+    stats.latency.observe(duration)
+    if flush_inline and time.monotonic() - last_flush_time >= CACHE_STATS_FLUSH_INTERVAL:
+        flush_cache_stats()
+
+
+def record_cache_counter(cache: str, event: str, count: int = 1) -> None:
+    unflushed_cache_counters[cache, event] += count
+    if flush_inline and time.monotonic() - last_flush_time >= CACHE_STATS_FLUSH_INTERVAL:
+        flush_cache_stats()
+
+
+def flush_cache_stats() -> None:
+    global last_flush_time
+    last_flush_time = time.monotonic()
+    all_stats = dict(unflushed_cache_stats)
+    unflushed_cache_stats.clear()
+    counters = dict(unflushed_cache_counters)
+    unflushed_cache_counters.clear()
+    if not all_stats and not counters:
+        return
+
+    try:
+        with redis_client.pipeline(transaction=False) as pipeline:
+            for family, stats in all_stats.items():
+                for name, count in [
+                    ("hits", stats.hits),
+                    ("misses", stats.misses),
+                    ("sets", stats.sets),
+                    ("set_bytes", stats.set_bytes),
+                    ("deletes", stats.deletes),
+                ]:
+                    if count:
+                        pipeline.hincrby(CACHE_STATS_REDIS_KEY, f"{family}:{name}", count)
+                for label, count in zip(
+                    STAGE_TIME_BUCKET_LABELS, stats.latency.bucket_counts, strict=True
+                ):
+                    if count:
+                        pipeline.hincrby(
+                            CACHE_STATS_REDIS_KEY, f"{family}:latency_bucket:{label}", count
+                        )
+                pipeline.hincrby(
+                    CACHE_STATS_REDIS_KEY, f"{family}:latency_count", stats.latency.count
+                )
+                pipeline.hincrbyfloat(
+                    CACHE_STATS_REDIS_KEY, f"{family}:latency_sum", stats.latency.total_time
+                )
+            for (cache, event), count in counters.items():
+                pipeline.hincrby(CACHE_COUNTERS_REDIS_KEY, f"{cache}:{event}", count)
+            pipeline.execute()
+    except redis.RedisError:
+        # Losing some statistics is better than failing the cache
+        # request which triggered the flush.
+        logging.warning("Failed to flush cache statistics to Redis", exc_info=True)
+
+
+def get_cache_stats() -> dict[str, CacheFamilyStats]:
+    """The statistics for every process, as of each process's last
+    flush."""
+    all_stats: dict[str, CacheFamilyStats] = defaultdict(CacheFamilyStats)
+    for key, value in redis_client.hgetall(CACHE_STATS_REDIS_KEY).items():
+        family, name, *label = key.decode().split(":")
+        stats = all_stats[family]
+        if name == "latency_bucket":
+            stats.latency.bucket_counts[STAGE_TIME_BUCKET_LABELS.index(label[0])] = int(value)
+        elif name == "latency_count":
+            stats.latency.count = int(value)
+        elif name == "latency_sum":
+            stats.latency.total_time = float(value)
+        else:
+            setattr(stats, name, int(value))
+    return dict(all_stats)
+
+
+def get_cache_counters() -> dict[tuple[str, str], int]:
+    """The counters of events in each cache other than memcached, by
+    cache and event, for every process, as of each process's last
+    flush."""
+    counters: dict[tuple[str, str], int] = {}
+    for key, value in redis_client.hgetall(CACHE_COUNTERS_REDIS_KEY).items():
+        cache, event = key.decode().rsplit(":", 1)
+        counters[cache, event] = int(value)
+    return counters
+
+
+def reset_cache_stats() -> None:
+    redis_client.delete(CACHE_STATS_REDIS_KEY, CACHE_COUNTERS_REDIS_KEY)
@@ -11,9 +11,10 @@ from typing_extensions import override
 
 from zerver.actions.message_send import (
     check_send_message,
+    do_send_messages,
+    internal_prep_stream_message,
     internal_send_group_direct_message,
     internal_send_private_message,
-    internal_send_stream_message,
 )
 from zerver.lib.display_recipient import get_display_recipient
 from zerver.lib.email_mirror_helpers import (
@@ -24,7 +25,12 @@ from zerver.lib.email_mirror_helpers import (
 )
 from zerver.lib.email_notifications import convert_html_to_markdown
 from zerver.lib.exceptions import JsonableError, RateLimitedError
-from zerver.lib.message import normalize_body, truncate_content, truncate_topic
+from zerver.lib.message import (
+    SendMessageRequest,
+    normalize_body,
+    truncate_content,
+    truncate_topic,
+)
 from zerver.lib.queue import queue_json_publish_rollback_unsafe
 from zerver.lib.rate_limiter import RateLimitedObject
 from zerver.lib.send_email import FromAddress
@@ -199,8 +205,10 @@ def construct_zulip_body(
 ## Sending the Zulip ##
 
 
-def send_zulip(sender: UserProfile, stream: Stream, topic_name: str, content: str) -> None:
-    internal_send_stream_message(
+def prep_zulip(
+    sender: UserProfile, stream: Stream, topic_name: str, content: str
+) -> SendMessageRequest | None:
+    return internal_prep_stream_message(
         sender,
         stream,
         truncate_topic(topic_name),
@@ -422,7 +430,7 @@ def is_forwarded(subject: str) -> bool:
     return bool(re.match(reg, subject, flags=re.IGNORECASE))
 
 
-def process_stream_message(to: str, message: EmailMessage) -> None:
+def prep_stream_message(to: str, message: EmailMessage) -> SendMessageRequest | None:
     subject_header = message.get("Subject", "")
 
     subject = strip_from_subject(subject_header)
@@ -449,15 +457,27 @@ def process_stream_message(to: str, message: EmailMessage) -> None:
         logger.info(
             "Failed to process email to %s (%s): %s", stream.name, stream.realm.string_id, e
         )
-        return
+        return None
 
     body = construct_zulip_body(message, stream.realm, sender=user_profile, **options)
-    send_zulip(user_profile, stream, subject, body)
-    logger.info(
-        "Successfully processed email to %s (%s)",
-        stream.name,
-        stream.realm.string_id,
-    )
+    return prep_zulip(user_profile, stream, subject, body)
+
+
+def send_stream_messages(send_requests: list[SendMessageRequest]) -> None:
+    do_send_messages(send_requests)
+    for send_request in send_requests:
+        assert send_request.stream is not None
+        logger.info(
+            "Successfully processed email to %s (%s)",
+            send_request.stream.name,
+            send_request.stream.realm.string_id,
+        )
+
+
+def process_stream_message(to: str, message: EmailMessage) -> None:
+    send_request = prep_stream_message(to, message)
+    if send_request is not None:
+        send_stream_messages([send_request])
 
 
 def process_missed_message(to: str, message: EmailMessage) -> None:
@@ -524,6 +544,25 @@ def process_message(message: EmailMessage, rcpt_to: str | None = None) -> None:
         log_error(message, e.args[0], to)
 
 
+def prep_message(message: EmailMessage, rcpt_to: str) -> SendMessageRequest | None:
+    """Mirrors an email to a missed-message address right away; for an
+    email to a channel address, returns the request to send it with,
+    which the caller passes to send_stream_messages, possibly together
+    with others.  Expected errors in the email are logged, with None
+    returned."""
+    if is_missed_message_address(rcpt_to):
+        process_message(message, rcpt_to=rcpt_to)
+        return None
+
+    try:
+        return prep_stream_message(rcpt_to, message)
+    except ZulipEmailForwardUserError as e:
+        logger.info(e.args[0])
+    except ZulipEmailForwardError as e:
+        log_error(message, e.args[0], rcpt_to)
+    return None
+
+
 def validate_to_address(rcpt_to: str) -> None:
     if is_missed_message_address(rcpt_to):
         get_usable_missed_message_address(rcpt_to)
@@ -47,7 +47,10 @@ from zerver.lib.presence import get_presence_for_user, get_presences_for_realm
 from zerver.lib.realm_icon import realm_icon_url
 from zerver.lib.realm_logo import get_realm_logo_source, get_realm_logo_url
 from zerver.lib.scheduled_messages import get_undelivered_scheduled_messages
-from zerver.lib.soft_deactivation import reactivate_user_if_soft_deactivated
+from zerver.lib.soft_deactivation import (
+    add_missing_deferred_messages,
+    reactivate_user_if_soft_deactivated,
+)
 from zerver.lib.sounds import get_available_notification_sounds
 from zerver.lib.stream_subscription import handle_stream_notifications_compatibility
 from zerver.lib.streams import do_get_streams, get_web_public_streams
@@ -1827,6 +1830,8 @@ def do_events_register(
 
     # Fill up the UserMessage rows if a soft-deactivated user has returned
     reactivate_user_if_soft_deactivated(user_profile)
+    # ... and likewise for messages in channels which defer them.
+    add_missing_deferred_messages(user_profile)
 
     legacy_narrow = [[nt.operator, nt.operand] for nt in narrow]
 
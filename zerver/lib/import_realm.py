@@ -57,7 +57,7 @@ from zerver.lib.upload import ensure_avatar_image, sanitize_name, upload_backend
 from zerver.lib.upload.s3 import get_bucket
 from zerver.lib.user_counts import realm_user_count_by_role
 from zerver.lib.user_groups import create_system_user_groups_for_realm
-from zerver.lib.user_message import UserMessageLite, bulk_insert_ums
+from zerver.lib.user_message import bulk_copy_ums
 from zerver.lib.utils import generate_api_key, process_list_in_batches
 from zerver.lib.zulip_update_announcements import send_zulip_update_announcements_to_realm
 from zerver.models import (
@@ -745,15 +745,9 @@ def bulk_import_user_message_data(data: TableData, dump_file_id: int) -> None:
     # so we can safely avoid all re-mapping complexity.
 
     def process_batch(items: list[dict[str, Any]]) -> None:
-        ums = [
-            UserMessageLite(
-                user_profile_id=item["user_profile_id"],
-                message_id=item["message_id"],
-                flags=item["flags"],
-            )
-            for item in items
-        ]
-        bulk_insert_ums(ums)
+        bulk_copy_ums(
+            (item["user_profile_id"], item["message_id"], item["flags"]) for item in items
+        )
 
     chunk_size = 10000
 
@@ -16,6 +16,7 @@ from typing_extensions import override
 
 from zerver.lib.context_managers import lockfile_nonblocking
 from zerver.lib.initial_password import initial_password
+from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.models import Client, Realm, UserProfile
 from zerver.models.clients import get_client
 
@@ -94,7 +95,10 @@ class ZulipBaseCommand(BaseCommand):
 
             # This deactivates Sentry
             sentry_sdk.init()
-        super().execute(*args, **options)
+        try:
+            super().execute(*args, **options)
+        finally:
+            flush_per_request_caches()
 
     def add_realm_args(
         self, parser: ArgumentParser, *, required: bool = False, help: str | None = None
@@ -51,6 +51,7 @@ from zerver.lib.mention import (
     FullNameInfo,
     MentionBackend,
     MentionData,
+    possible_syntax,
 )
 from zerver.lib.outgoing_http import OutgoingSession
 from zerver.lib.subdomains import is_static_or_current_realm_url
@@ -1589,7 +1590,7 @@ class Emoji(markdown.inlinepatterns.Pattern):
 
 
 def content_has_emoji_syntax(content: str) -> bool:
-    return re.search(EMOJI_REGEX, content) is not None
+    return possible_syntax(content).has_emoji_syntax
 
 
 class Tex(markdown.inlinepatterns.Pattern):
@@ -2090,13 +2091,7 @@ class StreamTopicMessagePattern(StreamTopicMessageProcessor):
 
 
 def possible_linked_stream_names(content: str) -> set[str]:
-    return {
-        *re.findall(STREAM_LINK_REGEX, content, re.VERBOSE),
-        *(
-            match.group("stream_name")
-            for match in re.finditer(STREAM_TOPIC_LINK_REGEX, content, re.VERBOSE)
-        ),
-    }
+    return possible_syntax(content).stream_names
 
 
 class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
@@ -2715,10 +2710,14 @@ def do_convert(
                 message_sender = message.sender
             mention_data = MentionData(mention_backend, content, message_sender)
 
-        stream_names = possible_linked_stream_names(content)
-        stream_name_info = mention_data.get_stream_name_map(stream_names)
+        # MentionData has usually already scanned this content.
+        if mention_data.content == content:
+            content_syntax = mention_data.possible_syntax
+        else:
+            content_syntax = possible_syntax(content)
+        stream_name_info = mention_data.get_stream_name_map(content_syntax.stream_names)
 
-        if content_has_emoji_syntax(content):
+        if content_syntax.has_emoji_syntax:
             active_realm_emoji = get_name_keyed_dict_for_active_realm_emoji(message_realm.id)
         else:
             active_realm_emoji = {}
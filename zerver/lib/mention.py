@@ -21,6 +21,27 @@ USER_GROUP_MENTIONS_RE = re.compile(
     rf"{BEFORE_MENTION_ALLOWED_REGEX}@(?P<silent>_?)(\*(?P<match>[^\*]+)\*)"
 )
 
+# Finds, in one pass over the content, all the syntax whose rendering
+# needs data from the database: user mentions, user group mentions,
+# channel links (the Markdown processor's STREAM_LINK_REGEX and
+# STREAM_TOPIC_LINK_REGEX; the latter's channel name is the part of
+# the former's before the first ">") and emoji.  The lookahead
+# makes each match zero-width, so matches can overlap, and we find
+# everything that separate scans with each of those regexes would.
+CONTENT_SYNTAX_RE = re.compile(
+    rf"""
+    (?=
+        {BEFORE_MENTION_ALLOWED_REGEX}
+        (?:
+            @_?(?:\*\*(?P<mention>[^\*]+)\*\*|\*(?P<user_group>[^\*]+)\*)
+          | \#\*\*(?P<stream>[^\*]+)\*\*
+        )
+      | (?P<emoji>:[\w\-\+]+:)
+    )
+    """,
+    re.VERBOSE,
+)
+
 topic_wildcards = frozenset(["topic"])
 stream_wildcards = frozenset(["all", "everyone", "stream", "channel"])
 
@@ -62,6 +83,14 @@ class PossibleMentions:
     message_has_stream_wildcards: bool
 
 
+@dataclass
+class PossibleSyntax:
+    mentions: PossibleMentions
+    user_group_names: set[str]
+    stream_names: set[str]
+    has_emoji_syntax: bool
+
+
 class MentionBackend:
     # Be careful about reuse: MentionBackend contains caches which are
     # designed to only have the lifespan of a sender user (typically a
@@ -180,8 +209,8 @@ def user_mention_matches_stream_wildcard(mention: str) -> bool:
     return mention in stream_wildcards
 
 
-def extract_mention_text(m: Match[str]) -> MentionText:
-    text = m.group("match")
+def extract_mention_text(m: Match[str], group: str = "match") -> MentionText:
+    text = m.group(group)
     if text in topic_wildcards:
         return MentionText(text=None, is_topic_wildcard=True, is_stream_wildcard=False)
     if text in stream_wildcards:
@@ -189,29 +218,57 @@ def extract_mention_text(m: Match[str]) -> MentionText:
     return MentionText(text=text, is_topic_wildcard=False, is_stream_wildcard=False)
 
 
-def possible_mentions(content: str) -> PossibleMentions:
+def possible_syntax(content: str) -> PossibleSyntax:
+    """Everything in the content which might be rendered using data
+    from the database; this is a superset of what the Markdown
+    processor will find, since it doesn't know about code blocks,
+    escaping, etc.  MentionData computes this once per message, and
+    the Markdown processor reuses it."""
     # mention texts can either be names, or an extended name|id syntax.
     texts = set()
     message_has_topic_wildcards = False
     message_has_stream_wildcards = False
-    for m in MENTIONS_RE.finditer(content):
-        mention_text = extract_mention_text(m)
-        text = mention_text.text
-        if text:
-            texts.add(text)
-        if mention_text.is_topic_wildcard:
-            message_has_topic_wildcards = True
-        if mention_text.is_stream_wildcard:
-            message_has_stream_wildcards = True
-    return PossibleMentions(
-        mention_texts=texts,
-        message_has_topic_wildcards=message_has_topic_wildcards,
-        message_has_stream_wildcards=message_has_stream_wildcards,
+    user_group_names = set()
+    stream_names = set()
+    has_emoji_syntax = False
+    for m in CONTENT_SYNTAX_RE.finditer(content):
+        if m.group("mention") is not None:
+            mention_text = extract_mention_text(m, "mention")
+            text = mention_text.text
+            if text:
+                texts.add(text)
+            if mention_text.is_topic_wildcard:
+                message_has_topic_wildcards = True
+            if mention_text.is_stream_wildcard:
+                message_has_stream_wildcards = True
+        elif m.group("user_group") is not None:
+            user_group_names.add(m.group("user_group"))
+        elif m.group("stream") is not None:
+            stream_name = m.group("stream")
+            stream_names.add(stream_name)
+            channel_name, separator, topic_name = stream_name.partition(">")
+            if channel_name and topic_name:
+                stream_names.add(channel_name)
+        else:
+            has_emoji_syntax = True
+    return PossibleSyntax(
+        mentions=PossibleMentions(
+            mention_texts=texts,
+            message_has_topic_wildcards=message_has_topic_wildcards,
+            message_has_stream_wildcards=message_has_stream_wildcards,
+        ),
+        user_group_names=user_group_names,
+        stream_names=stream_names,
+        has_emoji_syntax=has_emoji_syntax,
     )
 
 
+def possible_mentions(content: str) -> PossibleMentions:
+    return possible_syntax(content).mentions
+
+
 def possible_user_group_mentions(content: str) -> set[str]:
-    return {m.group("match") for m in USER_GROUP_MENTIONS_RE.finditer(content)}
+    return possible_syntax(content).user_group_names
 
 
 def get_possible_mentions_info(
@@ -248,13 +305,17 @@ class MentionData:
     ) -> None:
         self.mention_backend = mention_backend
         realm_id = mention_backend.realm_id
-        mentions = possible_mentions(content)
+        self.content = content
+        self.possible_syntax = possible_syntax(content)
+        mentions = self.possible_syntax.mentions
         possible_mentions_info = get_possible_mentions_info(
             mention_backend, mentions.mention_texts, message_sender
         )
         self.full_name_info = {row.full_name.lower(): row for row in possible_mentions_info}
         self.user_id_info = {row.id: row for row in possible_mentions_info}
-        self.init_user_group_data(realm_id=realm_id, content=content)
+        self.init_user_group_data(
+            realm_id=realm_id, user_group_names=self.possible_syntax.user_group_names
+        )
         self.has_stream_wildcards = mentions.message_has_stream_wildcards
         self.has_topic_wildcards = mentions.message_has_topic_wildcards
 
@@ -264,10 +325,9 @@ class MentionData:
     def message_has_topic_wildcards(self) -> bool:
         return self.has_topic_wildcards
 
-    def init_user_group_data(self, realm_id: int, content: str) -> None:
+    def init_user_group_data(self, realm_id: int, user_group_names: set[str]) -> None:
         self.user_group_name_info: dict[str, NamedUserGroup] = {}
         self.user_group_members: dict[int, list[int]] = {}
-        user_group_names = possible_user_group_mentions(content)
         if user_group_names:
             # We are not directly doing 'prefetch_related("direct_members")'
             # because then we would have to filter out deactivated users
@@ -8,7 +8,13 @@ from typing import Any, TypedDict
 import orjson
 
 from zerver.lib.avatar import get_avatar_field, get_avatar_for_inaccessible_user
-from zerver.lib.cache import cache_set_many, cache_with_key, to_dict_cache_key, to_dict_cache_key_id
+from zerver.lib.cache import (
+    MESSAGE_CACHE_FORMAT_VERSION,
+    cache_set_many,
+    cache_with_key,
+    to_dict_cache_key,
+    to_dict_cache_key_id,
+)
 from zerver.lib.display_recipient import bulk_fetch_display_recipients
 from zerver.lib.markdown import render_message_markdown, topic_links
 from zerver.lib.markdown import version as markdown_version
@@ -65,12 +71,131 @@ def sew_messages_and_submessages(
             message["submessages"].append(submessage)
 
 
+# Message dicts are cached in a compact encoding: a version byte,
+# followed by a zlib stream, compressed with a preset dictionary of
+# strings common in message dicts, of a JSON array of the dict's
+# values.  The keys are implied by MESSAGE_CACHE_KEYS; the first
+# element of the array is a bitmask of which of those keys are
+# present, and the last is a dict of any keys not in the table.
+#
+# Changing MESSAGE_CACHE_KEYS or MESSAGE_CACHE_ZDICT changes the
+# meaning of existing cached values, and must come with a new
+# MESSAGE_CACHE_FORMAT_VERSION (in zerver/lib/cache.py), which is part
+# of the cache key; so values are never read by a different version of
+# the code than wrote them, and the version byte only catches
+# mistakes.
+#
+# See `manage.py benchmark_message_cache_encoding` for the size and
+# speed of the encoding.
+
+MESSAGE_CACHE_KEYS = (
+    "id",
+    "sender_id",
+    "content",
+    "recipient_type_id",
+    "recipient_type",
+    "recipient_id",
+    "timestamp",
+    "client",
+    TOPIC_NAME,
+    "sender_realm_id",
+    TOPIC_LINKS,
+    "last_edit_timestamp",
+    "edit_history",
+    "rendered_content",
+    "is_me_message",
+    "reactions",
+    "submessages",
+)
+
+# zlib gives the most weight to the strings at the end of the preset
+# dictionary, so the most common ones go last.
+MESSAGE_CACHE_ZDICT = b"".join(
+    [
+        b'<div class="codehilite" data-code-language="',
+        b'"><pre><span></span><code>',
+        b"</code></pre></div>",
+        b"<blockquote>\n<p>",
+        b"</p>\n</blockquote>",
+        b"<ul>\n<li>",
+        b"</li>\n</ul>",
+        b'<div class="message_inline_image"><a href="',
+        b'<span class="topic-mention">',
+        b'<span class="user-group-mention" data-user-group-id="',
+        b'<span class="user-mention silent" data-user-id="',
+        b'<span class="user-mention" data-user-id="',
+        b'<a class="stream-topic" data-stream-id="',
+        b'<span aria-label="',
+        b'" class="emoji emoji-',
+        b'" role="img" title="',
+        b'<a href="https://',
+        b"<strong>",
+        b"</strong>",
+        b"<code>",
+        b"</code>",
+        b'"prev_rendered_content":"',
+        b'"prev_content":"',
+        b'"prev_topic":"',
+        b'"prev_stream":',
+        b'"stream":',
+        b'"topic":"',
+        b'{"msg_type":"widget","content":"',
+        b'"sender_id":',
+        b'"message_id":',
+        b'"reaction_type":"realm_emoji"',
+        b'"reaction_type":"zulip_extra_emoji"',
+        b'"emoji_name":"',
+        b'"emoji_code":"',
+        b'"reaction_type":"unicode_emoji","user":{"email":"',
+        b'","id":',
+        b',"full_name":"',
+        b'"},"user_id":',
+        b'{"user_id":',
+        b',"timestamp":',
+        b'"}]',
+        b"</a>",
+        b"</p>\n<p>",
+        b"</p>",
+        b',["internal",',
+        b'"website","',
+        b'"ZulipMobile","',
+        b'"Internal","',
+        b"false",
+        b"true",
+        b',{}]',
+        b'[],[],false,"<p>',
+    ]
+)
+
+
 def extract_message_dict(message_bytes: bytes) -> dict[str, Any]:
-    return orjson.loads(zlib.decompress(message_bytes))
+    if message_bytes[0] != MESSAGE_CACHE_FORMAT_VERSION:
+        raise ValueError(f"Unknown message cache format version {message_bytes[0]}")
+    decompressor = zlib.decompressobj(zdict=MESSAGE_CACHE_ZDICT)
+    present, *values, extra = orjson.loads(decompressor.decompress(message_bytes[1:]))
+    message_dict = {}
+    for key in MESSAGE_CACHE_KEYS:
+        if present & 1:
+            message_dict[key] = values.pop()
+        present >>= 1
+    message_dict.update(extra)
+    return message_dict
 
 
 def stringify_message_dict(message_dict: dict[str, Any]) -> bytes:
-    return zlib.compress(orjson.dumps(message_dict))
+    extra = dict(message_dict)
+    present = 0
+    # Values are in reverse order, so that extract_message_dict can
+    # pop them off the end of the list.
+    values = []
+    for i, key in enumerate(MESSAGE_CACHE_KEYS):
+        if key in extra:
+            present |= 1 << i
+            values.append(extra.pop(key))
+    values.reverse()
+    compressor = zlib.compressobj(zdict=MESSAGE_CACHE_ZDICT)
+    compressed = compressor.compress(orjson.dumps([present, *values, extra])) + compressor.flush()
+    return bytes([MESSAGE_CACHE_FORMAT_VERSION]) + compressed
 
 
 @cache_with_key(to_dict_cache_key, timeout=3600 * 24)
@@ -1,5 +1,6 @@
 from collections.abc import Collection
 from typing import Any, Protocol
+from weakref import WeakValueDictionary
 
 from django.utils.translation import gettext as _
 
@@ -12,6 +13,13 @@ channel_operators: list[str] = ["channel", "stream"]
 # "streams" is a legacy alias for "channels"
 channels_operators: list[str] = ["channels", "streams"]
 
+# Operands which are equivalent in build_narrow_predicate, mapped to
+# the one we use when canonicalizing narrows.
+canonical_is_operands: dict[str, str] = {
+    "private": "dm",
+    "alerted": "mentioned",
+}
+
 
 def check_narrow_for_events(narrow: Collection[NarrowTerm]) -> None:
     supported_operators = [*channel_operators, "topic", "sender", "is"]
@@ -82,3 +90,76 @@ def build_narrow_predicate(
         return True
 
     return narrow_predicate
+
+
+CanonicalNarrow = tuple[tuple[str, str], ...]
+
+
+def canonicalize_narrow(narrow: Collection[NarrowTerm]) -> CanonicalNarrow:
+    """Returns a hashable form of the narrow, which is the same for any
+    two narrows that build_narrow_predicate treats identically."""
+    canonical_terms = set()
+    for narrow_term in narrow:
+        operator = narrow_term.operator
+        operand = narrow_term.operand
+        if operator in channel_operators:
+            canonical_terms.add(("channel", operand.lower()))
+        elif operator in ["topic", "sender"]:
+            canonical_terms.add((operator, operand.lower()))
+        elif operator == "is":
+            canonical_terms.add((operator, canonical_is_operands.get(operand, operand)))
+        else:
+            canonical_terms.add((operator, operand))
+    return tuple(sorted(canonical_terms))
+
+
+class SharedNarrowPredicate:
+    """A narrow predicate shared by every event queue with an equivalent
+    narrow.  Message fan-out checks the narrows of many queues against
+    the same message, so we memoize the results for the most recent
+    message; since flags differ between users, they are part of the
+    key.  We hold a reference to that message, so that its identity
+    cannot be reused by another message while the results are cached.
+    """
+
+    def __init__(self, predicate: NarrowPredicate) -> None:
+        self.predicate = predicate
+        self.message: dict[str, Any] | None = None
+        self.results: dict[tuple[str, ...], bool] = {}
+
+    def __call__(self, *, message: dict[str, Any], flags: list[str]) -> bool:
+        if message is not self.message:
+            self.message = message
+            self.results = {}
+        key = tuple(flags)
+        result = self.results.get(key)
+        if result is None:
+            result = self.predicate(message=message, flags=flags)
+            self.results[key] = result
+        return result
+
+
+# Maps canonicalized narrows to the predicate shared by every live
+# event queue with that narrow in this process; entries are dropped
+# once no queue uses them.
+shared_narrow_predicates: WeakValueDictionary[CanonicalNarrow, SharedNarrowPredicate] = (
+    WeakValueDictionary()
+)
+
+
+def get_shared_narrow_predicate(narrow: Collection[NarrowTerm]) -> NarrowPredicate:
+    check_narrow_for_events(narrow)
+    canonical_narrow = canonicalize_narrow(narrow)
+    predicate = shared_narrow_predicates.get(canonical_narrow)
+    if predicate is None:
+        canonical_terms = [
+            NarrowTerm(operator=operator, operand=operand)
+            for operator, operand in canonical_narrow
+        ]
+        predicate = SharedNarrowPredicate(build_narrow_predicate(canonical_terms))
+        shared_narrow_predicates[canonical_narrow] = predicate
+    return predicate
+
+
+def get_distinct_narrow_count() -> int:
+    return len(shared_narrow_predicates)
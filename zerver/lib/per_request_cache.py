@@ -1,9 +1,31 @@
-from collections.abc import Callable
+from collections.abc import Callable, Hashable
+from functools import wraps
 from typing import Any, TypeVar
 
+from zerver.lib.cache import expire_local_cache_versions
+from zerver.lib.cache_stats import record_cache_counter
+
+# Memoization of functions for the duration of a single unit of work:
+# an HTTP request (see the FlushPerRequestCaches middleware), a batch
+# of events consumed by a queue worker (see QueueProcessingWorker),
+# a management command (see ZulipBaseCommand), or an iteration of a
+# long-running loop, such as a batch of events processed by Tornado or
+# deliver_scheduled_messages.  Each of those calls
+# flush_per_request_caches when it finishes, so cached values are
+# never shared between units of work, and code using these functions
+# does not need to manage the caches' lifetime itself.
+#
+# Hits and misses are counted in the cache statistics (see
+# zerver/lib/cache_stats.py) as "per_request.<function name>".
+#
+# Results are cached by the function's full arguments, which must
+# all be hashable.  Since the same object is returned to every caller
+# during the request, functions should return values which callers
+# do not mutate, and not model instances which might be saved.
+
 ReturnT = TypeVar("ReturnT")
 
-FUNCTION_NAME_TO_PER_REQUEST_RESULT: dict[str, dict[int, Any]] = {}
+FUNCTION_NAME_TO_PER_REQUEST_RESULT: dict[str, dict[Hashable, Any]] = {}
 
 
 def return_same_value_during_entire_request(f: Callable[..., ReturnT]) -> Callable[..., ReturnT]:
@@ -12,12 +34,17 @@ def return_same_value_during_entire_request(f: Callable[..., ReturnT]) -> Callab
     assert cache_key not in FUNCTION_NAME_TO_PER_REQUEST_RESULT
     FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key] = {}
 
-    def wrapper(key: int, *args: Any) -> ReturnT:
-        if key in FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key]:
-            return FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key][key]
-
-        result = f(key, *args)
-        FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key][key] = result
+    @wraps(f)
+    def wrapper(*args: Hashable, **kwargs: Hashable) -> ReturnT:
+        key: Hashable = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+        results = FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key]
+        if key in results:
+            record_cache_counter(f"per_request.{cache_key}", "hit")
+            return results[key]
+
+        record_cache_counter(f"per_request.{cache_key}", "miss")
+        result = f(*args, **kwargs)
+        results[key] = result
         return result
 
     return wrapper
@@ -31,3 +58,5 @@ def flush_per_request_cache(cache_key: str) -> None:
 def flush_per_request_caches() -> None:
     for cache_key in FUNCTION_NAME_TO_PER_REQUEST_RESULT:
         FUNCTION_NAME_TO_PER_REQUEST_RESULT[cache_key] = {}
+    expire_local_cache_versions()
+
@@ -21,6 +21,7 @@ from pika.spec import Basic
 from tornado import ioloop
 from typing_extensions import override
 
+from zerver.lib.stage_timing import timed_stage
 from zerver.lib.utils import assert_is_not_none
 
 MAX_REQUEST_RETRIES = 3
@@ -456,7 +457,11 @@ def queue_json_publish_rollback_unsafe(
 
 
 def queue_event_on_commit(queue_name: str, event: dict[str, Any]) -> None:
-    transaction.on_commit(lambda: queue_json_publish_rollback_unsafe(queue_name, event))
+    def publish_event() -> None:
+        with timed_stage("queue_event"):
+            queue_json_publish_rollback_unsafe(queue_name, event)
+
+    transaction.on_commit(publish_event)
 
 
 def retry_event(
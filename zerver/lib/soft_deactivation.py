@@ -6,11 +6,12 @@ from typing import Any, TypedDict
 
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Exists, F, Max, OuterRef, QuerySet
-from django.db.models.functions import Greatest
+from django.db.models import Exists, F, Max, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.utils.timezone import now as timezone_now
 from sentry_sdk import capture_exception
 
+from zerver.lib.cache import delete_user_profile_caches
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.user_message import bulk_insert_all_ums
@@ -20,6 +21,7 @@ from zerver.models import (
     Realm,
     RealmAuditLog,
     Recipient,
+    Stream,
     Subscription,
     UserActivity,
     UserMessage,
@@ -250,6 +252,192 @@ def add_missing_messages(user_profile: UserProfile) -> None:
         )
 
 
+def add_missing_deferred_messages(user_profile: UserProfile) -> list[int]:
+    """Creates the UserMessage rows which do_send_messages skipped for
+    this user in channels with defer_user_messages enabled.
+
+    This is the same lazy materialization that add_missing_messages
+    does for soft-deactivated users, just tracked per subscription
+    (Subscription.deferred_materialized_message_id) rather than per
+    user, since the user is otherwise active.  Messages at or below
+    the subscription's read_watermark_message_id, which were marked as
+    read before their rows existed, are created as read; their IDs are
+    returned.
+    """
+    if not user_profile.has_deferred_subscriptions:
+        # Most users are in no such channels; this keeps the cost of
+        # calling this on every message fetch and flag update down to
+        # nothing for them.
+        return []
+
+    deferred_after_message_ids = dict(
+        Stream.objects.filter(
+            realm_id=user_profile.realm_id, deferred_after_message_id__isnull=False
+        ).values_list("id", "deferred_after_message_id")
+    )
+    if not deferred_after_message_ids:
+        return []
+
+    subs = list(
+        Subscription.objects.filter(
+            user_profile=user_profile,
+            recipient__type=Recipient.STREAM,
+            recipient__type_id__in=deferred_after_message_ids,
+        ).values(
+            "id",
+            "recipient_id",
+            "recipient__type_id",
+            "deferred_materialized_message_id",
+            "read_watermark_message_id",
+        )
+    )
+    if not subs:
+        return []
+
+    # See add_missing_messages for why this ordering matters.
+    subscription_logs = list(
+        RealmAuditLog.objects.filter(
+            modified_user=user_profile,
+            modified_stream_id__in=[sub["recipient__type_id"] for sub in subs],
+            event_type__in=[
+                AuditLogEventType.SUBSCRIPTION_CREATED,
+                AuditLogEventType.SUBSCRIPTION_DEACTIVATED,
+                AuditLogEventType.SUBSCRIPTION_ACTIVATED,
+            ],
+        )
+        .order_by("event_last_message_id", "id")
+        .only("id", "event_type", "modified_stream_id", "event_last_message_id")
+    )
+    all_stream_subscription_logs: defaultdict[int, list[RealmAuditLog]] = defaultdict(list)
+    for log in subscription_logs:
+        all_stream_subscription_logs[assert_is_not_none(log.modified_stream_id)].append(log)
+
+    read_message_ids: list[int] = []
+    for sub in subs:
+        stream_id = sub["recipient__type_id"]
+        if not all_stream_subscription_logs[stream_id]:  # nocoverage
+            continue
+        materialized_message_id = max(
+            sub["deferred_materialized_message_id"] or 0, deferred_after_message_ids[stream_id]
+        )
+        new_stream_msgs = list(
+            Message.objects.alias(
+                has_user_message=Exists(
+                    UserMessage.objects.filter(
+                        user_profile_id=user_profile,
+                        message_id=OuterRef("id"),
+                    )
+                )
+            )
+            .filter(
+                # Uses index: zerver_message_realm_recipient_id
+                has_user_message=False,
+                realm_id=user_profile.realm_id,
+                recipient_id=sub["recipient_id"],
+                id__gt=materialized_message_id,
+            )
+            .order_by("id")
+            .values("id", "recipient__type_id")
+        )
+        if not new_stream_msgs:
+            continue
+
+        stream_messages: defaultdict[int, list[MissingMessageDict]] = defaultdict(list)
+        stream_messages[stream_id] = [
+            MissingMessageDict(id=msg["id"], recipient__type_id=msg["recipient__type_id"])
+            for msg in new_stream_msgs
+        ]
+        message_ids_to_insert = filter_by_subscription_history(
+            user_profile, stream_messages, all_stream_subscription_logs
+        )
+
+        read_watermark_message_id = sub["read_watermark_message_id"] or 0
+        with transaction.atomic(savepoint=False):
+            for start in range(0, len(message_ids_to_insert), BULK_CREATE_BATCH_SIZE):
+                message_ids = message_ids_to_insert[start : start + BULK_CREATE_BATCH_SIZE]
+                read_batch = [
+                    message_id
+                    for message_id in message_ids
+                    if message_id <= read_watermark_message_id
+                ]
+                bulk_insert_all_ums(
+                    user_ids=[user_profile.id],
+                    message_ids=read_batch,
+                    flags=UserMessage.flags.read,
+                )
+                read_message_ids.extend(read_batch)
+                bulk_insert_all_ums(
+                    user_ids=[user_profile.id],
+                    message_ids=[
+                        message_id
+                        for message_id in message_ids
+                        if message_id > read_watermark_message_id
+                    ],
+                    flags=0,
+                )
+            Subscription.objects.filter(id=sub["id"]).update(
+                deferred_materialized_message_id=Greatest(
+                    Coalesce(F("deferred_materialized_message_id"), 0), new_stream_msgs[-1]["id"]
+                )
+            )
+    return read_message_ids
+
+
+def mark_users_with_deferred_subscriptions(user_profiles: Iterable[UserProfile]) -> None:
+    """Sets UserProfile.has_deferred_subscriptions for users who are
+    subscribed to a channel with Stream.deferred_after_message_id set.
+    It is never cleared, since rows may still be missing after the
+    user unsubscribes, or deferral is disabled."""
+    user_profiles = {
+        user_profile.id: user_profile
+        for user_profile in user_profiles
+        if not user_profile.has_deferred_subscriptions
+    }
+    if not user_profiles:
+        return
+    UserProfile.objects.filter(id__in=user_profiles).update(has_deferred_subscriptions=True)
+    for user_profile in user_profiles.values():
+        user_profile.has_deferred_subscriptions = True
+    # .update() skips the post_save signal which flushes the cached
+    # copies of the users.
+    delete_user_profile_caches(
+        user_profiles.values(), next(iter(user_profiles.values())).realm_id
+    )
+
+
+def mark_deferred_messages_as_read(
+    user_profile: UserProfile, stream_recipient_id: int | None = None
+) -> list[int]:
+    """Marks everything the user has been sent in deferred channels
+    (or just the given one) as read, by advancing the read watermark
+    and then creating the missing UserMessage rows as already read.
+    Returns the IDs of the messages whose rows were created."""
+    if not user_profile.has_deferred_subscriptions:
+        return []
+
+    subs = Subscription.objects.filter(
+        user_profile=user_profile,
+        recipient_id__in=Stream.objects.filter(
+            realm_id=user_profile.realm_id, deferred_after_message_id__isnull=False
+        ).values("recipient_id"),
+    )
+    if stream_recipient_id is not None:
+        subs = subs.filter(recipient_id=stream_recipient_id)
+    # Each subscription's watermark is its channel's latest message;
+    # the index zerver_message_realm_recipient_id makes this cheap.
+    latest_message_id = Subquery(
+        Message.objects.filter(
+            realm_id=user_profile.realm_id, recipient_id=OuterRef("recipient_id")
+        )
+        .order_by("-id")
+        .values("id")[:1]
+    )
+    watermark = Coalesce(latest_message_id, F("read_watermark_message_id"))
+    if subs.update(read_watermark_message_id=watermark) == 0:
+        return []
+    return add_missing_deferred_messages(user_profile)
+
+
 def do_soft_deactivate_user(user_profile: UserProfile) -> None:
     try:
         user_profile.last_active_message_id = (
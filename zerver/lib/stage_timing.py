@@ -0,0 +1,182 @@
+import logging
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import redis
+
+from zerver.lib.redis_utils import get_redis_client
+
+# Timers for the stages of latency-sensitive code paths, most notably
+# sending a message.  Stage times are reported in the request's log
+# line (see zerver/middleware.py), and aggregated into per-stage
+# histograms across all of the server's processes, which are exported
+# in the Prometheus format by /api/internal/metrics.
+#
+# Stages should not be nested inside each other, since their times
+# would then be counted twice in the log line, and their names may
+# not contain colons.
+
+# Upper bounds, in seconds, of the histogram buckets.
+STAGE_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_TIME_BUCKET_LABELS = [*(str(bound) for bound in STAGE_TIME_BUCKETS), "+Inf"]
+
+# Upper bounds of the histogram buckets for the sizes of batches, such
+# as the number of events in a batched notice to Tornado.
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+BATCH_SIZE_BUCKET_LABELS = [*(str(bound) for bound in BATCH_SIZE_BUCKETS), "+Inf"]
+
+# Each process accumulates observations, and adds them to the totals
+# in Redis at most this often, so that timing a stage stays cheap.
+STAGE_TIMING_FLUSH_INTERVAL = 10
+STAGE_TIMING_REDIS_KEY = "zulip:stage_timing"
+BATCH_SIZES_REDIS_KEY = "zulip:batch_sizes"
+
+# A flush is a synchronous Redis request, so Tornado clears this, and
+# flushes from a periodic callback instead of in the middle of
+# handling an event; see setup_event_queue.
+flush_inline = True
+
+redis_client = get_redis_client()
+
+
+@dataclass
+class StageHistogram:
+    # Not cumulative; the last entry counts the observations above
+    # every bound in STAGE_TIME_BUCKETS.
+    bucket_counts: list[int] = field(default_factory=lambda: [0] * len(STAGE_TIME_BUCKET_LABELS))
+    total_time: float = 0.0
+    count: int = 0
+
+    def observe(self, duration: float) -> None:
+        index = 0
+        while index < len(STAGE_TIME_BUCKETS) and duration > STAGE_TIME_BUCKETS[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.total_time += duration
+        self.count += 1
+
+
+@dataclass
+class BatchSizeHistogram:
+    # Not cumulative, like StageHistogram.bucket_counts.
+    bucket_counts: list[int] = field(default_factory=lambda: [0] * len(BATCH_SIZE_BUCKET_LABELS))
+    total_size: int = 0
+    count: int = 0
+
+    def observe(self, size: int) -> None:
+        index = 0
+        while index < len(BATCH_SIZE_BUCKETS) and size > BATCH_SIZE_BUCKETS[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.total_size += size
+        self.count += 1
+
+
+stage_total_times: dict[str, float] = defaultdict(float)
+unflushed_stage_histograms: dict[str, StageHistogram] = defaultdict(StageHistogram)
+unflushed_batch_size_histograms: dict[str, BatchSizeHistogram] = defaultdict(BatchSizeHistogram)
+last_flush_time = time.monotonic()
+
+
+def get_stage_times() -> dict[str, float]:
+    return dict(stage_total_times)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage_time(stage, time.perf_counter() - start)
+
+
+def record_stage_time(stage: str, duration: float) -> None:
+    stage_total_times[stage] += duration
+    unflushed_stage_histograms[stage].observe(duration)
+    if flush_inline and time.monotonic() - last_flush_time >= STAGE_TIMING_FLUSH_INTERVAL:
+        flush_stage_histograms()
+
+
+def record_batch_size(batch: str, size: int) -> None:
+    """Records the size of a batch of the named kind; these are
+    flushed along with the stage timings."""
+    unflushed_batch_size_histograms[batch].observe(size)
+    if flush_inline and time.monotonic() - last_flush_time >= STAGE_TIMING_FLUSH_INTERVAL:
+        flush_stage_histograms()
+
+
+def flush_stage_histograms() -> None:
+    global last_flush_time
+    last_flush_time = time.monotonic()
+    histograms = dict(unflushed_stage_histograms)
+    unflushed_stage_histograms.clear()
+    batch_size_histograms = dict(unflushed_batch_size_histograms)
+    unflushed_batch_size_histograms.clear()
+    if not histograms and not batch_size_histograms:
+        return
+
+    try:
+        with redis_client.pipeline(transaction=False) as pipeline:
+            for stage, histogram in histograms.items():
+                for label, count in zip(
+                    STAGE_TIME_BUCKET_LABELS, histogram.bucket_counts, strict=True
+                ):
+                    if count:
+                        pipeline.hincrby(STAGE_TIMING_REDIS_KEY, f"{stage}:bucket:{label}", count)
+                pipeline.hincrby(STAGE_TIMING_REDIS_KEY, f"{stage}:count", histogram.count)
+                pipeline.hincrbyfloat(
+                    STAGE_TIMING_REDIS_KEY, f"{stage}:sum", histogram.total_time
+                )
+            for batch, batch_size_histogram in batch_size_histograms.items():
+                for label, count in zip(
+                    BATCH_SIZE_BUCKET_LABELS, batch_size_histogram.bucket_counts, strict=True
+                ):
+                    if count:
+                        pipeline.hincrby(BATCH_SIZES_REDIS_KEY, f"{batch}:bucket:{label}", count)
+                pipeline.hincrby(
+                    BATCH_SIZES_REDIS_KEY, f"{batch}:count", batch_size_histogram.count
+                )
+                pipeline.hincrby(
+                    BATCH_SIZES_REDIS_KEY, f"{batch}:sum", batch_size_histogram.total_size
+                )
+            pipeline.execute()
+    except redis.RedisError:
+        # Losing some observations is better than failing whatever
+        # we were timing.
+        logging.warning("Failed to flush stage timings to Redis", exc_info=True)
+
+
+def get_stage_histograms() -> dict[str, StageHistogram]:
+    """The histograms for every process, as of each process's last
+    flush."""
+    histograms: dict[str, StageHistogram] = defaultdict(StageHistogram)
+    for key, value in redis_client.hgetall(STAGE_TIMING_REDIS_KEY).items():
+        stage, kind, *label = key.decode().split(":")
+        histogram = histograms[stage]
+        if kind == "count":
+            histogram.count = int(value)
+        elif kind == "sum":
+            histogram.total_time = float(value)
+        else:
+            histogram.bucket_counts[STAGE_TIME_BUCKET_LABELS.index(label[0])] = int(value)
+    return dict(histograms)
+
+
+def get_batch_size_histograms() -> dict[str, BatchSizeHistogram]:
+    """The batch size histograms for every process, as of each
+    process's last flush."""
+    histograms: dict[str, BatchSizeHistogram] = defaultdict(BatchSizeHistogram)
+    for key, value in redis_client.hgetall(BATCH_SIZES_REDIS_KEY).items():
+        batch, kind, *label = key.decode().split(":")
+        histogram = histograms[batch]
+        if kind == "count":
+            histogram.count = int(value)
+        elif kind == "sum":
+            histogram.total_size = int(value)
+        else:
+            histogram.bucket_counts[BATCH_SIZE_BUCKET_LABELS.index(label[0])] = int(value)
+    return dict(histograms)
@@ -1,13 +1,21 @@
 import itertools
+import secrets
 from collections import defaultdict
 from collections.abc import Collection
 from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
 from operator import itemgetter
-from typing import Any
+from typing import Any, NamedTuple
 
-from django.db.models import Q, QuerySet
+from django.db.models import Exists, F, OuterRef, Q, QuerySet
 
+from zerver.lib.cache import (
+    cache_get_many,
+    cache_set,
+    stream_recipient_info_cache_key,
+    stream_recipient_info_version_cache_key,
+)
+from zerver.lib.cache_stats import record_cache_counter
 from zerver.models import AlertWord, Realm, Recipient, Stream, Subscription, UserProfile, UserTopic
 
 
@@ -355,3 +363,145 @@ def get_subscriptions_for_send_message(
         )
     )
     return query
+
+
+class SendMessageSubscriberRow(NamedTuple):
+    user_profile_id: int
+    is_muted: bool
+    push_notifications: bool | None
+    email_notifications: bool | None
+    wildcard_mentions_notify: bool | None
+    user_profile_push_notifications: bool
+    user_profile_email_notifications: bool
+    user_profile_wildcard_mentions_notify: bool
+    followed_topic_push_notifications: bool
+    followed_topic_email_notifications: bool
+    followed_topic_wildcard_mentions_notify: bool
+    enable_online_push_notifications: bool
+    enable_offline_email_notifications: bool
+    enable_offline_push_notifications: bool
+    long_term_idle: bool
+    is_bot: bool
+    bot_type: int | None
+    has_alert_words: bool
+
+
+def fetch_subscriber_rows_for_send_message(
+    query: QuerySet[Subscription],
+) -> list[SendMessageSubscriberRow]:
+    query = query.annotate(
+        user_profile_push_notifications=F("user_profile__enable_stream_push_notifications"),
+        user_profile_email_notifications=F("user_profile__enable_stream_email_notifications"),
+        user_profile_wildcard_mentions_notify=F("user_profile__wildcard_mentions_notify"),
+        followed_topic_push_notifications=F(
+            "user_profile__enable_followed_topic_push_notifications"
+        ),
+        followed_topic_email_notifications=F(
+            "user_profile__enable_followed_topic_email_notifications"
+        ),
+        followed_topic_wildcard_mentions_notify=F(
+            "user_profile__enable_followed_topic_wildcard_mentions_notify"
+        ),
+        enable_online_push_notifications=F("user_profile__enable_online_push_notifications"),
+        enable_offline_email_notifications=F("user_profile__enable_offline_email_notifications"),
+        enable_offline_push_notifications=F("user_profile__enable_offline_push_notifications"),
+        long_term_idle=F("user_profile__long_term_idle"),
+        is_bot=F("user_profile__is_bot"),
+        bot_type=F("user_profile__bot_type"),
+        has_alert_words=Exists(
+            AlertWord.objects.filter(user_profile_id=OuterRef("user_profile_id"))
+        ),
+    )
+    return [
+        SendMessageSubscriberRow(*row)
+        for row in query.values_list(*SendMessageSubscriberRow._fields).order_by(
+            "user_profile_id"
+        )
+    ]
+
+
+def get_subscriber_rows_for_send_message(
+    realm_id: int,
+    recipient_id: int,
+    *,
+    possible_stream_wildcard_mention: bool,
+    topic_participant_user_ids: AbstractSet[int],
+    possibly_mentioned_user_ids: AbstractSet[int],
+    followed_user_ids: AbstractSet[int],
+) -> list[SendMessageSubscriberRow]:
+    """Everything about the subscribers who should receive a message
+    that get_recipient_info needs; the same subscribers as
+    get_subscriptions_for_send_message, which see for details.
+
+    Busy streams mostly get the same answer for every message sent
+    to them, so the subscribers which receive every message (those
+    who aren't long-term idle, who have notifications enabled for the
+    stream, or who have alert words) are cached.  Like the SQL
+    filter, this leaves out the long-term idle subscribers, which
+    are most subscribers of large streams.  The entry is deleted when
+    a subscription to the stream changes, and is tagged with the
+    realm's version, which is replaced whenever a user setting or
+    alert word included here changes; see
+    bump_stream_recipient_info_version.  Both keys are read in a
+    single round trip.
+
+    Idle subscribers who are mentioned, participate in the topic, or
+    follow it are fetched separately, and a possible stream wildcard
+    mention, which is sent to every subscriber, is not cached.
+    """
+    query = Subscription.objects.filter(
+        recipient_id=recipient_id, active=True, is_user_active=True
+    )
+    if possible_stream_wildcard_mention:
+        return fetch_subscriber_rows_for_send_message(query)
+
+    key = stream_recipient_info_cache_key(recipient_id)
+    version_key = stream_recipient_info_version_cache_key(realm_id)
+    cached = cache_get_many([key, version_key])
+    rows: list[SendMessageSubscriberRow] | None = None
+    if version_key in cached:
+        version = cached[version_key][0]
+        if key in cached and cached[key][0][0] == version:
+            record_cache_counter("stream_recipient_info", "hit")
+            rows = cached[key][0][1]
+    else:
+        version = secrets.token_hex(8)
+        cache_set(version_key, version, timeout=3600 * 24)
+    if rows is None:
+        # Includes rows cached under an older version, which memcached's
+        # own statistics count as hits.
+        record_cache_counter("stream_recipient_info", "miss")
+        rows = fetch_subscriber_rows_for_send_message(
+            query.filter(
+                Q(user_profile__long_term_idle=False)
+                | Q(push_notifications=True)
+                | (
+                    Q(push_notifications=None)
+                    & Q(user_profile__enable_stream_push_notifications=True)
+                )
+                | Q(email_notifications=True)
+                | (
+                    Q(email_notifications=None)
+                    & Q(user_profile__enable_stream_email_notifications=True)
+                )
+                | Q(
+                    user_profile_id__in=AlertWord.objects.filter(realm_id=realm_id).values_list(
+                        "user_profile_id"
+                    )
+                )
+            )
+        )
+        cache_set(key, (version, rows), timeout=3600 * 24)
+
+    idle_user_ids = (
+        topic_participant_user_ids | possibly_mentioned_user_ids | followed_user_ids
+    ) - {row.user_profile_id for row in rows}
+    if idle_user_ids:
+        rows = sorted(
+            rows
+            + fetch_subscriber_rows_for_send_message(
+                query.filter(user_profile_id__in=idle_user_ids)
+            ),
+            key=lambda row: row.user_profile_id,
+        )
+    return rows
@@ -2074,13 +2074,16 @@ class ZulipTestCase(ZulipTestCaseMixin, TestCase):
     ) -> Iterator[list[Mapping[str, Any]]]:
         lst: list[Mapping[str, Any]] = []
 
-        # process_notification takes a single parameter called 'notice'.
-        # lst.append takes a single argument called 'object'.
-        # Some code might call process_notification using keyword arguments,
-        # so mypy doesn't allow assigning lst.append to process_notification
-        # So explicitly change parameter name to 'notice' to work around this problem
+        def capture_notice(notice: Mapping[str, Any]) -> None:
+            # Events sent from consecutive `on_commit` callbacks are
+            # batched into one notice; capture them individually.
+            if "notices" in notice:
+                lst.extend(notice["notices"])
+            else:
+                lst.append(notice)
+
         with (
-            mock.patch("zerver.tornado.event_queue.process_notification", lst.append),
+            mock.patch("zerver.tornado.event_queue.process_notification", capture_notice),
             # Some `send_event_rollback_unsafe` calls need to be
             # executed only after the current transaction commits
             # (mainly those using the `send_event_on_commit` wrapper, which
@@ -4,8 +4,8 @@ from typing import Any
 
 import orjson
 from django.db import connection
-from django.db.models import F, Func, JSONField, Q, QuerySet, Subquery, TextField, Value
-from django.db.models.functions import Cast
+from django.db.models import Case, Q, QuerySet, Subquery, TextField, Value, When
+from django.db.models.functions import Concat, Substr
 
 from zerver.lib.types import EditHistoryEvent
 from zerver.lib.utils import assert_is_not_none
@@ -107,12 +107,16 @@ def update_edit_history(
     message: Message, last_edit_time: datetime, edit_history_event: EditHistoryEvent
 ) -> None:
     message.last_edit_time = last_edit_time
-    if message.edit_history is not None:
-        edit_history: list[EditHistoryEvent] = orjson.loads(message.edit_history)
-        edit_history.insert(0, edit_history_event)
+    # edit_history is stored newest-first, so we splice the new event
+    # onto the front of the existing JSON, rather than decoding and
+    # re-encoding earlier events, which can include the full previous
+    # content of every earlier edit.
+    event_json = orjson.dumps(edit_history_event).decode()
+    if message.edit_history is None or message.edit_history == "[]":
+        message.edit_history = f"[{event_json}]"
     else:
-        edit_history = [edit_history_event]
-    message.edit_history = orjson.dumps(edit_history).decode()
+        assert message.edit_history.startswith("[")
+        message.edit_history = f"[{event_json},{message.edit_history[1:]}"
 
 
 def update_messages_for_topic_edit(
@@ -125,7 +129,9 @@ def update_messages_for_topic_edit(
     old_stream: Stream,
     edit_history_event: EditHistoryEvent,
     last_edit_time: datetime,
-) -> tuple[QuerySet[Message], Callable[[], QuerySet[Message]]]:
+    batch_size: int | None = None,
+    max_message_id: int | None = None,
+) -> tuple[QuerySet[Message], Callable[[], QuerySet[Message]], bool]:
     # Uses index: zerver_message_realm_recipient_upper_subject
     messages = Message.objects.filter(
         realm_id=old_stream.realm_id,
@@ -136,6 +142,8 @@ def update_messages_for_topic_edit(
         messages = messages.exclude(id=edited_message.id)
     if propagate_mode == "change_later":
         messages = messages.filter(id__gt=edited_message.id)
+    if max_message_id is not None:
+        messages = messages.filter(id__lte=max_message_id)
 
     if new_stream is not None:
         # If we're moving the messages between streams, only move
@@ -150,37 +158,36 @@ def update_messages_for_topic_edit(
         # to keep topics together.
         pass
 
+    # With a batch_size, only the oldest messages are edited, and we
+    # report whether there are more left for the caller to edit later.
+    more_messages_to_edit = False
+    if batch_size is not None:
+        batch_message_ids = list(
+            messages.order_by("id").values_list("id", flat=True)[: batch_size + 1]
+        )
+        more_messages_to_edit = len(batch_message_ids) > batch_size
+        messages = Message.objects.filter(id__in=batch_message_ids[:batch_size])
+
+    event_json = orjson.dumps(edit_history_event).decode()
     update_fields: dict[str, object] = {
         "last_edit_time": last_edit_time,
-        # We cast the `edit_history` column to jsonb (defaulting NULL
-        # to `[]`), apply the `||` array concatenation operator to it,
-        # and cast the result back to text.  See #26496 for making
-        # this column itself jsonb, which is a complicated migration.
-        #
-        # This equates to:
-        #    "edit_history" = (
-        #      (COALESCE("zerver_message"."edit_history", '[]'))::jsonb
-        #      ||
-        #      ( '[{ ..json event.. }]' )::jsonb
-        #     )::text
-        "edit_history": Cast(
-            Func(
-                Cast(
-                    Value(orjson.dumps([edit_history_event]).decode()),
-                    JSONField(),
-                ),
-                Cast(
-                    Func(
-                        F("edit_history"),
-                        Value("[]"),
-                        function="COALESCE",
-                    ),
-                    JSONField(),
-                ),
-                function="",
-                arg_joiner=" || ",
+        # Splice the event onto the front of each message's history,
+        # as update_edit_history does; this avoids decoding and
+        # re-encoding every event in the history of every moved
+        # message.  This equates to:
+        #    "edit_history" = CASE
+        #      WHEN ("zerver_message"."edit_history" IS NULL
+        #            OR "zerver_message"."edit_history" = '[]')
+        #      THEN '[{ ..json event.. }]'
+        #      ELSE '[{ ..json event.. },' || SUBSTRING("zerver_message"."edit_history", 2)
+        #    END
+        "edit_history": Case(
+            When(
+                Q(edit_history__isnull=True) | Q(edit_history="[]"),
+                then=Value(f"[{event_json}]"),
             ),
-            TextField(),
+            default=Concat(Value(f"[{event_json},"), Substr("edit_history", 2)),
+            output_field=TextField(),
         ),
     }
     if new_stream is not None:
@@ -201,7 +208,7 @@ def update_messages_for_topic_edit(
             *Message.DEFAULT_SELECT_RELATED
         )
 
-    return messages, propagate
+    return messages, propagate, more_messages_to_edit
 
 
 def generate_topic_history_from_db_rows(rows: list[tuple[str, int]]) -> list[dict[str, Any]]:
@@ -1,4 +1,6 @@
-from django.db import connection
+from collections.abc import Iterable, Iterator
+
+from django.db import connection, transaction
 from psycopg2.extras import execute_values
 from psycopg2.sql import SQL, Composable, Literal
 
@@ -21,6 +23,37 @@ class UserMessageLite:
         return UserMessage.flags_list_for_flags(self.flags)
 
 
+class UserMessageCopyStream:
+    """
+    A file-like object producing text-format COPY input from an
+    iterable of (user_profile_id, message_id, flags) rows, without
+    materializing all of them at once.
+    """
+
+    def __init__(self, rows: Iterable[tuple[int, int, int]]) -> None:
+        self.rows: Iterator[tuple[int, int, int]] = iter(rows)
+        self.buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        for row in self.rows:
+            line = b"%d\t%d\t%d\n" % row
+            chunks.append(line)
+            length += len(line)
+            if size >= 0 and length >= size:
+                break
+        data = b"".join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+# Above this many rows, bulk_insert_ums loads them with COPY, which
+# has much lower per-row overhead than a multi-row INSERT.
+BULK_INSERT_UMS_COPY_THRESHOLD = 2000
+
 DEFAULT_HISTORICAL_FLAGS = UserMessage.flags.historical | UserMessage.flags.read
 
 
@@ -50,16 +83,22 @@ def create_historical_user_messages(
 
 
 def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
+    if not ums:
+        return
+
+    if len(ums) >= BULK_INSERT_UMS_COPY_THRESHOLD:
+        bulk_copy_ums((um.user_profile_id, um.message_id, um.flags) for um in ums)
+    else:
+        bulk_insert_ums_values([(um.user_profile_id, um.message_id, um.flags) for um in ums])
+
+
+def bulk_insert_ums_values(rows: list[tuple[int, int, int]]) -> None:
     """
     Doing bulk inserts this way is much faster than using Django,
     since we don't have any ORM overhead.  Profiling with 1000
     users shows a speedup of 0.436 -> 0.027 seconds, so we're
     talking about a 15x speedup.
     """
-    if not ums:
-        return
-
-    vals = [(um.user_profile_id, um.message_id, um.flags) for um in ums]
     query = SQL(
         """
         INSERT into
@@ -70,7 +109,48 @@ def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
     )
 
     with connection.cursor() as cursor:
-        execute_values(cursor.cursor, query, vals)
+        execute_values(cursor.cursor, query, rows)
+
+
+def bulk_copy_ums(rows: Iterable[tuple[int, int, int]]) -> None:
+    """
+    Inserts (user_profile_id, message_id, flags) rows, streamed via
+    COPY into a staging table.  COPY cannot skip conflicting rows, so
+    we then move them into zerver_usermessage with the same ON
+    CONFLICT DO NOTHING semantics as bulk_insert_ums.
+
+    The staging table is a temporary table created the first time a
+    connection needs it, rather than on every call, since creating and
+    dropping a table writes to the system catalogs.  Rows are deleted
+    from it as they are moved, and ON COMMIT DELETE ROWS truncates it
+    at the end of the transaction.
+    """
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE IF NOT EXISTS zerver_usermessage_staging (
+                user_profile_id integer NOT NULL,
+                message_id bigint NOT NULL,
+                flags bigint NOT NULL
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        cursor.cursor.copy_expert(
+            "COPY zerver_usermessage_staging (user_profile_id, message_id, flags) FROM STDIN",
+            UserMessageCopyStream(rows),
+        )
+        cursor.execute(
+            """
+            WITH staged AS (
+                DELETE FROM zerver_usermessage_staging
+                RETURNING user_profile_id, message_id, flags
+            )
+            INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+            SELECT user_profile_id, message_id, flags
+              FROM staged
+            ON CONFLICT DO NOTHING
+            """
+        )
 
 
 def bulk_insert_all_ums(
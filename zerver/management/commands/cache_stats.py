@@ -0,0 +1,67 @@
+from argparse import ArgumentParser
+from typing import Any
+
+from typing_extensions import override
+
+from zerver.lib.cache_stats import flush_cache_stats, get_cache_stats, reset_cache_stats
+from zerver.lib.management import ZulipBaseCommand
+
+
+class Command(ZulipBaseCommand):
+    help = """Report how each family of memcached keys is used, across all processes.
+
+Families with a low hit rate, or with many misses not explained by
+deletes (which suggests that their keys are being evicted), may not be
+worth caching.
+
+Usage examples:
+
+./manage.py cache_stats
+./manage.py cache_stats --reset"""
+
+    @override
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--reset", action="store_true", help="Clear the statistics after reporting them."
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        # This process's own statistics are not otherwise flushed yet.
+        flush_cache_stats()
+
+        row_format = "{:<36} {:>10} {:>7} {:>11} {:>10} {:>10} {:>10} {:>9}"
+        print(
+            row_format.format(
+                "family",
+                "gets",
+                "hit_%",
+                "unexpl_miss",
+                "sets",
+                "avg_bytes",
+                "deletes",
+                "avg_ms",
+            )
+        )
+        all_stats = get_cache_stats()
+        for family, stats in sorted(
+            all_stats.items(), key=lambda item: -(item[1].hits + item[1].misses)
+        ):
+            gets = stats.hits + stats.misses
+            print(
+                row_format.format(
+                    family[:36],
+                    gets,
+                    f"{100 * stats.hits / gets:.1f}" if gets else "-",
+                    stats.unexplained_misses(),
+                    stats.sets,
+                    stats.set_bytes // stats.sets if stats.sets else "-",
+                    stats.deletes,
+                    f"{1000 * stats.latency.total_time / stats.latency.count:.2f}"
+                    if stats.latency.count
+                    else "-",
+                )
+            )
+
+        if options["reset"]:
+            reset_cache_stats()
@@ -0,0 +1,51 @@
+from argparse import ArgumentParser
+from typing import Any
+
+from django.core.management.base import CommandError
+from typing_extensions import override
+
+from zerver.actions.streams import do_set_stream_defer_user_messages
+from zerver.lib.management import ZulipBaseCommand
+from zerver.models import Stream
+
+
+class Command(ZulipBaseCommand):
+    help = """Defer creating UserMessage rows for a very large channel.
+
+When enabled, messages sent to the channel only get UserMessage rows
+for subscribers with non-default flags (e.g. mentions); the rest are
+created when each subscriber next uses Zulip.  Private channels with
+protected history are not supported, since access to their messages
+depends on the UserMessage rows.
+
+Usage examples:
+
+./manage.py defer_channel_user_messages -r zulip --channel-id 10
+./manage.py defer_channel_user_messages -r zulip --channel-id 10 --disable"""
+
+    @override
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--channel-id", required=True, type=int, help="ID of the channel in the realm."
+        )
+        parser.add_argument(
+            "--disable", action="store_true", help="Create UserMessage rows eagerly again."
+        )
+        self.add_realm_args(parser, required=True)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None  # Should be ensured by parser
+
+        try:
+            channel = Stream.objects.get(realm=realm, id=options["channel_id"])
+        except Stream.DoesNotExist:
+            raise CommandError(f"No channel with id {options['channel_id']} in this realm.")
+
+        if not options["disable"] and not channel.is_history_public_to_subscribers():
+            raise CommandError(
+                "Only channels with history visible to subscribers can defer UserMessage rows."
+            )
+
+        do_set_stream_defer_user_messages(channel, not options["disable"])
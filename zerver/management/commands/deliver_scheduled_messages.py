@@ -7,6 +7,7 @@ from typing_extensions import override
 
 from zerver.actions.scheduled_messages import try_deliver_one_scheduled_message
 from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.per_request_cache import flush_per_request_caches
 
 
 ## Setup ##
@@ -23,6 +24,10 @@ Usage: ./manage.py deliver_scheduled_messages
     def handle(self, *args: Any, **options: Any) -> None:
         try:
             while True:
+                # Each message is delivered as its own unit of work,
+                # with fresh per-request caches, since this loop
+                # never returns to ZulipBaseCommand to flush them.
+                flush_per_request_caches()
                 if try_deliver_one_scheduled_message():
                     continue
 
@@ -0,0 +1,62 @@
+from argparse import ArgumentParser
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.tornado.django_api import requests_client
+from zerver.tornado.sharding import get_tornado_url
+
+
+class Command(ZulipBaseCommand):
+    help = """Report the event queues holding the most events on each Tornado process.
+
+Usage examples:
+
+./manage.py report_event_queues
+./manage.py report_event_queues --limit 50"""
+
+    @override
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Number of queues to report per process."
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        if not settings.USING_TORNADO:
+            raise CommandError("This server is not running Tornado.")
+
+        row_format = "{:<38} {:>8} {:>8} {:<24} {:>8} {:>12} {:>10}"
+        for port in settings.TORNADO_PORTS:
+            result = requests_client().post(
+                get_tornado_url(port) + "/api/internal/event_queue_stats",
+                data={"secret": settings.SHARED_SECRET, "limit": options["limit"]},
+                timeout=30,
+            )
+            result.raise_for_status()
+            stats = result.json()
+            print(
+                f"Tornado port {port}: {stats['queue_count']} queues, "
+                f"{stats['distinct_narrow_count']} distinct narrows"
+            )
+            print(
+                row_format.format(
+                    "queue_id", "user_id", "realm_id", "client", "events", "bytes", "idle_secs"
+                )
+            )
+            for queue in stats["queues"]:
+                print(
+                    row_format.format(
+                        queue["queue_id"],
+                        queue["user_id"],
+                        queue["realm_id"],
+                        queue["client_type_name"][:24],
+                        queue["events"],
+                        queue["bytes"],
+                        "-" if queue["connected"] else queue["idle_secs"],
+                    )
+                )
+            print()
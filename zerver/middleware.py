@@ -25,7 +25,14 @@ from django_scim.settings import scim_settings
 from sentry_sdk import set_tag
 from typing_extensions import ParamSpec, override
 
-from zerver.lib.cache import get_remote_cache_requests, get_remote_cache_time
+from zerver.lib.cache import (
+    get_local_cache_hits,
+    get_local_cache_misses,
+    get_remote_cache_hits,
+    get_remote_cache_misses,
+    get_remote_cache_requests,
+    get_remote_cache_time,
+)
 from zerver.lib.db_connections import reset_queries
 from zerver.lib.debug import maybe_tracemalloc_listen
 from zerver.lib.exceptions import ErrorCode, JsonableError, MissingAuthenticationError, WebhookError
@@ -39,6 +46,7 @@ from zerver.lib.response import (
     json_response_from_error,
     json_unauthorized,
 )
+from zerver.lib.stage_timing import get_stage_times
 from zerver.lib.subdomains import get_subdomain
 from zerver.lib.typed_endpoint import INTENTIONALLY_UNDOCUMENTED, ApiParamConfig, typed_endpoint
 from zerver.lib.user_agent import parse_user_agent
@@ -50,10 +58,20 @@ logger = logging.getLogger("zulip.requests")
 slow_query_logger = logging.getLogger("zulip.slow_queries")
 
 
+def get_cache_get_counts() -> tuple[int, int, int, int]:
+    return (
+        get_remote_cache_hits(),
+        get_remote_cache_misses(),
+        get_local_cache_hits(),
+        get_local_cache_misses(),
+    )
+
+
 def record_request_stop_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["time_stopped"] = time.time()
     log_data["remote_cache_time_stopped"] = get_remote_cache_time()
     log_data["remote_cache_requests_stopped"] = get_remote_cache_requests()
+    log_data["cache_gets_stopped"] = get_cache_get_counts()
     log_data["markdown_time_stopped"] = get_markdown_time()
     log_data["markdown_requests_stopped"] = get_markdown_requests()
     if settings.PROFILE_ALL_REQUESTS:
@@ -72,6 +90,7 @@ def record_request_restart_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["time_restarted"] = time.time()
     log_data["remote_cache_time_restarted"] = get_remote_cache_time()
     log_data["remote_cache_requests_restarted"] = get_remote_cache_requests()
+    log_data["cache_gets_restarted"] = get_cache_get_counts()
     log_data["markdown_time_restarted"] = get_markdown_time()
     log_data["markdown_requests_restarted"] = get_markdown_requests()
 
@@ -95,8 +114,10 @@ def record_request_start_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["time_started"] = time.time()
     log_data["remote_cache_time_start"] = get_remote_cache_time()
     log_data["remote_cache_requests_start"] = get_remote_cache_requests()
+    log_data["cache_gets_start"] = get_cache_get_counts()
     log_data["markdown_time_start"] = get_markdown_time()
     log_data["markdown_requests_start"] = get_markdown_requests()
+    log_data["stage_times_start"] = get_stage_times()
 
 
 def timedelta_ms(timedelta: float) -> float:
@@ -164,6 +185,32 @@ def write_log_line(
                 f" (mem: {format_timedelta(remote_cache_time_delta)}/{remote_cache_count_delta})"
             )
 
+    if "cache_gets_start" in log_data:
+        cache_gets_deltas = [
+            now - start
+            for now, start in zip(
+                get_cache_get_counts(), log_data["cache_gets_start"], strict=True
+            )
+        ]
+        if "cache_gets_stopped" in log_data:
+            # (now - restarted) + (stopped - start) = (now - start) + (stopped - restarted)
+            cache_gets_deltas = [
+                delta + stopped - restarted
+                for delta, stopped, restarted in zip(
+                    cache_gets_deltas,
+                    log_data["cache_gets_stopped"],
+                    log_data["cache_gets_restarted"],
+                    strict=True,
+                )
+            ]
+        remote_hits, remote_misses, local_hits, local_misses = cache_gets_deltas
+        if remote_hits + remote_misses + local_hits + local_misses > 0:
+            # Hits out of gets, from memcached and the local cache.
+            remote_cache_output += (
+                f" (hits: mem {remote_hits}/{remote_hits + remote_misses},"
+                f" local {local_hits}/{local_hits + local_misses})"
+            )
+
     startup_output = ""
     if "startup_time_delta" in log_data and log_data["startup_time_delta"] > 0.005:
         startup_output = " (+start: {})".format(format_timedelta(log_data["startup_time_delta"]))
@@ -186,6 +233,22 @@ def write_log_line(
                 f" (md: {format_timedelta(markdown_time_delta)}/{markdown_count_delta})"
             )
 
+    stages_output = ""
+    if "stage_times_start" in log_data:
+        stage_times_start = log_data["stage_times_start"]
+        stage_time_deltas = {
+            stage: stage_time - stage_times_start.get(stage, 0)
+            for stage, stage_time in get_stage_times().items()
+        }
+        if sum(stage_time_deltas.values()) > 0.005:
+            stages_output = " (stages: {})".format(
+                ", ".join(
+                    f"{stage} {format_timedelta(stage_time_delta)}"
+                    for stage, stage_time_delta in stage_time_deltas.items()
+                    if stage_time_delta > 0
+                )
+            )
+
     # Get the amount of time spent doing database queries
     db_time_output = ""
     queries = connection.connection.queries if connection.connection is not None else []
@@ -201,7 +264,7 @@ def write_log_line(
         logger_client = f"({requester_for_logs} via {client_name})"
     else:
         logger_client = f"({requester_for_logs} via {client_name}/{client_version})"
-    logger_timing = f"{format_timedelta(time_delta):>5}{optional_orig_delta}{remote_cache_output}{markdown_output}{db_time_output}{startup_output} {path}"
+    logger_timing = f"{format_timedelta(time_delta):>5}{optional_orig_delta}{remote_cache_output}{markdown_output}{stages_output}{db_time_output}{startup_output} {path}"
     logger_line = f"{remote_ip:<15} {method:<7} {status_code:3} {logger_timing}{extra_request_data} {logger_client}"
     if status_code in [200, 304] and method == "GET" and path.startswith("/static"):
         logger.debug(logger_line)
@@ -526,7 +589,7 @@ class RateLimitMiddleware(MiddlewareMixin):
         return response
 
 
-class FlushDisplayRecipientCache(MiddlewareMixin):
+class FlushPerRequestCaches(MiddlewareMixin):
     def process_response(
         self, request: HttpRequest, response: HttpResponseBase
     ) -> HttpResponseBase:
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0638_alter_stream_can_administer_channel_group"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stream",
+            name="defer_user_messages",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="stream",
+            name="deferred_after_message_id",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="deferred_materialized_message_id",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="read_watermark_message_id",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="has_deferred_subscriptions",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -3,9 +3,10 @@ from django.db.models import CASCADE
 from django.db.models.signals import post_delete, post_save
 
 from zerver.lib.cache import (
+    bump_stream_recipient_info_version,
     cache_delete,
-    realm_alert_words_automaton_cache_key,
     realm_alert_words_cache_key,
+    realm_alert_words_version_cache_key,
 )
 from zerver.models.realms import Realm
 from zerver.models.users import UserProfile
@@ -27,7 +28,10 @@ class AlertWord(models.Model):
 
 def flush_realm_alert_words(realm_id: int) -> None:
     cache_delete(realm_alert_words_cache_key(realm_id))
-    cache_delete(realm_alert_words_automaton_cache_key(realm_id))
+    # The cached automaton is tagged with the version it was built
+    # for, so it's enough to replace the version.
+    cache_delete(realm_alert_words_version_cache_key(realm_id))
+    bump_stream_recipient_info_version(realm_id)
 
 
 def flush_alert_word(*, instance: AlertWord, **kwargs: object) -> None:
@@ -8,6 +8,10 @@ from django.utils.translation import gettext_lazy
 from typing_extensions import override
 
 from zerver.lib.cache import cache_set, cache_with_key
+from zerver.lib.per_request_cache import (
+    flush_per_request_cache,
+    return_same_value_during_entire_request,
+)
 from zerver.models.realms import Realm
 
 
@@ -108,6 +112,7 @@ def get_all_custom_emoji_for_realm_uncached(realm_id: int) -> dict[str, EmojiInf
     return d
 
 
+@return_same_value_during_entire_request
 @cache_with_key(get_all_custom_emoji_for_realm_cache_key, timeout=3600 * 24 * 7)
 def get_all_custom_emoji_for_realm(realm_id: int) -> dict[str, EmojiInfo]:
     return get_all_custom_emoji_for_realm_uncached(realm_id)
@@ -120,6 +125,7 @@ def get_name_keyed_dict_for_active_realm_emoji(realm_id: int) -> dict[str, Emoji
 
 
 def flush_realm_emoji(*, instance: RealmEmoji, **kwargs: object) -> None:
+    flush_per_request_cache("get_all_custom_emoji_for_realm")
     if instance.file_name is None:
         # Because we construct RealmEmoji.file_name using the ID for
         # the RealmEmoji object, it will always have file_name=None,
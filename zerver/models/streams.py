@@ -10,7 +10,7 @@ from django.utils.translation import gettext_lazy
 from django_stubs_ext import StrPromise
 from typing_extensions import override
 
-from zerver.lib.cache import flush_stream
+from zerver.lib.cache import flush_stream, flush_subscription
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.types import DefaultStreamDict, GroupPermissionSetting
 from zerver.models.groups import SystemGroups, UserGroup
@@ -141,6 +141,15 @@ class Stream(models.Model):
     # Whether a message has been sent to this stream in the last X days.
     is_recently_active = models.BooleanField(default=True, db_default=True)
 
+    # For very large channels, we can skip creating UserMessage rows
+    # with the default (zero) flags when a message is sent; they are
+    # created lazily, by add_missing_deferred_messages, when the
+    # subscriber next uses Zulip, like for soft-deactivated users.
+    defer_user_messages = models.BooleanField(default=False)
+    # The ID of the last message sent before defer_user_messages was
+    # first enabled; any later message may lack UserMessage rows.
+    deferred_after_message_id = models.IntegerField(null=True)
+
     stream_permission_group_settings = {
         "can_administer_channel_group": GroupPermissionSetting(
             require_system_group=False,
@@ -338,6 +347,13 @@ class Subscription(models.Model):
     email_notifications = models.BooleanField(null=True, default=None)
     wildcard_mentions_notify = models.BooleanField(null=True, default=None)
 
+    # For streams with Stream.deferred_after_message_id set: the ID of
+    # the last message for which this user's UserMessage rows have
+    # been created, and the ID of the last message which the user has
+    # read, including messages whose rows have not been created yet.
+    deferred_materialized_message_id = models.IntegerField(null=True)
+    read_watermark_message_id = models.IntegerField(null=True)
+
     class Meta:
         unique_together = ("user_profile", "recipient")
         indexes = [
@@ -378,6 +394,10 @@ class Subscription(models.Model):
     ]
 
 
+post_save.connect(flush_subscription, sender=Subscription)
+post_delete.connect(flush_subscription, sender=Subscription)
+
+
 class DefaultStream(models.Model):
     realm = models.ForeignKey(Realm, on_delete=CASCADE)
     stream = models.ForeignKey(Stream, on_delete=CASCADE)
@@ -560,6 +560,11 @@ class UserProfile(AbstractBaseUser, PermissionsMixin, UserBaseSettings):
     # When we last added basic UserMessage rows for a long_term_idle user.
     last_active_message_id = models.IntegerField(null=True)
 
+    # Whether the user has ever been subscribed to a channel with
+    # Stream.deferred_after_message_id set, whose messages may lack
+    # UserMessage rows for them; see add_missing_deferred_messages.
+    has_deferred_subscriptions = models.BooleanField(default=False)
+
     # Mirror dummies are fake (!is_active) users used to provide
     # message senders in our cross-protocol Zephyr<->Zulip content
     # mirroring integration, so that we can display mirrored content
@@ -1122,7 +1127,7 @@ def get_user_by_id_in_realm_including_cross_realm(
     raise UserProfile.DoesNotExist
 
 
-@cache_with_key(realm_user_dicts_cache_key, timeout=3600 * 24 * 7)
+@cache_with_key(realm_user_dicts_cache_key, timeout=3600 * 24 * 7, coalesce_misses=True)
 def get_realm_user_dicts(realm_id: int) -> list[RawUserDict]:
     return list(
         UserProfile.objects.filter(
@@ -1131,7 +1136,7 @@ def get_realm_user_dicts(realm_id: int) -> list[RawUserDict]:
     )
 
 
-@cache_with_key(active_user_ids_cache_key, timeout=3600 * 24 * 7)
+@cache_with_key(active_user_ids_cache_key, timeout=3600 * 24 * 7, coalesce_misses=True)
 def active_user_ids(realm_id: int) -> list[int]:
     query = UserProfile.objects.filter(
         realm_id=realm_id,
@@ -1140,7 +1145,7 @@ def active_user_ids(realm_id: int) -> list[int]:
     return list(query)
 
 
-@cache_with_key(active_non_guest_user_ids_cache_key, timeout=3600 * 24 * 7)
+@cache_with_key(active_non_guest_user_ids_cache_key, timeout=3600 * 24 * 7, coalesce_misses=True)
 def active_non_guest_user_ids(realm_id: int) -> list[int]:
     query = (
         UserProfile.objects.filter(
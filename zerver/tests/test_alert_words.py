@@ -1,9 +1,23 @@
+from unittest import mock
+
 import orjson
 
 from zerver.actions.alert_words import do_add_alert_words, do_remove_alert_words
-from zerver.lib.alert_words import alert_words_in_realm, user_alert_words
+from zerver.lib.alert_words import (
+    alert_words_in_realm,
+    build_alert_word_automaton,
+    get_alert_word_automaton,
+    get_alert_word_automaton_builds,
+    local_alert_word_automatons,
+    user_alert_words,
+)
+from zerver.lib.stage_timing import flush_stage_histograms
 from zerver.lib.test_classes import ZulipTestCase
-from zerver.lib.test_helpers import most_recent_message, most_recent_usermessage
+from zerver.lib.test_helpers import (
+    cache_tries_captured,
+    most_recent_message,
+    most_recent_usermessage,
+)
 from zerver.models import AlertWord, UserProfile
 
 
@@ -111,6 +125,65 @@ class AlertWordTests(ZulipTestCase):
         self.assertEqual(set(realm_words[user1.id]), set(self.interesting_alert_word_list))
         self.assertEqual(set(realm_words[user2.id]), {"another"})
 
+    def test_automaton_caching(self) -> None:
+        user = self.get_user()
+        realm = user.realm
+        do_add_alert_words(user, ["AlertWordTest"])
+
+        def matched_words(content: str) -> set[str]:
+            automaton = get_alert_word_automaton(realm)
+            assert automaton is not None
+            return {word for end_index, (word, user_ids) in automaton.iter(content)}
+
+        with mock.patch(
+            "zerver.lib.alert_words.build_alert_word_automaton",
+            wraps=build_alert_word_automaton,
+        ) as build:
+            self.assertEqual(matched_words("an alertwordtest here"), {"alertwordtest"})
+            self.assertEqual(build.call_count, 1)
+
+            # This process's copy is reused, after checking only the version.
+            with cache_tries_captured() as cache_tries:
+                self.assertEqual(matched_words("alertwordtest"), {"alertwordtest"})
+            self.assert_length(cache_tries, 1)
+            self.assertEqual(build.call_count, 1)
+
+            # Another process gets the automaton from memcached, without rebuilding it.
+            local_alert_word_automatons.clear()
+            with cache_tries_captured() as cache_tries:
+                self.assertEqual(matched_words("alertwordtest"), {"alertwordtest"})
+            self.assert_length(cache_tries, 1)
+            self.assertEqual(build.call_count, 1)
+
+            # Changing alert words rebuilds the automaton exactly once.
+            do_add_alert_words(user, ["OtherAlertWordTest"])
+            self.assertEqual(
+                matched_words("otheralertwordtest"), {"alertwordtest", "otheralertwordtest"}
+            )
+            self.assertEqual(build.call_count, 2)
+
+            do_remove_alert_words(user, ["AlertWordTest"])
+            self.assertEqual(matched_words("otheralertwordtest"), {"otheralertwordtest"})
+            self.assertEqual(build.call_count, 3)
+
+        [build_stats] = [
+            stats for stats in get_alert_word_automaton_builds() if stats.realm_id == realm.id
+        ]
+        realm_words = AlertWord.objects.filter(realm=realm, user_profile__is_active=True)
+        self.assertEqual(
+            build_stats.word_count,
+            len({word.lower() for word in realm_words.values_list("word", flat=True)}),
+        )
+        self.assertGreater(build_stats.total_size, 0)
+
+        flush_stage_histograms()
+        result = self.client_get("/api/internal/metrics")
+        content = result.content.decode()
+        self.assertIn("# TYPE zulip_alert_word_automaton_max_words gauge", content)
+        self.assertIn(
+            'zulip_stage_duration_seconds_count{stage="alert_word_automaton_build"}', content
+        )
+
     def test_json_list_default(self) -> None:
         user = self.get_user()
         self.login_user(user)
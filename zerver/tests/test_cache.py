@@ -1,8 +1,10 @@
 from unittest.mock import Mock, patch
 
 from django.conf import settings
+from django.test import override_settings
 
 from zerver.apps import flush_cache
+from zerver.lib import cache
 from zerver.lib.cache import (
     MEMCACHED_MAX_KEY_LENGTH,
     InvalidCacheKeyError,
@@ -13,12 +15,25 @@ from zerver.lib.cache import (
     cache_get_many,
     cache_set,
     cache_set_many,
+    cache_miss_lock_cache_key,
     cache_with_key,
+    get_cache_backend,
+    get_coalesced_cache_misses,
+    get_local_cache_hits,
+    get_local_cache_version_key,
+    get_remote_cache_requests,
+    local_cache,
     safe_cache_get_many,
     safe_cache_set_many,
     user_profile_by_id_cache_key,
     validate_cache_key,
 )
+from zerver.lib.cache_stats import flush_cache_stats, get_cache_counters
+from zerver.lib.per_request_cache import (
+    flush_per_request_cache,
+    flush_per_request_caches,
+    return_same_value_during_entire_request,
+)
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.models import UserProfile
 from zerver.models.realms import get_realm
@@ -133,6 +148,57 @@ class CacheWithKeyDecoratorTest(ZulipTestCase):
 
         self.assertEqual(result_two, hamlet)
 
+    def test_cache_with_key_coalesce_misses(self) -> None:
+        calls = 0
+
+        @cache_with_key(lambda: "test_coalesce_misses", coalesce_misses=True)
+        def count_calls() -> int:
+            nonlocal calls
+            calls += 1
+            return calls
+
+        self.assertEqual(count_calls(), 1)
+        self.assertEqual(count_calls(), 1)
+
+        # While another process is recomputing the value, we wait for
+        # it, rather than serving the value from before the flush.
+        cache_backend = get_cache_backend(None)
+        lock_key = cache.KEY_PREFIX + cache_miss_lock_cache_key("test_coalesce_misses")
+        cache_backend.add(lock_key, True)
+        cache_delete("test_coalesce_misses")
+        coalesced_cache_misses = get_coalesced_cache_misses()
+
+        def finish_recomputing(seconds: float) -> None:
+            cache_set("test_coalesce_misses", 5)
+
+        with patch("zerver.lib.cache.time.sleep", side_effect=finish_recomputing) as mock_sleep:
+            self.assertEqual(count_calls(), 5)
+        mock_sleep.assert_called_once()
+        self.assertEqual(get_coalesced_cache_misses(), coalesced_cache_misses + 1)
+
+        # If it takes too long, we compute the value ourselves.
+        cache_delete("test_coalesce_misses")
+        with patch("zerver.lib.cache.time.sleep") as mock_sleep:
+            self.assertEqual(count_calls(), 2)
+        self.assertEqual(mock_sleep.call_count, 20)
+
+        # The lock is released after computing the value.
+        cache_backend.delete(lock_key)
+        cache_delete("test_coalesce_misses")
+        self.assertEqual(count_calls(), 3)
+        self.assertIsNone(cache_backend.get(lock_key))
+        self.assertEqual(cache_get("test_coalesce_misses"), (3,))
+
+        flush_cache_stats()
+        counters = get_cache_counters()
+        for event in ["waited", "timed_out", "computed"]:
+            self.assertGreaterEqual(counters["coalesced_miss", event], 1)
+
+        # Waiting would block Tornado's IO loop.
+        cache_delete("test_coalesce_misses")
+        with self.settings(RUNNING_INSIDE_TORNADO=True), self.assertRaises(AssertionError):
+            count_calls()
+
     def test_cache_with_key_none_values(self) -> None:
         def cache_key_function(user_id: int) -> str:
             return f"CacheWithKeyDecoratorTest:test_cache_with_key_none_values:{user_id}"
@@ -235,6 +301,106 @@ class BotCacheKeyTest(ZulipTestCase):
         self.assertEqual(user_profile2.can_forge_sender, flipped_setting)
 
 
+class LocalCacheTest(ZulipTestCase):
+    @override_settings(LOCAL_CACHE_SIZE=10)
+    def test_local_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        key = user_profile_by_id_cache_key(hamlet.id)
+        local_cache.clear()
+        flush_per_request_caches()
+
+        # Filling memcached on a miss drops our own copy, so the
+        # second call is the one which copies the key locally.
+        get_user_profile_by_id(hamlet.id)
+        get_user_profile_by_id(hamlet.id)
+        remote_cache_requests = get_remote_cache_requests()
+        local_cache_hits = get_local_cache_hits()
+        user_profile = get_user_profile_by_id(hamlet.id)
+        self.assertEqual(user_profile, hamlet)
+        self.assertIsNot(user_profile, get_user_profile_by_id(hamlet.id))
+        self.assertEqual(get_remote_cache_requests(), remote_cache_requests)
+        self.assertEqual(get_local_cache_hits(), local_cache_hits + 2)
+
+        # Filling an evicted key after a miss leaves our copies alone.
+        cache_backend = get_cache_backend(None)
+        othello = self.example_user("othello")
+        cache_backend.delete(cache.KEY_PREFIX + user_profile_by_id_cache_key(othello.id))
+        flush_per_request_caches()
+        get_user_profile_by_id(othello.id)
+        local_cache_hits = get_local_cache_hits()
+        get_user_profile_by_id(hamlet.id)
+        self.assertEqual(get_local_cache_hits(), local_cache_hits + 1)
+
+        # Another process changing the key also deletes its version
+        # key, which we only check in the next request.
+        cache_backend.set(cache.KEY_PREFIX + key, ("changed",))
+        cache_backend.delete(
+            cache.KEY_PREFIX + get_local_cache_version_key(key, "user_profile_by_id")
+        )
+        self.assertEqual(cache_get(key), (hamlet,))
+        flush_per_request_caches()
+        self.assertEqual(cache_get(key), ("changed",))
+
+        # Processes which do not flush their per-request caches, such
+        # as long-running loops, check the versions again after a time.
+        cache_backend.set(cache.KEY_PREFIX + key, ("changed again",))
+        cache_backend.delete(
+            cache.KEY_PREFIX + get_local_cache_version_key(key, "user_profile_by_id")
+        )
+        self.assertEqual(cache_get(key), ("changed",))
+        with patch("zerver.lib.cache.LOCAL_CACHE_VERSION_MAX_AGE", 0):
+            self.assertEqual(cache_get(key), ("changed again",))
+
+        # Our own changes are seen immediately.
+        cache_set(key, "set")
+        self.assertEqual(cache_get(key), ("set",))
+        cache_delete(key)
+        self.assertIsNone(cache_get(key))
+
+        # Only the most recently used keys are kept.
+        keys = [user_profile_by_id_cache_key(user_id) for user_id in range(20)]
+        cache_set_many({key: (user_id,) for user_id, key in enumerate(keys)})
+        self.assertEqual(
+            cache_get_many(keys), {key: (user_id,) for user_id, key in enumerate(keys)}
+        )
+        self.assertEqual(list(local_cache), [cache.KEY_PREFIX + key for key in keys[10:]])
+
+
+@return_same_value_during_entire_request
+def per_request_cached_list(first: int, second: int = 0) -> list[int]:
+    return [first, second]
+
+
+class PerRequestCacheTest(ZulipTestCase):
+    def get_counts(self) -> tuple[int, int]:
+        flush_cache_stats()
+        counters = get_cache_counters()
+        return (
+            counters.get(("per_request.per_request_cached_list", "hit"), 0),
+            counters.get(("per_request.per_request_cached_list", "miss"), 0),
+        )
+
+    def test_per_request_cache(self) -> None:
+        flush_per_request_caches()
+        hits, misses = self.get_counts()
+
+        result = per_request_cached_list(1, second=2)
+        self.assertEqual(result, [1, 2])
+        self.assertIs(per_request_cached_list(1, second=2), result)
+        self.assertEqual(per_request_cached_list(1, second=3), [1, 3])
+        self.assertEqual(per_request_cached_list(1), [1, 0])
+        self.assertEqual(self.get_counts(), (hits + 1, misses + 3))
+
+        flush_per_request_cache("per_request_cached_list")
+        self.assertIsNot(per_request_cached_list(1, second=2), result)
+
+        # Requests flush the caches when they finish.
+        result = per_request_cached_list(1, second=2)
+        self.login("hamlet")
+        self.client_get("/json/users/me")
+        self.assertIsNot(per_request_cached_list(1, second=2), result)
+
+
 def get_user_id(user: UserProfile) -> int:
     return user.id  # nocoverage
 
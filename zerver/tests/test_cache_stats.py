@@ -0,0 +1,97 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+
+from zerver.lib.cache import (
+    cache_delete,
+    cache_get,
+    cache_get_many,
+    cache_set,
+    cache_set_many,
+    get_cache_key_family,
+)
+from zerver.lib.cache_stats import (
+    CacheFamilyStats,
+    flush_cache_stats,
+    get_cache_counters,
+    get_cache_stats,
+    record_cache_counter,
+    reset_cache_stats,
+)
+from zerver.lib.test_classes import ZulipTestCase
+
+
+class CacheStatsTest(ZulipTestCase):
+    def get_stats(self, family: str) -> CacheFamilyStats:
+        flush_cache_stats()
+        return get_cache_stats().get(family, CacheFamilyStats())
+
+    def test_get_cache_key_family(self) -> None:
+        self.assertEqual(get_cache_key_family("user_profile_by_id:10"), "user_profile_by_id")
+        self.assertEqual(get_cache_key_family("tor_ip_addresses:"), "tor_ip_addresses")
+        self.assertEqual(get_cache_key_family("1234567"), "other")
+        self.assertEqual(get_cache_key_family("a1b2c3:realm:2"), "other")
+
+    def test_family_stats(self) -> None:
+        before = self.get_stats("test_family")
+
+        with mock.patch("zerver.lib.cache.CACHE_SET_BYTES_SAMPLE_RATE", 1):
+            cache_set("test_family:1", "value")
+            cache_set_many({"test_family:2": ("value",), "other_test_family:1": ("value",)})
+        cache_get("test_family:1")
+        cache_get("test_family:3")
+        cache_get_many(["test_family:1", "test_family:2", "test_family:4"])
+        cache_delete("test_family:1")
+
+        after = self.get_stats("test_family")
+        self.assertEqual(after.hits - before.hits, 3)
+        self.assertEqual(after.misses - before.misses, 2)
+        self.assertEqual(after.sets - before.sets, 2)
+        self.assertGreater(after.set_bytes, before.set_bytes)
+        self.assertEqual(after.deletes - before.deletes, 1)
+        # One observation per request, even if it had several keys.
+        self.assertEqual(after.latency.count - before.latency.count, 6)
+
+        reset_cache_stats()
+        self.assertNotIn("test_family", get_cache_stats())
+
+    def test_metrics_endpoint(self) -> None:
+        cache_get("test_family:1")
+        flush_cache_stats()
+
+        result = self.client_get("/api/internal/metrics")
+        self.assertEqual(result.status_code, 200)
+        content = result.content.decode()
+        self.assertIn('zulip_cache_gets_total{family="test_family",result="miss"}', content)
+        self.assertIn('zulip_cache_request_duration_seconds_count{family="test_family"}', content)
+        self.assertIn("# TYPE zulip_cache_unexplained_misses gauge", content)
+
+    def test_cache_counters(self) -> None:
+        record_cache_counter("test_cache", "hit", 2)
+        record_cache_counter("test.cache", "miss")
+        flush_cache_stats()
+        counters = get_cache_counters()
+        self.assertGreaterEqual(counters["test_cache", "hit"], 2)
+        self.assertGreaterEqual(counters["test.cache", "miss"], 1)
+
+        result = self.client_get("/api/internal/metrics")
+        content = result.content.decode()
+        self.assertIn('zulip_cache_events_total{cache="test_cache",event="hit"}', content)
+
+        reset_cache_stats()
+        self.assertEqual(get_cache_counters(), {})
+
+    def test_cache_stats_command(self) -> None:
+        flush_cache_stats()
+        reset_cache_stats()
+        cache_set("test_family:1", "value")
+        cache_get("test_family:1")
+
+        with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+            call_command("cache_stats", "--reset")
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0].split()[0], "family")
+        [test_family_line] = (line for line in lines if line.startswith("test_family "))
+        self.assertEqual(test_family_line.split()[1:3], ["1", "100.0"])
+        self.assertNotIn("test_family", get_cache_stats())
@@ -12,6 +12,7 @@ from unittest import mock
 import orjson
 from django.conf import settings
 
+from zerver.actions.message_send import do_send_messages
 from zerver.actions.realm_settings import do_deactivate_realm
 from zerver.actions.streams import do_change_stream_post_policy, do_deactivate_stream
 from zerver.actions.users import do_deactivate_user
@@ -276,6 +277,41 @@ class TestStreamEmailMessages(ZulipTestCase):
         self.assert_message_stream_name(message, stream.name)
         self.assertEqual(message.topic_name(), incoming_valid_message["Subject"])
 
+    def test_receive_stream_email_messages_batch(self) -> None:
+        user_profile = self.example_user("hamlet")
+        self.subscribe(user_profile, "Denmark")
+        stream = get_stream("Denmark", user_profile.realm)
+        stream_to_address = encode_email_address(stream)
+
+        events: list[dict[str, Any]] = []
+        for i in range(3):
+            incoming_valid_message = EmailMessage()
+            incoming_valid_message.set_content(f"Batch body {i}")
+            incoming_valid_message["Subject"] = f"Batch subject {i}"
+            incoming_valid_message["From"] = self.example_email("hamlet")
+            incoming_valid_message["To"] = stream_to_address
+            events.append(
+                {
+                    "rcpt_to": stream_to_address,
+                    "msg_base64": base64.b64encode(incoming_valid_message.as_bytes()).decode(),
+                }
+            )
+
+        # The emails are sent together, with a single do_send_messages.
+        with mock.patch(
+            "zerver.lib.email_mirror.do_send_messages", wraps=do_send_messages
+        ) as send_mock:
+            MirrorWorker().consume_batch(events)
+        send_mock.assert_called_once()
+
+        messages = Message.objects.filter(realm_id=stream.realm_id).order_by("-id")[:3]
+        self.assertEqual(
+            [message.content for message in reversed(messages)],
+            ["Batch body 0", "Batch body 1", "Batch body 2"],
+        )
+        for message in messages:
+            self.assert_message_stream_name(message, stream.name)
+
     # Test receiving an email with the address on an UnstructuredHeader
     # (e.g. Envelope-To) instead of an AddressHeader (e.g. To).
     # https://github.com/zulip/zulip/issues/15864
@@ -1154,7 +1190,7 @@ class TestMissedMessageEmailMessages(ZulipTestCase):
         incoming_valid_message["To"] = mm_address
         incoming_valid_message["Reply-to"] = user_profile.delivery_email
 
-        with self.assert_database_query_count(17):
+        with self.assert_database_query_count(16):
             process_message(incoming_valid_message)
 
         # confirm that Hamlet got the message
@@ -1564,7 +1600,7 @@ class TestEmailMirrorTornadoView(ZulipTestCase):
         ) -> None:
             self.assertEqual(queue_name, "email_mirror")
             self.assertEqual(event, {"rcpt_to": to_address, "msg_base64": msg_base64})
-            MirrorWorker().consume(event)
+            MirrorWorker().consume(dict(event))
 
             self.assertEqual(
                 self.get_last_message().content,
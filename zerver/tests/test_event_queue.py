@@ -1,9 +1,12 @@
+import os
+import tempfile
 import time
 from collections.abc import Callable, Collection
 from typing import Any
 from unittest import mock
 
 import orjson
+from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 from typing_extensions import override
 
@@ -14,19 +17,33 @@ from zerver.actions.user_groups import check_add_user_group
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.cache import cache_delete, get_muting_users_cache_key
+from zerver.lib.narrow_predicate import get_distinct_narrow_count
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import HostRequestMock, dummy_handler, mock_queue_publish
 from zerver.models import Recipient, Subscription, UserProfile, UserTopic
 from zerver.models.streams import get_stream
+from zerver.tornado import event_queue
 from zerver.tornado.event_queue import (
+    EVENT_QUEUE_JOURNAL_HEADER,
+    HEARTBEAT_MIN_FREQ_SECS,
+    HEARTBEAT_WHEEL_SLOTS,
     ClientDescriptor,
+    EventQueue,
+    HeartbeatWheel,
+    PreEncodedPayload,
+    SharedPayloadTable,
     access_client_descriptor,
     allocate_client_descriptor,
+    clear_client_event_queues_for_testing,
+    compact_event_queue_journal,
+    dump_event_queues,
+    load_event_queues,
     maybe_enqueue_notifications,
     missedmessage_hook,
     persistent_queue_filename,
     process_notification,
 )
+from zerver.tornado.exceptions import BadEventQueueIdError
 from zerver.tornado.views import cleanup_event_queue, get_events
 
 
@@ -1204,6 +1221,211 @@ class FileReloadLogicTest(ZulipTestCase):
                 "/home/zulip/tornado/event_queues.9800.last.json",
             )
 
+    def allocate_queue(self, user_profile: UserProfile) -> ClientDescriptor:
+        return allocate_client_descriptor(
+            dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=time.time(),
+                queue_timeout=600,
+                realm_id=user_profile.realm_id,
+                user_profile_id=user_profile.id,
+            )
+        )
+
+    def test_dump_and_load_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            self.settings(
+                JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=os.path.join(tmpdir, "event_queues%s.json")
+            ),
+            self.assertLogs(level="INFO"),
+        ):
+            client = self.allocate_queue(hamlet)
+            client.add_event(dict(type="test", value=1))
+            dump_event_queues(9800)
+
+            clear_client_event_queues_for_testing()
+            load_event_queues(9800)
+            self.assertEqual(list(event_queue.clients), [client.event_queue.id])
+            self.assertEqual(
+                event_queue.clients[client.event_queue.id].to_dict(), client.to_dict()
+            )
+
+    def test_dump_and_load_shared_message_payloads(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            self.settings(
+                JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=os.path.join(tmpdir, "event_queues%s.json")
+            ),
+            self.assertLogs(level="INFO") as logs,
+        ):
+            hamlet_client = self.allocate_queue(hamlet)
+            othello_client = self.allocate_queue(othello)
+            payload = dict(id=1, content="<p>hello</p>")
+            hamlet_client.add_event(dict(type="message", message=payload, flags=["mentioned"]))
+            othello_client.add_event(dict(type="message", message=payload, flags=[]))
+            dump_event_queues(9800)
+            self.assertIn("with 1 distinct message payloads", logs.output[-1])
+
+            with open(persistent_queue_filename(9800), "rb") as f:
+                stored = orjson.loads(f.read())
+            self.assertEqual(stored["payloads"], [payload])
+            self.assertEqual(stored["queues"][0][1]["event_queue"]["queue"][0]["message"], 0)
+
+            clear_client_event_queues_for_testing()
+            load_event_queues(9800)
+            [hamlet_event] = event_queue.clients[hamlet_client.event_queue.id].event_queue.queue
+            [othello_event] = event_queue.clients[othello_client.event_queue.id].event_queue.queue
+            self.assertEqual(hamlet_event["message"], payload)
+            self.assertEqual(hamlet_event["flags"], ["mentioned"])
+            self.assertIs(hamlet_event["message"], othello_event["message"])
+
+        # Payloads serialized without a table are interned by value
+        # when loading.
+        queue_dicts = [
+            dict(
+                id=str(i),
+                next_event_id=1,
+                queue=[dict(type="message", message=dict(id=1, content=content), id=0)],
+            )
+            for i, content in enumerate(["a", "a", "b"])
+        ]
+        shared_payloads = SharedPayloadTable()
+        queues = [EventQueue.from_dict(d, shared_payloads) for d in queue_dicts]
+        self.assertIs(queues[0].queue[0]["message"], queues[1].queue[0]["message"])
+        self.assertEqual(queues[2].queue[0]["message"], dict(id=1, content="b"))
+
+    def test_event_queue_journal(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            self.settings(
+                JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=os.path.join(tmpdir, "event_queues%s.json"),
+                TORNADO_EVENT_QUEUE_JOURNAL=True,
+            ),
+            self.assertLogs(level="INFO") as logs,
+        ):
+            filename = persistent_queue_filename(9800)
+            hamlet_client = self.allocate_queue(hamlet)
+            othello_client = self.allocate_queue(othello)
+            hamlet_client.add_event(dict(type="test", value=1))
+            dump_event_queues(9800)
+            with open(filename, "rb") as f:
+                journal = f.read()
+            self.assertTrue(journal.startswith(EVENT_QUEUE_JOURNAL_HEADER))
+            self.assert_length(journal.splitlines(), 3)
+
+            # A journal with several records is loaded as a journal,
+            # not as the JSON written when the journal is disabled.
+            clear_client_event_queues_for_testing()
+            load_event_queues(9800)
+            self.assertEqual(
+                set(event_queue.clients),
+                {hamlet_client.event_queue.id, othello_client.event_queue.id},
+            )
+            self.assertEqual(
+                event_queue.clients[hamlet_client.event_queue.id].to_dict(),
+                hamlet_client.to_dict(),
+            )
+            hamlet_client = event_queue.clients[hamlet_client.event_queue.id]
+            othello_client = event_queue.clients[othello_client.event_queue.id]
+            event_queue.dirty_queue_ids.clear()
+
+            # Only the changed queue, and a tombstone for the removed
+            # queue, are appended by the next checkpoint.
+            othello_client.cleanup()
+            hamlet_client.add_event(dict(type="test", value=2))
+            dump_event_queues(9800)
+            with open(filename, "rb") as f:
+                self.assert_length(f.read().splitlines(), 5)
+            self.assertIn(
+                "INFO:root:Tornado 9800 checkpointed 2 changed event queues (1 removed)",
+                logs.output[-1],
+            )
+
+            # A record truncated by a crash mid-checkpoint is skipped.
+            with open(filename, "ab") as f:
+                f.write(b'["partial", {"user_profile_id"')
+
+            clear_client_event_queues_for_testing()
+            load_event_queues(9800)
+            self.assertEqual(list(event_queue.clients), [hamlet_client.event_queue.id])
+            loaded_client = event_queue.clients[hamlet_client.event_queue.id]
+            self.assertEqual(loaded_client.to_dict(), hamlet_client.to_dict())
+            self.assertEqual(
+                [event["value"] for event in loaded_client.event_queue.contents()], [1, 2]
+            )
+
+            # Loading marks every queue as changed, since the journal
+            # is moved aside on startup; compaction writes one record
+            # per live queue.
+            self.assertEqual(event_queue.dirty_queue_ids, {hamlet_client.event_queue.id})
+            compact_event_queue_journal(9800)
+            self.assertEqual(event_queue.dirty_queue_ids, set())
+            with open(filename, "rb") as f:
+                self.assert_length(f.read().splitlines(), 2)
+
+    def test_event_queue_journal_shared_message_payloads(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            self.settings(
+                JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=os.path.join(tmpdir, "event_queues%s.json"),
+                TORNADO_EVENT_QUEUE_JOURNAL=True,
+            ),
+            self.assertLogs(level="INFO"),
+        ):
+            filename = persistent_queue_filename(9800)
+            hamlet_client = self.allocate_queue(hamlet)
+            othello_client = self.allocate_queue(othello)
+            payload = dict(id=1, content="<p>hello</p>")
+            hamlet_client.add_event(dict(type="message", message=payload, flags=["mentioned"]))
+            othello_client.add_event(dict(type="message", message=payload, flags=[]))
+            dump_event_queues(9800)
+
+            # The payload is written once, before the first queue
+            # which references it.
+            with open(filename, "rb") as f:
+                records = [orjson.loads(line) for line in f.read().splitlines()[1:]]
+            self.assertEqual(records[0], [0, payload])
+            self.assertEqual(records[1][1]["event_queue"]["queue"][0]["message"], 0)
+            self.assertEqual(records[2][1]["event_queue"]["queue"][0]["message"], 0)
+
+            # A later checkpoint only writes payloads which are new.
+            payload2 = dict(id=2, content="<p>again</p>")
+            hamlet_client.add_event(dict(type="message", message=payload2, flags=[]))
+            dump_event_queues(9800)
+            with open(filename, "rb") as f:
+                records = [orjson.loads(line) for line in f.read().splitlines()[1:]]
+            self.assertEqual(records[3], [1, payload2])
+            self.assertEqual(records[4][0], hamlet_client.event_queue.id)
+            self.assert_length(records, 5)
+
+            # After a restart, the queues are written to a new journal,
+            # which numbers its payloads afresh.
+            clear_client_event_queues_for_testing()
+            load_event_queues(9800)
+            othello_client = event_queue.clients[othello_client.event_queue.id]
+            othello_client.add_event(dict(type="message", message=payload2, flags=[]))
+            dump_event_queues(9800)
+
+            clear_client_event_queues_for_testing()
+            load_event_queues(9800)
+            hamlet_events = event_queue.clients[hamlet_client.event_queue.id].event_queue.queue
+            othello_events = event_queue.clients[othello_client.event_queue.id].event_queue.queue
+            self.assertEqual([event["message"] for event in hamlet_events], [payload, payload2])
+            self.assertEqual([event["message"] for event in othello_events], [payload, payload2])
+            self.assertIs(hamlet_events[0]["message"], othello_events[0]["message"])
+
 
 class PruneInternalDataTest(ZulipTestCase):
     def test_prune_internal_data(self) -> None:
@@ -1241,6 +1463,18 @@ class PruneInternalDataTest(ZulipTestCase):
         self.assertTrue("internal_data" in events[1])
         self.assertTrue("internal_data" in events[2])
 
+        # The pre-encoded form, used for get_events responses, splices
+        # in each message payload's cached encoding, and serializes
+        # identically.
+        self.assertIsInstance(events[0]["message"], PreEncodedPayload)
+        pre_encoded_events = client.event_queue.contents(pre_encoded=True)
+        self.assertFalse("internal_data" in pre_encoded_events[0])
+        self.assertIsInstance(pre_encoded_events[0]["message"], orjson.Fragment)
+        self.assertEqual(
+            orjson.dumps(pre_encoded_events), orjson.dumps(client.event_queue.contents())
+        )
+        self.assertTrue("internal_data" in client.event_queue.queue[0])
+
 
 class EventQueueTest(ZulipTestCase):
     def get_client_descriptor(self) -> ClientDescriptor:
@@ -1506,6 +1740,113 @@ class EventQueueTest(ZulipTestCase):
         queue.prune(1)
         self.verify_to_dict_end_to_end(client)
 
+    def test_gc_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+
+        def allocate_queue(last_connection_time: float) -> ClientDescriptor:
+            queue_data = dict(
+                all_public_streams=False,
+                apply_markdown=False,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=last_connection_time,
+                queue_timeout=0,
+                realm_id=hamlet.realm_id,
+                user_profile_id=hamlet.id,
+            )
+            return allocate_client_descriptor(queue_data)
+
+        now = time.time()
+        expired_client = allocate_queue(now - 1000)
+        idle_client = allocate_queue(now)
+        connected_client = allocate_queue(now - 1000)
+        connected_client.connect_handler(1234, "website")
+
+        event_queue.gc_event_queues(9800)
+        with self.assertRaises(BadEventQueueIdError):
+            access_client_descriptor(hamlet.id, expired_client.event_queue.id)
+        access_client_descriptor(hamlet.id, idle_client.event_queue.id)
+        access_client_descriptor(hamlet.id, connected_client.event_queue.id)
+        # Each remaining queue has one entry in the heap; the entry
+        # of the connected queue was pushed back to its current expiry.
+        self.assertEqual(
+            sorted(event_queue.expiry_heap),
+            sorted(
+                [
+                    (idle_client.expiry_time(), idle_client.event_queue.id),
+                    (connected_client.expiry_time(), connected_client.event_queue.id),
+                ]
+            ),
+        )
+
+        # Long-polls finishing do not add entries.
+        connected_client.disconnect_handler()
+        connected_client.connect_handler(1235, "website")
+        connected_client.disconnect_handler()
+        self.assert_length(event_queue.expiry_heap, 2)
+
+    def test_event_queue_overflow(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.get_client_descriptor()
+
+        with self.settings(EVENT_QUEUE_MAX_EVENTS=2):
+            for value in range(2):
+                process_notification(dict(event=dict(type="test", value=value), users=[hamlet.id]))
+            access_client_descriptor(hamlet.id, client.event_queue.id)
+
+            with self.assertLogs(level="INFO") as logs:
+                process_notification(dict(event=dict(type="test", value=2), users=[hamlet.id]))
+            self.assertEqual(
+                logs.output, ["INFO:root:Tornado removed 1 event queues with more than 2 events"]
+            )
+        with self.assertRaises(BadEventQueueIdError):
+            access_client_descriptor(hamlet.id, client.event_queue.id)
+
+    def test_event_queue_stats(self) -> None:
+        client = self.get_client_descriptor()
+        client.event_queue.push(dict(type="test", value=1))
+        self.get_client_descriptor()
+
+        post_data = {"limit": "1", "secret": settings.SHARED_SECRET}
+        req = HostRequestMock(post_data, tornado_handler=dummy_handler)
+        req.META["REMOTE_ADDR"] = "127.0.0.1"
+        result = self.client_post_request("/api/internal/event_queue_stats", req)
+        stats = self.assert_json_success(result)
+        self.assertEqual(stats["queue_count"], len(event_queue.clients))
+        self.assertEqual(stats["distinct_narrow_count"], get_distinct_narrow_count())
+        queues = stats["queues"]
+        self.assert_length(queues, 1)
+        self.assertEqual(queues[0]["queue_id"], client.event_queue.id)
+        self.assertEqual(queues[0]["events"], 1)
+        self.assertEqual(queues[0]["bytes"], len(orjson.dumps(client.event_queue.to_dict())))
+
+    def test_heartbeat_wheel(self) -> None:
+        client = self.get_client_descriptor()
+        wheel = HeartbeatWheel()
+        start = wheel.position
+        with (
+            mock.patch.object(event_queue, "heartbeat_wheel", wheel),
+            mock.patch("zerver.tornado.event_queue.random.randint", return_value=0),
+        ):
+            client.connect_handler(1234, "website")
+            self.assertEqual(client.heartbeat_due, start + HEARTBEAT_MIN_FREQ_SECS)
+
+            self.assertEqual(wheel.advance(start + HEARTBEAT_MIN_FREQ_SECS - 1), 0)
+            self.assertEqual(wheel.advance(start + HEARTBEAT_MIN_FREQ_SECS), 1)
+            self.assertEqual(
+                [event["type"] for event in client.event_queue.contents()], ["heartbeat"]
+            )
+            # Delivering the heartbeat finished the long-poll.
+            self.assertIsNone(client.current_handler_id)
+            self.assertIsNone(client.heartbeat_due)
+
+            # Disconnecting cancels the pending heartbeat.
+            client.connect_handler(1235, "website")
+            client.disconnect_handler()
+            self.assertEqual(wheel.advance(wheel.position + 2 * HEARTBEAT_WHEEL_SLOTS), 0)
+            self.assert_length(client.event_queue.contents(), 1)
+
 
 class SchemaMigrationsTests(ZulipTestCase):
     def test_reformat_legacy_send_message_event(self) -> None:
@@ -1,11 +1,14 @@
 import time
 from collections.abc import Callable
+from contextlib import suppress
 from typing import Any
 from unittest import mock
 from urllib.parse import urlsplit
 
 import orjson
+import responses
 from django.conf import settings
+from django.db import transaction
 from django.http import HttpRequest, HttpResponse
 from django.test import override_settings
 from django.utils.timezone import now as timezone_now
@@ -18,7 +21,8 @@ from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_change_user_role
 from zerver.lib.event_schema import check_web_reload_client_event
 from zerver.lib.events import fetch_initial_state_data, post_process_state
-from zerver.lib.exceptions import AccessDeniedError
+from zerver.lib.exceptions import AccessDeniedError, JsonableError
+from zerver.lib.queue import queue_json_publish_rollback_unsafe
 from zerver.lib.request import RequestVariableMissingError
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import (
@@ -34,13 +38,23 @@ from zerver.models.realms import get_realm, get_realm_with_settings
 from zerver.models.streams import get_stream
 from zerver.models.users import get_system_bot
 from zerver.tornado.event_queue import (
+    ClientDescriptor,
+    abort_event_queue_handoff,
+    access_client_descriptor,
     allocate_client_descriptor,
     clear_client_event_queues_for_testing,
+    complete_event_queue_handoff,
+    expiry_heap,
+    export_event_queues,
     get_client_info_for_message_event,
+    import_event_queues,
     mark_clients_to_reload,
     process_message_event,
+    process_notification,
+    realm_clients_by_narrowed_stream,
     send_web_reload_client_events,
 )
+from zerver.tornado.django_api import send_event_on_commit
 from zerver.tornado.exceptions import BadEventQueueIdError
 from zerver.tornado.views import get_events
 from zerver.views.events_register import _default_all_public_streams, _default_narrow
@@ -897,6 +911,53 @@ class ClientDescriptorsTest(ZulipTestCase):
         dct = client_info[client.event_queue.id]
         self.assertEqual(dct["is_sender"], True)
 
+    def test_get_client_info_for_narrowed_streams(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+
+        def allocate(narrow: list[list[str]], event_types: list[str] | None = None) -> str:
+            queue_data = dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=event_types,
+                last_connection_time=time.time(),
+                narrow=narrow,
+                queue_timeout=0,
+                realm_id=realm.id,
+                user_profile_id=hamlet.id,
+            )
+            return allocate_client_descriptor(queue_data).event_queue.id
+
+        denmark_queue_id = allocate([["channel", "Denmark"], ["topic", "lunch"]])
+        mentioned_queue_id = allocate([["is", "mentioned"]])
+        # Clients narrowed to other channels, or not receiving message
+        # events at all, are never considered for a Denmark message.
+        for i in range(10):
+            allocate([["stream", f"other stream {i}"]])
+        allocate([["is", "mentioned"]], event_types=["presence"])
+
+        message_event = dict(
+            realm_id=realm.id,
+            stream_name="denmark",
+        )
+        client_info = get_client_info_for_message_event(message_event, users=[])
+        self.assertEqual(set(client_info), {denmark_queue_id, mentioned_queue_id})
+
+        message_event = dict(
+            realm_id=realm.id,
+            stream_name="Verona",
+        )
+        client_info = get_client_info_for_message_event(message_event, users=[])
+        self.assertEqual(set(client_info), {mentioned_queue_id})
+
+        # Garbage-collecting a queue removes it from the index.
+        self.assert_length(realm_clients_by_narrowed_stream[realm.id], 11)
+        access_client_descriptor(hamlet.id, denmark_queue_id).cleanup()
+        self.assertNotIn("denmark", realm_clients_by_narrowed_stream[realm.id])
+        self.assert_length(realm_clients_by_narrowed_stream[realm.id], 10)
+
     def test_get_client_info_for_normal_users(self) -> None:
         hamlet = self.example_user("hamlet")
         cordelia = self.example_user("cordelia")
@@ -1142,6 +1203,223 @@ class ClientDescriptorsTest(ZulipTestCase):
         )
 
 
+class SendEventOnCommitTest(ZulipTestCase):
+    def test_events_batched_per_transaction(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=0,
+            realm_id=realm.id,
+            user_profile_id=hamlet.id,
+        )
+        client = allocate_client_descriptor(queue_data)
+
+        with (
+            mock.patch(
+                "zerver.tornado.django_api.queue_json_publish_rollback_unsafe",
+                wraps=queue_json_publish_rollback_unsafe,
+            ) as mock_publish,
+            self.captureOnCommitCallbacks(execute=True),
+            transaction.atomic(savepoint=True),
+        ):
+            send_event_on_commit(realm, dict(type="test", value=1), [hamlet.id])
+            send_event_on_commit(realm, dict(type="test", value=2), [hamlet.id])
+            # Events in a savepoint which is rolled back are not sent.
+            with suppress(AssertionError), transaction.atomic(savepoint=True):
+                send_event_on_commit(realm, dict(type="test", value=3), [hamlet.id])
+                raise AssertionError
+            send_event_on_commit(realm, dict(type="test", value=4), [hamlet.id])
+            # Another on_commit callback ends the batch, so that events
+            # are not sent before callbacks which preceded them.
+            transaction.on_commit(lambda: None)
+            send_event_on_commit(realm, dict(type="test", value=5), [hamlet.id])
+
+        self.assertEqual(
+            [call.args[1] for call in mock_publish.call_args_list],
+            [
+                dict(
+                    notices=[
+                        dict(event=dict(type="test", value=1), users=[hamlet.id]),
+                        dict(event=dict(type="test", value=2), users=[hamlet.id]),
+                    ]
+                ),
+                dict(event=dict(type="test", value=4), users=[hamlet.id]),
+                dict(event=dict(type="test", value=5), users=[hamlet.id]),
+            ],
+        )
+        self.assertEqual([event["value"] for event in client.event_queue.contents()], [1, 2, 4, 5])
+
+
+class EventQueueHandoffTest(ZulipTestCase):
+    def allocate_queue(self, user_profile: UserProfile) -> ClientDescriptor:
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=0,
+            realm_id=user_profile.realm_id,
+            user_profile_id=user_profile.id,
+        )
+        return allocate_client_descriptor(queue_data)
+
+    def test_hand_off_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        hamlet_client = self.allocate_queue(hamlet)
+        cordelia_client = self.allocate_queue(cordelia)
+        hamlet_client.add_event(dict(type="test", value=1))
+
+        exported = export_event_queues({hamlet.id: 9801})
+        self.assertEqual(list(exported), [9801])
+        self.assert_length(exported[9801], 1)
+        with self.assertRaises(BadEventQueueIdError):
+            access_client_descriptor(hamlet.id, hamlet_client.event_queue.id)
+
+        forwarded_notice = dict(event=dict(type="test", value=2), users=[hamlet.id], forwarded=True)
+        with mock.patch(
+            "zerver.tornado.event_queue.queue_json_publish_rollback_unsafe"
+        ) as mock_publish:
+            process_notification(
+                dict(event=dict(type="test", value=2), users=[hamlet.id, cordelia.id])
+            )
+            # Events for handed-off queues are held back until the
+            # new process has imported them.
+            mock_publish.assert_not_called()
+            complete_event_queue_handoff(9801)
+        mock_publish.assert_called_once()
+        self.assertEqual(mock_publish.call_args.args[:2], ("notify_tornado", forwarded_notice))
+        self.assertEqual([event["value"] for event in cordelia_client.event_queue.contents()], [2])
+
+        # Now act as the new process.
+        clear_client_event_queues_for_testing()
+        queues = orjson.loads(orjson.dumps(exported[9801]))
+        self.assertEqual(import_event_queues(queues), 1)
+        self.assertEqual(import_event_queues(queues), 0)
+        process_notification(forwarded_notice)
+        client = access_client_descriptor(hamlet.id, hamlet_client.event_queue.id)
+        self.assertEqual([event["value"] for event in client.event_queue.contents()], [1, 2])
+
+    def test_no_duplicate_messages_during_handoff(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.allocate_queue(hamlet)
+        queues = orjson.loads(orjson.dumps(export_event_queues({hamlet.id: 9801})[9801]))
+        complete_event_queue_handoff(9801)
+
+        clear_client_event_queues_for_testing()
+        self.assertEqual(import_event_queues(queues), 1)
+        client = access_client_descriptor(hamlet.id, client.event_queue.id)
+        client_info = {client.event_queue.id: dict(client=client, flags=[])}
+        message_event = dict(
+            message_dict=dict(
+                id=999,
+                content="hello",
+                rendered_content="<p>hello</p>",
+                sender_id=hamlet.id,
+                type="stream",
+                client="website",
+                sender_email=hamlet.email,
+                sender_delivery_email=hamlet.delivery_email,
+                sender_realm_id=hamlet.realm_id,
+                sender_avatar_source=UserProfile.AVATAR_FROM_GRAVATAR,
+                sender_avatar_version=1,
+                sender_is_mirror_dummy=None,
+                sender_email_address_visibility=UserProfile.EMAIL_ADDRESS_VISIBILITY_EVERYONE,
+                recipient_type=None,
+                recipient_type_id=None,
+            ),
+        )
+
+        # The message arrives both from a Django process using the
+        # old sharding configuration and forwarded by the old process.
+        with mock.patch(
+            "zerver.tornado.event_queue.get_client_info_for_message_event",
+            return_value=client_info,
+        ):
+            process_message_event(message_event, [])
+            process_message_event(message_event, [])
+        message_ids = [event["message"]["id"] for event in client.event_queue.contents()]
+        self.assertEqual(message_ids, [999])
+
+    def test_receive_event_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.allocate_queue(hamlet)
+        queues = export_event_queues({hamlet.id: 9801})[9801]
+        complete_event_queue_handoff(9801)
+
+        post_data = {
+            "queues": orjson.dumps(queues).decode(),
+            "secret": settings.SHARED_SECRET,
+        }
+        req = HostRequestMock(post_data, tornado_handler=dummy_handler)
+        req.META["REMOTE_ADDR"] = "127.0.0.1"
+        result = self.client_post_request("/api/internal/receive_event_queues", req)
+        self.assert_json_success(result)
+        self.assertEqual(orjson.loads(result.content)["imported_queues"], 1)
+        access_client_descriptor(hamlet.id, client.event_queue.id)
+
+    def test_rebalance_with_stale_sharding_configuration(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.allocate_queue(hamlet)
+
+        post_data = {"version": "stale", "secret": settings.SHARED_SECRET}
+        req = HostRequestMock(post_data, tornado_handler=dummy_handler)
+        req.META["REMOTE_ADDR"] = "127.0.0.1"
+        with (
+            mock.patch("zerver.tornado.views.get_user_id_tornado_port", return_value=9801),
+            self.assertRaises(JsonableError),
+        ):
+            self.client_post_request("/api/internal/rebalance_event_queues", req)
+        access_client_descriptor(hamlet.id, client.event_queue.id)
+
+    def test_abort_handoff_schedules_expiry_once(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.allocate_queue(hamlet)
+        queues = export_event_queues({hamlet.id: 9801})[9801]
+        self.assertNotIn(client.event_queue.id, [id for _, id in expiry_heap])
+
+        abort_event_queue_handoff(9801, queues)
+        access_client_descriptor(hamlet.id, client.event_queue.id)
+        self.assertEqual([id for _, id in expiry_heap].count(client.event_queue.id), 1)
+
+    def test_rebalance_rejected_by_other_process(self) -> None:
+        hamlet = self.example_user("hamlet")
+        client = self.allocate_queue(hamlet)
+        client.add_event(dict(type="test", value=1))
+
+        # There is no sharding configuration in the test suite.
+        post_data = {"version": "", "secret": settings.SHARED_SECRET}
+        req = HostRequestMock(post_data, tornado_handler=dummy_handler)
+        req.META["REMOTE_ADDR"] = "127.0.0.1"
+        with (
+            mock.patch("zerver.tornado.views.get_user_id_tornado_port", return_value=9801),
+            responses.RequestsMock() as mock_requests,
+            self.assertLogs(level="ERROR") as logs,
+        ):
+            mock_requests.add(
+                responses.POST,
+                "http://127.0.0.1:9801/api/internal/receive_event_queues",
+                json={"result": "error", "msg": "Internal server error"},
+                status=500,
+            )
+            result = self.client_post_request("/api/internal/rebalance_event_queues", req)
+        self.assert_json_success(result)
+        self.assertEqual(orjson.loads(result.content)["handed_off_queues"], 0)
+        self.assertIn("Failed to hand off 1 event queues to port 9801", logs.output[0])
+
+        # The queue, and its events, stay with this process.
+        client = access_client_descriptor(hamlet.id, client.event_queue.id)
+        self.assertEqual([event["value"] for event in client.event_queue.contents()], [1])
+
+
 class ReloadWebClientsTest(ZulipTestCase):
     def test_web_reload_clients(self) -> None:
         hamlet = self.example_user("hamlet")
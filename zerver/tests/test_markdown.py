@@ -53,8 +53,10 @@ from zerver.lib.mention import (
     MentionBackend,
     MentionData,
     PossibleMentions,
+    PossibleSyntax,
     get_possible_mentions_info,
     possible_mentions,
+    possible_syntax,
     possible_user_group_mentions,
     stream_wildcards,
     topic_wildcards,
@@ -3140,6 +3142,43 @@ class MarkdownStreamMentionTests(ZulipTestCase):
             {"test here", "Denmark", "garçon", "천국"},
         )
 
+    def test_possible_syntax(self) -> None:
+        content = "@**King Hamlet** @*support* #**Denmark>danish** :smile: @_**all**"
+        self.assertEqual(
+            possible_syntax(content),
+            PossibleSyntax(
+                mentions=PossibleMentions(
+                    mention_texts={"King Hamlet"},
+                    message_has_topic_wildcards=False,
+                    message_has_stream_wildcards=True,
+                ),
+                user_group_names={"support"},
+                stream_names={"Denmark>danish", "Denmark"},
+                has_emoji_syntax=True,
+            ),
+        )
+        # Matches can overlap, so we don't miss anything the Markdown
+        # processor might find.
+        self.assertEqual(possible_syntax("@**a @**b**").mentions.mention_texts, {"a @", "b"})
+
+        # Rendering with a MentionData for the same content doesn't
+        # scan the content again.
+        sender_user_profile = self.example_user("othello")
+        msg = Message(
+            sender=sender_user_profile,
+            sending_client=get_client("test"),
+            realm=sender_user_profile.realm,
+        )
+        mention_data = MentionData(
+            MentionBackend(sender_user_profile.realm_id), content, sender_user_profile
+        )
+        with mock.patch(
+            "zerver.lib.markdown.possible_syntax", wraps=possible_syntax
+        ) as possible_syntax_mock:
+            rendering_result = render_message_markdown(msg, content, mention_data=mention_data)
+        possible_syntax_mock.assert_not_called()
+        self.assertIn('class="stream-topic"', rendering_result.rendered_content)
+
     def test_stream_unicode(self) -> None:
         realm = get_realm("zulip")
         uni = self.make_stream(stream_name="привет", realm=realm)
@@ -1,13 +1,21 @@
+import zlib
 from typing import Any
 from unittest import mock
 
+import orjson
 from django.utils.timezone import now as timezone_now
 
 from zerver.lib.cache import cache_delete, to_dict_cache_key_id
 from zerver.lib.display_recipient import get_display_recipient
 from zerver.lib.markdown import version as markdown_version
 from zerver.lib.message import messages_for_ids
-from zerver.lib.message_cache import MessageDict, sew_messages_and_reactions
+from zerver.lib.message_cache import (
+    MESSAGE_CACHE_FORMAT_VERSION,
+    MessageDict,
+    extract_message_dict,
+    sew_messages_and_reactions,
+    stringify_message_dict,
+)
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import make_client
@@ -303,6 +311,28 @@ class MessageDictTest(ZulipTestCase):
         self.assertEqual(msg_dict["reactions"][0]["user"]["email"], sender.email)
         self.assertEqual(msg_dict["reactions"][0]["user"]["full_name"], sender.full_name)
 
+    def test_cache_encoding(self) -> None:
+        sender = self.example_user("othello")
+        msg_id = self.send_stream_message(sender, "Denmark", "hello **world**")
+        self.api_post(sender, f"/api/v1/messages/{msg_id}/reactions", {"emoji_name": "smile"})
+        self.api_patch(sender, f"/api/v1/messages/{msg_id}", {"content": "goodbye"})
+        msg_dict = MessageDict.ids_to_dict([msg_id])[0]
+        self.assertIn("edit_history", msg_dict)
+        self.assertNotEqual(msg_dict["reactions"], [])
+
+        encoded = stringify_message_dict(msg_dict)
+        self.assertEqual(encoded[0], MESSAGE_CACHE_FORMAT_VERSION)
+        self.assertEqual(extract_message_dict(encoded), msg_dict)
+        self.assertLess(len(encoded), len(zlib.compress(orjson.dumps(msg_dict))))
+
+        # Keys outside the table are preserved, as are missing ones.
+        del msg_dict["edit_history"]
+        msg_dict["extra_key"] = None
+        self.assertEqual(extract_message_dict(stringify_message_dict(msg_dict)), msg_dict)
+
+        with self.assertRaisesRegex(ValueError, "Unknown message cache format version"):
+            extract_message_dict(zlib.compress(orjson.dumps(msg_dict)))
+
     def test_missing_anchor(self) -> None:
         self.login("hamlet")
         result = self.client_get(
@@ -43,7 +43,13 @@ from zerver.lib.narrow import (
     post_process_limited_query,
 )
 from zerver.lib.narrow_helpers import NarrowTerm
-from zerver.lib.narrow_predicate import build_narrow_predicate
+from zerver.lib.narrow_predicate import (
+    SharedNarrowPredicate,
+    build_narrow_predicate,
+    canonicalize_narrow,
+    get_distinct_narrow_count,
+    get_shared_narrow_predicate,
+)
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
 from zerver.lib.streams import StreamDict, create_streams_if_needed, get_public_streams_queryset
 from zerver.lib.test_classes import ZulipTestCase
@@ -980,6 +986,110 @@ class NarrowLibraryTest(ZulipTestCase):
         with self.assertRaises(JsonableError):
             build_narrow_predicate([NarrowTerm(operator="is", operand="followed")])
 
+    def test_shared_narrow_predicate(self) -> None:
+        self.assertEqual(
+            canonicalize_narrow(
+                [
+                    NarrowTerm(operator="topic", operand="Python"),
+                    NarrowTerm(operator="stream", operand="Devel"),
+                    NarrowTerm(operator="is", operand="alerted"),
+                ]
+            ),
+            (("channel", "devel"), ("is", "mentioned"), ("topic", "python")),
+        )
+
+        narrow_predicate = get_shared_narrow_predicate(
+            [
+                NarrowTerm(operator="channel", operand="devel"),
+                NarrowTerm(operator="is", operand="alerted"),
+            ]
+        )
+        assert isinstance(narrow_predicate, SharedNarrowPredicate)
+        self.assertIs(
+            get_shared_narrow_predicate(
+                [
+                    NarrowTerm(operator="is", operand="mentioned"),
+                    NarrowTerm(operator="stream", operand="Devel"),
+                ]
+            ),
+            narrow_predicate,
+        )
+        self.assertIsNot(
+            get_shared_narrow_predicate([NarrowTerm(operator="channel", operand="devel")]),
+            narrow_predicate,
+        )
+        distinct_narrow_count = get_distinct_narrow_count()
+
+        # Results are evaluated once per message and set of flags.
+        message = {"display_recipient": "devel", "type": "stream"}
+        self.assertTrue(narrow_predicate(message=message, flags=["mentioned"]))
+        self.assertFalse(narrow_predicate(message=message, flags=[]))
+        self.assertEqual(narrow_predicate.results, {("mentioned",): True, (): False})
+        self.assertTrue(narrow_predicate(message=message, flags=["mentioned"]))
+
+        other_message = {"display_recipient": "social", "type": "stream"}
+        self.assertFalse(narrow_predicate(message=other_message, flags=["mentioned"]))
+        self.assertEqual(narrow_predicate.results, {("mentioned",): False})
+
+        # Predicates no longer used by any queue are dropped.
+        del narrow_predicate
+        self.assertEqual(get_distinct_narrow_count(), distinct_narrow_count - 1)
+
+    def test_canonicalize_narrow_case_handling(self) -> None:
+        # For every operator supported in event queue narrows, the
+        # canonical narrow, whose operands may be lowercased, must
+        # accept exactly the messages the original narrow accepts.
+        messages = [
+            {"type": "stream", "display_recipient": "Devel", "subject": "Python"},
+            {"type": "stream", "display_recipient": "devel", "subject": "python"},
+            {"type": "stream", "display_recipient": "Denmark", "subject": "✔ Python"},
+            {"type": "private", "sender_email": "Hamlet@zulip.com"},
+            {"type": "private", "sender_email": "hamlet@zulip.com"},
+        ]
+        for message in messages:
+            message.setdefault("sender_email", "othello@zulip.com")
+        flag_sets: list[list[str]] = [[], ["read"], ["mentioned"], ["starred", "read"]]
+        narrows = [
+            *(
+                [NarrowTerm(operator=operator, operand=operand)]
+                for operator in ["channel", "stream"]
+                for operand in ["Devel", "devel", "DEVEL"]
+            ),
+            *(
+                [NarrowTerm(operator=operator, operand=operand)]
+                for operator in ["topic", "sender"]
+                for operand in ["Python", "python", "Hamlet@zulip.com", "hamlet@ZULIP.com"]
+            ),
+            *(
+                [NarrowTerm(operator="is", operand=operand)]
+                for operand in [
+                    "dm",
+                    "private",
+                    "starred",
+                    "unread",
+                    "alerted",
+                    "mentioned",
+                    "resolved",
+                    "Mentioned",
+                ]
+            ),
+        ]
+        for narrow in narrows:
+            canonical_predicate = build_narrow_predicate(
+                [
+                    NarrowTerm(operator=operator, operand=operand)
+                    for operator, operand in canonicalize_narrow(narrow)
+                ]
+            )
+            narrow_predicate = build_narrow_predicate(narrow)
+            for message in messages:
+                for flags in flag_sets:
+                    self.assertEqual(
+                        canonical_predicate(message=message, flags=flags),
+                        narrow_predicate(message=message, flags=flags),
+                        (narrow, message, flags),
+                    )
+
     def test_is_spectator_compatible(self) -> None:
         self.assertTrue(is_spectator_compatible([]))
         self.assertTrue(
@@ -10,6 +10,7 @@ from django.utils.timezone import now as timezone_now
 from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.message_edit import (
     check_update_message,
+    do_continue_message_move,
     do_update_message,
     maybe_send_resolve_topic_notifications,
 )
@@ -1004,6 +1005,42 @@ class MessageMoveTopicTest(ZulipTestCase):
         self.assert_json_success(result)
         verify_edit_history(new_topic_name, 2)
 
+    def test_topic_edit_history_spliced(self) -> None:
+        self.login("hamlet")
+        id1 = self.send_stream_message(self.example_user("hamlet"), "Denmark", topic_name="topic1")
+        id2 = self.send_stream_message(self.example_user("iago"), "Denmark", topic_name="topic1")
+        id3 = self.send_stream_message(self.example_user("iago"), "Denmark", topic_name="topic1")
+
+        # Older histories may be empty lists, or have been re-encoded
+        # by PostgreSQL with different whitespace.
+        old_event_json = '{"user_id": 10, "timestamp": 1000, "prev_topic": "old", "topic": "topic1"}'
+        Message.objects.filter(id=id2).update(edit_history="[]")
+        Message.objects.filter(id=id3).update(edit_history=f"[{old_event_json}]")
+
+        result = self.client_patch(
+            f"/json/messages/{id1}",
+            {
+                "topic": "edited",
+                "propagate_mode": "change_all",
+            },
+        )
+        self.assert_json_success(result)
+
+        edit_histories = {
+            message.id: assert_is_not_none(message.edit_history)
+            for message in Message.objects.filter(id__in=[id1, id2, id3])
+        }
+        [new_event] = orjson.loads(edit_histories[id1])
+        self.assertEqual(new_event["prev_topic"], "topic1")
+        self.assertEqual(new_event["topic"], "edited")
+        new_event_json = orjson.dumps(new_event).decode()
+        self.assertEqual(edit_histories[id1], f"[{new_event_json}]")
+        self.assertEqual(edit_histories[id2], f"[{new_event_json}]")
+        self.assertEqual(edit_histories[id3], f"[{new_event_json},{old_event_json}]")
+        self.assertEqual(
+            orjson.loads(edit_histories[id3]), [new_event, orjson.loads(old_event_json)]
+        )
+
     def test_topic_and_content_edit(self) -> None:
         self.login("hamlet")
         id1 = self.send_stream_message(self.example_user("hamlet"), "Denmark", "message 1", "topic")
@@ -1274,6 +1311,106 @@ class MessageMoveTopicTest(ZulipTestCase):
             f"This topic was moved here from #**public stream>test** by @_**Iago|{user_profile.id}**.",
         )
 
+    @override_settings(MOVE_MESSAGES_BATCH_SIZE=2)
+    def test_move_topic_in_batches(self) -> None:
+        user_profile = self.example_user("iago")
+        self.login("iago")
+        stream = self.make_stream("public stream")
+        self.subscribe(user_profile, stream.name)
+        message_ids = [
+            self.send_stream_message(
+                user_profile, stream.name, topic_name="test", content=f"Message {i}"
+            )
+            for i in range(6)
+        ]
+
+        # The first 3 messages are moved by the request, and the last
+        # one by the deferred_work queue processor.
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.client_patch(
+                f"/json/messages/{message_ids[2]}",
+                {
+                    "topic": "edited",
+                    "propagate_mode": "change_later",
+                    "send_notification_to_old_thread": "true",
+                    "send_notification_to_new_thread": "true",
+                },
+            )
+        self.assert_json_success(result)
+
+        messages = get_topic_messages(user_profile, stream, "test")
+        self.assertEqual([message.id for message in messages[:2]], message_ids[:2])
+        self.assert_length(messages, 3)
+        self.assertEqual(
+            messages[2].content,
+            f"4 messages were moved from this topic to #**public stream>edited** by @_**Iago|{user_profile.id}**.",
+        )
+
+        messages = get_topic_messages(user_profile, stream, "edited")
+        self.assertEqual([message.id for message in messages[:4]], message_ids[2:])
+        self.assert_length(messages, 5)
+        self.assertEqual(
+            messages[4].content,
+            f"4 messages were moved here from #**public stream>test** by @_**Iago|{user_profile.id}**.",
+        )
+
+        edit_timestamps = {
+            orjson.loads(assert_is_not_none(message.edit_history))[0]["timestamp"]
+            for message in messages[:4]
+        }
+        self.assert_length(edit_timestamps, 1)
+
+    @override_settings(MOVE_MESSAGES_BATCH_SIZE=2)
+    def test_move_topic_in_batches_skips_new_messages(self) -> None:
+        user_profile = self.example_user("iago")
+        self.login("iago")
+        stream = self.make_stream("public stream")
+        self.subscribe(user_profile, stream.name)
+        message_ids = [
+            self.send_stream_message(
+                user_profile, stream.name, topic_name="test", content=f"Message {i}"
+            )
+            for i in range(5)
+        ]
+
+        with mock.patch("zerver.actions.message_edit.queue_event_on_commit") as m:
+            result = self.client_patch(
+                f"/json/messages/{message_ids[0]}",
+                {
+                    "topic": "edited",
+                    "propagate_mode": "change_all",
+                    "send_notification_to_old_thread": "false",
+                    "send_notification_to_new_thread": "false",
+                },
+            )
+        self.assert_json_success(result)
+        queue_name, event = m.call_args.args
+        self.assertEqual(queue_name, "deferred_work")
+        self.assertEqual(event["move_continuation"]["max_message_id"], message_ids[-1])
+
+        # A message sent to the original topic while the move is in
+        # progress stays there.
+        new_message_id = self.send_stream_message(
+            user_profile, stream.name, topic_name="test", content="New message"
+        )
+        do_continue_message_move(
+            user_profile,
+            event["message_id"],
+            event["stream_id"],
+            event["orig_topic_name"],
+            event["new_stream_id"],
+            event["topic_name"],
+            event["propagate_mode"],
+            event["send_notification_to_old_thread"],
+            event["send_notification_to_new_thread"],
+            event["move_continuation"],
+        )
+
+        messages = get_topic_messages(user_profile, stream, "test")
+        self.assertEqual([message.id for message in messages], [new_message_id])
+        messages = get_topic_messages(user_profile, stream, "edited")
+        self.assertEqual([message.id for message in messages], message_ids)
+
     def test_notify_no_topic(self) -> None:
         user_profile = self.example_user("iago")
         self.login("iago")
@@ -5,6 +5,7 @@ from unittest import mock
 
 import orjson
 from django.conf import settings
+from django.db import connection
 from django.db.models import Q
 from django.test import override_settings
 from django.utils.timezone import now as timezone_now
@@ -20,6 +21,7 @@ from zerver.actions.message_send import (
     extract_stream_indicator,
     internal_prep_private_message,
     internal_prep_stream_message_by_name,
+    internal_send_bulk_private_messages,
     internal_send_group_direct_message,
     internal_send_private_message,
     internal_send_stream_message,
@@ -30,22 +32,34 @@ from zerver.actions.realm_settings import (
     do_change_realm_permission_group_setting,
     do_set_realm_property,
 )
-from zerver.actions.streams import do_change_stream_post_policy, do_deactivate_stream
+from zerver.actions.streams import (
+    do_change_stream_post_policy,
+    do_change_subscription_property,
+    do_deactivate_stream,
+)
 from zerver.actions.user_groups import add_subgroups_to_user_group, check_add_user_group
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_change_can_forge_sender, do_deactivate_user
 from zerver.lib.addressee import Addressee
+from zerver.lib.cache_stats import flush_cache_stats, get_cache_counters
 from zerver.lib.exceptions import (
     DirectMessageInitiationError,
     DirectMessagePermissionError,
     JsonableError,
 )
+from zerver.lib.markdown import render_message_markdown
 from zerver.lib.message import get_raw_unread_data, get_recent_private_conversations
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.per_request_cache import flush_per_request_caches
+from zerver.lib.soft_deactivation import do_soft_deactivate_users
+from zerver.lib.stream_subscription import (
+    SendMessageSubscriberRow,
+    get_subscriber_rows_for_send_message,
+)
 from zerver.lib.streams import create_stream_if_needed
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import (
+    get_subscription,
     get_user_messages,
     make_client,
     message_stream_count,
@@ -54,6 +68,7 @@ from zerver.lib.test_helpers import (
     reset_email_visibility_to_everyone_in_zulip_realm,
 )
 from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.lib.user_message import bulk_copy_ums
 from zerver.models import (
     Message,
     NamedUserGroup,
@@ -1532,6 +1547,37 @@ class StreamMessagesTest(ZulipTestCase):
         self.assertEqual(old_non_subscriber_messages, new_non_subscriber_messages)
         self.assertEqual(new_subscriber_messages, [elt + 1 for elt in old_subscriber_messages])
 
+    def test_user_messages_inserted_with_copy(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        stream_name = "Verona"
+        with mock.patch("zerver.lib.user_message.BULK_INSERT_UMS_COPY_THRESHOLD", 1):
+            message_id = self.send_stream_message(
+                hamlet, stream_name, content=f"@**{cordelia.full_name}** hello"
+            )
+
+        subscribers = self.users_subscribed_to_stream(stream_name, hamlet.realm)
+        user_messages = UserMessage.objects.filter(message_id=message_id)
+        self.assertEqual(
+            {um.user_profile_id for um in user_messages},
+            {
+                subscriber.id
+                for subscriber in subscribers
+                if subscriber.bot_type != UserProfile.OUTGOING_WEBHOOK_BOT
+            },
+        )
+        self.assertEqual(user_messages.get(user_profile=cordelia).flags_list(), ["mentioned"])
+        self.assertEqual(user_messages.get(user_profile=hamlet).flags_list(), ["read"])
+
+        # Conflicting rows are skipped, as with INSERT.
+        bulk_copy_ums([(cordelia.id, message_id, 0)])
+        self.assertEqual(user_messages.get(user_profile=cordelia).flags_list(), ["mentioned"])
+
+        # The staging table is reused, and left empty, by each call.
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM zerver_usermessage_staging")
+            self.assertEqual(cursor.fetchone(), (0,))
+
     def test_performance(self) -> None:
         """
         This test is part of the automated test suite, but
@@ -1629,7 +1675,7 @@ class StreamMessagesTest(ZulipTestCase):
             setting_value=UserProfile.AUTOMATICALLY_CHANGE_VISIBILITY_POLICY_NEVER,
             acting_user=None,
         )
-        with self.assert_database_query_count(13):
+        with self.assert_database_query_count(12):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1649,7 +1695,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 5 queries: 1 to check if it is the first message in the topic +
         # 1 to check if the topic is already followed + 3 to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(18):
+        with self.assert_database_query_count(17):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1669,7 +1715,7 @@ class StreamMessagesTest(ZulipTestCase):
         # a message to a topic with visibility policy other than FOLLOWED.
         # 1 to check if the topic is already followed + 3 queries to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(17):
+        with self.assert_database_query_count(16):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1680,7 +1726,7 @@ class StreamMessagesTest(ZulipTestCase):
         # If the topic is already FOLLOWED, there will be an increase in the query
         # count of 1 to check if the topic is already followed.
         flush_per_request_caches()
-        with self.assert_database_query_count(14):
+        with self.assert_database_query_count(13):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1705,7 +1751,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 1 to get the user_id of the mentioned user + 1 to check if the topic
         # is already followed + 3 queries to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(22):
+        with self.assert_database_query_count(21):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1718,7 +1764,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 1 to get the user_id of the mentioned user + 1 to check if the topic is
         # already followed.
         flush_per_request_caches()
-        with self.assert_database_query_count(19):
+        with self.assert_database_query_count(18):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1727,6 +1773,8 @@ class StreamMessagesTest(ZulipTestCase):
                 body="@**" + user.full_name + "**",
             )
 
+        # Stream wildcard mentions are sent to long-term idle
+        # subscribers too, who are not cached.
         flush_per_request_caches()
         with self.assert_database_query_count(16):
             check_send_stream_message(
@@ -1737,6 +1785,85 @@ class StreamMessagesTest(ZulipTestCase):
                 body="@**all**",
             )
 
+    def test_stream_recipient_info_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        stream_name = "Denmark"
+        stream = get_stream(stream_name, hamlet.realm)
+        assert stream.recipient_id is not None
+        self.subscribe(hamlet, stream_name)
+        self.subscribe(cordelia, stream_name)
+        self.unsubscribe(othello, stream_name)
+
+        def get_cache_stats() -> tuple[int, int]:
+            flush_cache_stats()
+            counters = get_cache_counters()
+            return (
+                counters.get(("stream_recipient_info", "hit"), 0),
+                counters.get(("stream_recipient_info", "miss"), 0),
+            )
+
+        def send_and_check_cache(*, hit: bool) -> int:
+            hits, misses = get_cache_stats()
+            message_id = self.send_stream_message(hamlet, stream_name)
+            if hit:
+                self.assertEqual(get_cache_stats(), (hits + 1, misses))
+            else:
+                self.assertEqual(get_cache_stats(), (hits, misses + 1))
+            return message_id
+
+        # The first message may or may not find the rows cached.
+        self.send_stream_message(hamlet, stream_name)
+        send_and_check_cache(hit=True)
+
+        # Changing a subscription property invalidates the stream's rows.
+        sub = get_subscription(stream_name, cordelia)
+        do_change_subscription_property(
+            cordelia, sub, stream, "push_notifications", True, acting_user=None
+        )
+        send_and_check_cache(hit=False)
+        send_and_check_cache(hit=True)
+
+        # Changing a notification setting invalidates the realm's rows.
+        do_change_user_setting(
+            cordelia, "enable_stream_email_notifications", True, acting_user=None
+        )
+        send_and_check_cache(hit=False)
+        def get_rows(possibly_mentioned_user_ids: set[int]) -> list[SendMessageSubscriberRow]:
+            assert stream.recipient_id is not None
+            return get_subscriber_rows_for_send_message(
+                hamlet.realm_id,
+                stream.recipient_id,
+                possible_stream_wildcard_mention=False,
+                topic_participant_user_ids=set(),
+                possibly_mentioned_user_ids=possibly_mentioned_user_ids,
+                followed_user_ids=set(),
+            )
+
+        rows = get_rows(set())
+        [cordelia_row] = [row for row in rows if row.user_profile_id == cordelia.id]
+        self.assertTrue(cordelia_row.push_notifications)
+        self.assertTrue(cordelia_row.user_profile_email_notifications)
+
+        # Unrelated settings leave the cache alone.
+        do_change_user_setting(cordelia, "enter_sends", True, acting_user=None)
+        send_and_check_cache(hit=True)
+
+        # New subscribers receive the very next message.
+        self.subscribe(othello, stream_name)
+        message_id = send_and_check_cache(hit=False)
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=othello, message_id=message_id).exists()
+        )
+
+        # Long-term idle subscribers are not cached, but are fetched
+        # when they might be mentioned.
+        with self.assertLogs("zulip.soft_deactivation", level="INFO"):
+            do_soft_deactivate_users([othello])
+        self.assertNotIn(othello.id, [row.user_profile_id for row in get_rows(set())])
+        self.assertIn(othello.id, [row.user_profile_id for row in get_rows({othello.id})])
+
     def test_stream_message_dict(self) -> None:
         user_profile = self.example_user("iago")
         self.subscribe(user_profile, "Denmark")
@@ -2869,6 +2996,57 @@ class InternalPrepTest(ZulipTestCase):
         # wasn't automatically created.
         Stream.objects.get(name=stream_name, realm_id=realm.id)
 
+    def test_internal_send_bulk_private_messages(self) -> None:
+        realm = get_realm("zulip")
+        sender = get_system_bot(settings.NOTIFICATION_BOT, realm.id)
+        cordelia = self.example_user("cordelia")
+        hamlet = self.example_user("hamlet")
+        recipients = [cordelia, hamlet, self.example_user("iago"), self.example_user("othello")]
+        content = f"@**{cordelia.full_name}|{cordelia.id}**, see https://zulip.com/help/."
+        messages = [(user, content) for user in recipients]
+        messages.append((hamlet, "Something else"))
+        # Messages which fail to send are skipped.
+        messages.insert(2, (hamlet, ""))
+
+        progress: list[tuple[int, int]] = []
+        with (
+            mock.patch(
+                "zerver.actions.message_send.render_message_markdown",
+                wraps=render_message_markdown,
+            ) as render_mock,
+            self.assertLogs(level="ERROR") as error_log,
+        ):
+            message_ids = internal_send_bulk_private_messages(
+                sender,
+                messages,
+                batch_size=2,
+                progress_callback=lambda done, total: progress.append((done, total)),
+            )
+
+        # Each distinct content is rendered once.
+        self.assertEqual(render_mock.call_count, 2)
+        self.assertIn("Message must not be empty", error_log.output[0])
+        self.assertEqual(progress, [(2, 6), (3, 6), (5, 6)])
+        self.assert_length(message_ids, len(messages))
+        self.assertIsNone(message_ids[2])
+        for (user, message_content), message_id in zip(messages, message_ids, strict=True):
+            if message_id is None:
+                continue
+            message = Message.objects.get(id=message_id)
+            self.assertEqual(message.recipient_id, user.recipient_id)
+            self.assertEqual(message.content, message_content)
+            self.assertEqual(message.has_link, message_content == content)
+        shared_message = Message.objects.get(id=message_ids[1])
+        self.assertIn("user-mention", shared_message.rendered_content)
+
+        # Only cordelia's copy of the message mentions her.
+        mentioned_user_ids = {
+            user_message.user_profile_id
+            for user_message in UserMessage.objects.filter(message_id__in=message_ids[:5])
+            if user_message.flags.mentioned
+        }
+        self.assertEqual(mentioned_user_ids, {cordelia.id})
+
     def test_direct_message_to_self_and_bot_in_dm_disabled_org(self) -> None:
         """
         Test that a user can send a direct message to themselves and to a bot in a DM disabled organization
@@ -6,6 +6,7 @@ from django.http import HttpResponse
 
 from zerver.lib.realm_icon import get_realm_icon_url
 from zerver.lib.request import RequestNotes
+from zerver.lib.stage_timing import get_stage_times, record_stage_time
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import HostRequestMock
 from zerver.lib.utils import assert_is_not_none
@@ -57,6 +58,44 @@ class SlowQueryTest(ZulipTestCase):
                 r"123\.456\.789\.012 GET     200 10\.\ds .* \(unknown via \?\)",
             )
 
+    def test_stage_times_log(self) -> None:
+        log_data = {
+            "time_started": time.time(),
+            "stage_times_start": get_stage_times(),
+        }
+        record_stage_time("test_stage", 0.02)
+        with self.assertLogs("zulip.requests", level="INFO") as middleware_normal_logger:
+            write_log_line(
+                log_data,
+                path="/some/endpoint/",
+                method="POST",
+                remote_ip="123.456.789.012",
+                requester_for_logs="unknown",
+                client_name="?",
+            )
+        self.assert_length(middleware_normal_logger.output, 1)
+        self.assertIn(" (stages: test_stage 20ms) ", middleware_normal_logger.output[0])
+
+    def test_cache_gets_log(self) -> None:
+        log_data = {
+            "time_started": time.time(),
+            "cache_gets_start": (10, 5, 20, 0),
+        }
+        with (
+            patch("zerver.middleware.get_cache_get_counts", return_value=(12, 6, 24, 1)),
+            self.assertLogs("zulip.requests", level="INFO") as middleware_normal_logger,
+        ):
+            write_log_line(
+                log_data,
+                path="/some/endpoint/",
+                method="GET",
+                remote_ip="123.456.789.012",
+                requester_for_logs="unknown",
+                client_name="?",
+            )
+        self.assert_length(middleware_normal_logger.output, 1)
+        self.assertIn(" (hits: mem 2/3, local 4/5) ", middleware_normal_logger.output[0])
+
 
 class OpenGraphTest(ZulipTestCase):
     def check_title_and_description(
@@ -570,8 +570,11 @@ class WorkerTest(ZulipTestCase):
                     * 2,
                 )
 
-    @patch("zerver.worker.email_mirror.mirror_email")
-    def test_mirror_worker(self, mock_mirror_email: MagicMock) -> None:
+    @patch("zerver.worker.email_mirror.send_stream_messages")
+    @patch("zerver.worker.email_mirror.prep_message")
+    def test_mirror_worker(
+        self, mock_prep_message: MagicMock, mock_send_stream_messages: MagicMock
+    ) -> None:
         fake_client = FakeClient()
         stream = get_stream("Denmark", get_realm("zulip"))
         stream_to_address = encode_email_address(stream)
@@ -590,11 +593,102 @@ class WorkerTest(ZulipTestCase):
             worker.setup()
             worker.start()
 
-        self.assertEqual(mock_mirror_email.call_count, 3)
+        # All three emails are sent as one batch.
+        self.assertEqual(mock_prep_message.call_count, 3)
+        mock_send_stream_messages.assert_called_once()
+        self.assert_length(mock_send_stream_messages.call_args.args[0], 3)
+
+    @patch("zerver.worker.email_mirror.send_stream_messages")
+    @patch("zerver.worker.email_mirror.prep_message")
+    def test_mirror_worker_failures(
+        self, mock_prep_message: MagicMock, mock_send_stream_messages: MagicMock
+    ) -> None:
+        fake_client = FakeClient()
+        stream = get_stream("Denmark", get_realm("zulip"))
+        stream_to_address = encode_email_address(stream)
+        for i in range(4):
+            fake_client.enqueue(
+                "email_mirror",
+                dict(
+                    msg_base64=base64.b64encode(f"email {i}".encode()).decode(),
+                    time=time.time(),
+                    rcpt_to=stream_to_address,
+                ),
+            )
+
+        # The second email fails to be prepared, and the batched send
+        # fails because of the fourth email.
+        requests = [MagicMock(), MagicMock(), MagicMock()]
+        mock_prep_message.side_effect = [requests[0], Exception("bad email"), *requests[1:]]
+
+        def send_stream_messages(send_requests: list[MagicMock]) -> None:
+            if requests[2] in send_requests:
+                raise Exception("bad send")
+
+        mock_send_stream_messages.side_effect = send_stream_messages
+
+        fn = os.path.join(settings.QUEUE_ERROR_DIR, "email_mirror.errors")
+        with suppress(FileNotFoundError):
+            os.remove(fn)
+
+        with simulated_queue_client(fake_client), self.assertLogs(level="ERROR") as m:
+            worker = MirrorWorker()
+            worker.setup()
+            worker.start()
+
+        # Each failure only affects its own email; the others are
+        # sent separately once the batch fails.
+        self.assertEqual(
+            [call.args[0] for call in mock_send_stream_messages.call_args_list],
+            [requests, [requests[0]], [requests[1]], [requests[2]]],
+        )
+        self.assertEqual(
+            [record.message for record in m.records],
+            ["Problem handling data on queue email_mirror"] * 2,
+        )
+        with open(fn) as f:
+            failed = [orjson.loads(line.split("\t")[1]) for line in f]
+        self.assertEqual(
+            [[base64.b64decode(event["msg_base64"]) for event in events] for events in failed],
+            [[b"email 1"], [b"email 3"]],
+        )
+
+    @patch("zerver.worker.email_mirror.send_stream_messages")
+    @patch("zerver.worker.email_mirror.prep_message")
+    def test_mirror_worker_timeout(
+        self, mock_prep_message: MagicMock, mock_send_stream_messages: MagicMock
+    ) -> None:
+        stream = get_stream("Denmark", get_realm("zulip"))
+        stream_to_address = encode_email_address(stream)
+        events = [
+            dict(
+                msg_base64=base64.b64encode(f"email {i}".encode()).decode(),
+                rcpt_to=stream_to_address,
+            )
+            for i in range(3)
+        ]
+
+        # The first email is handled while it is prepared, and the
+        # batched send of the others times out.
+        mock_prep_message.side_effect = [None, MagicMock(), MagicMock()]
+        mock_send_stream_messages.side_effect = base_worker.WorkerTimeoutError(
+            "email_mirror", 5, 3
+        )
+
+        with self.assertLogs(level="ERROR") as m:
+            MirrorWorker().consume_batch(events)
+        self.assertEqual(
+            m.output,
+            [
+                f"ERROR:root:Timed out ingesting email to {stream_to_address} "
+                "(7 bytes) -- dropping!"
+            ]
+            * 2,
+        )
 
-    @patch("zerver.worker.email_mirror.mirror_email")
+    @patch("zerver.worker.email_mirror.prep_message", return_value=None)
     @override_settings(RATE_LIMITING_MIRROR_REALM_RULES=[(10, 2)])
-    def test_mirror_worker_rate_limiting(self, mock_mirror_email: MagicMock) -> None:
+    def test_mirror_worker_rate_limiting(self, mock_prep_message: MagicMock) -> None:
         fake_client = FakeClient()
         realm = get_realm("zulip")
         RateLimitedRealmMirror(realm).clear_history()
@@ -621,12 +715,12 @@ class WorkerTest(ZulipTestCase):
                 worker.start()
                 # Of the first 5 messages, only 2 should be processed
                 # (the rest being rate-limited):
-                self.assertEqual(mock_mirror_email.call_count, 2)
+                self.assertEqual(mock_prep_message.call_count, 2)
 
                 # If a new message is sent into the stream mirror, it will get rejected:
                 fake_client.enqueue("email_mirror", data[0])
                 worker.start()
-                self.assertEqual(mock_mirror_email.call_count, 2)
+                self.assertEqual(mock_prep_message.call_count, 2)
 
                 # However, message notification emails don't get rate limited:
                 with self.settings(EMAIL_GATEWAY_PATTERN="%s@example.com"):
@@ -638,13 +732,13 @@ class WorkerTest(ZulipTestCase):
                     )
                     fake_client.enqueue("email_mirror", event)
                     worker.start()
-                    self.assertEqual(mock_mirror_email.call_count, 3)
+                    self.assertEqual(mock_prep_message.call_count, 3)
 
             # After some time passes, emails get accepted again:
             with patch("time.time", return_value=start_time + 11.0):
                 fake_client.enqueue("email_mirror", data[0])
                 worker.start()
-                self.assertEqual(mock_mirror_email.call_count, 4)
+                self.assertEqual(mock_prep_message.call_count, 4)
 
                 # If RateLimiterLockingError is thrown, we rate-limit the new message:
                 with (
@@ -656,7 +750,7 @@ class WorkerTest(ZulipTestCase):
                 ):
                     fake_client.enqueue("email_mirror", data[0])
                     worker.start()
-                    self.assertEqual(mock_mirror_email.call_count, 4)
+                    self.assertEqual(mock_prep_message.call_count, 4)
                     self.assertEqual(
                         mock_warn.output,
                         [
@@ -1,11 +1,17 @@
 from collections.abc import Set as AbstractSet
 from unittest import mock
 
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.utils.timezone import now as timezone_now
 
 from zerver.actions.alert_words import do_add_alert_words
+from zerver.actions.message_flags import do_mark_stream_messages_as_read
+from zerver.actions.streams import do_change_stream_permission, do_set_stream_defer_user_messages
+from zerver.lib.exceptions import JsonableError
 from zerver.lib.mention import stream_wildcards
 from zerver.lib.soft_deactivation import (
+    add_missing_deferred_messages,
     add_missing_messages,
     do_auto_soft_deactivate_users,
     do_catch_up_soft_deactivated_users,
@@ -16,7 +22,10 @@ from zerver.lib.soft_deactivation import (
     get_users_for_soft_deactivation,
     reactivate_user_if_soft_deactivated,
 )
-from zerver.lib.stream_subscription import get_subscriptions_for_send_message
+from zerver.lib.stream_subscription import (
+    get_subscriber_rows_for_send_message,
+    get_subscriptions_for_send_message,
+)
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import get_subscription, get_user_messages, make_client
 from zerver.models import (
@@ -28,6 +37,7 @@ from zerver.models import (
     UserActivity,
     UserMessage,
     UserProfile,
+    UserTopic,
 )
 from zerver.models.realm_audit_logs import AuditLogEventType
 from zerver.models.realms import get_realm
@@ -561,6 +571,129 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         long_term_idle_user.refresh_from_db()
         self.assertEqual(long_term_idle_user.last_active_message_id, message_ids[-1])
 
+    def test_add_missing_deferred_messages(self) -> None:
+        sender = self.example_user("iago")
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        stream_name = "Denmark"
+        for user_profile in [sender, hamlet, cordelia]:
+            self.subscribe(user_profile, stream_name)
+        stream = get_stream(stream_name, sender.realm)
+        assert stream.recipient_id is not None
+        do_mark_stream_messages_as_read(cordelia, stream.recipient_id)
+        do_set_stream_defer_user_messages(stream, True)
+        stream.refresh_from_db()
+        self.assertIsNotNone(stream.deferred_after_message_id)
+        hamlet.refresh_from_db()
+        cordelia.refresh_from_db()
+        self.assertTrue(hamlet.has_deferred_subscriptions)
+
+        # Only the sender and mentioned users get rows when sending.
+        message_ids = [
+            self.send_stream_message(sender, stream_name, "deferred"),
+            self.send_stream_message(sender, stream_name, "@**King Hamlet**"),
+        ]
+        self.assertEqual(
+            set(
+                UserMessage.objects.filter(message_id=message_ids[0]).values_list(
+                    "user_profile_id", flat=True
+                )
+            ),
+            {sender.id},
+        )
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=hamlet, message_id=message_ids[1]).exists()
+        )
+
+        add_missing_deferred_messages(hamlet)
+        self.assertEqual(
+            list(
+                UserMessage.objects.filter(user_profile=hamlet, message_id__in=message_ids)
+                .order_by("message_id")
+                .values_list("message_id", flat=True)
+            ),
+            message_ids,
+        )
+        self.assertEqual(
+            get_subscription(stream_name, hamlet).deferred_materialized_message_id,
+            message_ids[0],
+        )
+
+        # Marking the channel as read advances the watermark, and
+        # creates the remaining rows as already read.
+        message_ids.append(self.send_stream_message(sender, stream_name, "more"))
+        # The watermark is the channel's latest message, not the
+        # latest message anywhere.
+        self.send_stream_message(sender, "Verona", "elsewhere")
+        self.assertEqual(
+            do_mark_stream_messages_as_read(cordelia, stream.recipient_id), len(message_ids)
+        )
+        self.assertEqual(
+            get_subscription(stream_name, cordelia).read_watermark_message_id,
+            message_ids[-1],
+        )
+        for user_message in UserMessage.objects.filter(
+            user_profile=cordelia, message_id__in=message_ids
+        ):
+            self.assertTrue(user_message.flags.read)
+        add_missing_deferred_messages(cordelia)
+        self.assertEqual(
+            UserMessage.objects.filter(user_profile=cordelia, message_id__in=message_ids).count(),
+            len(message_ids),
+        )
+
+        # Messages sent after turning deferral off are sent normally.
+        do_set_stream_defer_user_messages(stream, False)
+        message_id = self.send_stream_message(sender, stream_name)
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=cordelia, message_id=message_id).exists()
+        )
+
+    def test_defer_user_messages_restrictions(self) -> None:
+        iago = self.example_user("iago")
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+
+        # Users who were never in a deferred channel skip the work.
+        with self.assert_database_query_count(0):
+            self.assertEqual(add_missing_deferred_messages(hamlet), [])
+
+        # Access to messages in channels with protected history
+        # depends on UserMessage rows, so they cannot be deferred.
+        protected_stream = self.make_stream(
+            "protected", invite_only=True, history_public_to_subscribers=False
+        )
+        with self.assertRaisesRegex(JsonableError, "Only channels with history visible"):
+            do_set_stream_defer_user_messages(protected_stream, True)
+        with self.assertRaisesRegex(CommandError, "Only channels with history visible"):
+            call_command(
+                "defer_channel_user_messages", "-r", "zulip", "--channel-id", protected_stream.id
+            )
+
+        stream = self.make_stream("deferred")
+        self.subscribe(hamlet, "deferred")
+        do_set_stream_defer_user_messages(stream, True)
+        hamlet.refresh_from_db()
+        self.assertTrue(hamlet.has_deferred_subscriptions)
+
+        # Later subscribers are marked as well.
+        othello.refresh_from_db()
+        self.assertFalse(othello.has_deferred_subscriptions)
+        self.subscribe(othello, "deferred")
+        othello.refresh_from_db()
+        self.assertTrue(othello.has_deferred_subscriptions)
+
+        # Protecting the channel's history turns deferral off.
+        do_change_stream_permission(
+            stream,
+            invite_only=True,
+            history_public_to_subscribers=False,
+            is_web_public=False,
+            acting_user=iago,
+        )
+        stream.refresh_from_db()
+        self.assertFalse(stream.defer_user_messages)
+
     def test_user_message_filter(self) -> None:
         # In this test we are basically testing out the logic used out in
         # do_send_messages() in action.py for filtering the messages for which
@@ -578,7 +711,10 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         self.subscribe(cordelia, stream_name)
         self.subscribe(sender, stream_name)
 
-        stream_id = get_stream(stream_name, cordelia.realm).id
+        stream = get_stream(stream_name, cordelia.realm)
+        stream_id = stream.id
+        assert stream.recipient_id is not None
+        recipient_id = stream.recipient_id
 
         def send_stream_message(content: str) -> None:
             self.send_stream_message(sender, stream_name, content, topic_name)
@@ -630,6 +766,24 @@ class SoftDeactivationMessageTest(ZulipTestCase):
                 ),
                 expected_count,
             )
+            # The partly cached rows used by the send path are the same.
+            self.assert_length(
+                get_subscriber_rows_for_send_message(
+                    realm_id,
+                    recipient_id,
+                    possible_stream_wildcard_mention=possible_stream_wildcard_mention,
+                    topic_participant_user_ids=topic_participant_user_ids,
+                    possibly_mentioned_user_ids=possibly_mentioned_user_ids,
+                    followed_user_ids=set(
+                        UserTopic.objects.filter(
+                            stream_id=stream_id,
+                            topic_name__iexact=topic_name,
+                            visibility_policy=UserTopic.VisibilityPolicy.FOLLOWED,
+                        ).values_list("user_profile_id", flat=True)
+                    ),
+                ),
+                expected_count,
+            )
 
         def assert_stream_message_sent_to_idle_user(
             content: str,
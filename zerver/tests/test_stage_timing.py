@@ -0,0 +1,88 @@
+from zerver.lib.stage_timing import (
+    BATCH_SIZE_BUCKET_LABELS,
+    STAGE_TIME_BUCKET_LABELS,
+    BatchSizeHistogram,
+    StageHistogram,
+    flush_stage_histograms,
+    get_batch_size_histograms,
+    get_stage_histograms,
+    get_stage_times,
+    record_batch_size,
+    record_stage_time,
+    timed_stage,
+)
+from zerver.lib.test_classes import ZulipTestCase
+
+
+class StageTimingTest(ZulipTestCase):
+    def get_histogram(self, stage: str) -> StageHistogram:
+        flush_stage_histograms()
+        return get_stage_histograms().get(stage, StageHistogram())
+
+    def test_histograms(self) -> None:
+        before = self.get_histogram("test_stage")
+
+        record_stage_time("test_stage", 0.003)
+        record_stage_time("test_stage", 20)
+        with timed_stage("test_stage"):
+            pass
+        self.assertGreaterEqual(get_stage_times()["test_stage"], 20.003)
+
+        after = self.get_histogram("test_stage")
+        self.assertEqual(after.count - before.count, 3)
+        self.assertAlmostEqual(after.total_time - before.total_time, 20.003, places=2)
+        bucket_deltas = dict(
+            zip(
+                STAGE_TIME_BUCKET_LABELS,
+                [
+                    after_count - before_count
+                    for after_count, before_count in zip(
+                        after.bucket_counts, before.bucket_counts, strict=True
+                    )
+                ],
+                strict=True,
+            )
+        )
+        self.assertEqual(bucket_deltas["0.005"], 1)
+        self.assertEqual(bucket_deltas["+Inf"], 1)
+        self.assertEqual(sum(bucket_deltas.values()), 3)
+
+    def test_batch_size_histograms(self) -> None:
+        flush_stage_histograms()
+        before = get_batch_size_histograms().get("test_batch", BatchSizeHistogram())
+
+        record_batch_size("test_batch", 1)
+        record_batch_size("test_batch", 7)
+        record_batch_size("test_batch", 5000)
+        flush_stage_histograms()
+        after = get_batch_size_histograms()["test_batch"]
+        self.assertEqual(after.count - before.count, 3)
+        self.assertEqual(after.total_size - before.total_size, 5008)
+        for label, delta in [("1", 1), ("10", 1), ("+Inf", 1), ("2", 0)]:
+            index = BATCH_SIZE_BUCKET_LABELS.index(label)
+            self.assertEqual(after.bucket_counts[index] - before.bucket_counts[index], delta)
+
+        result = self.client_get("/api/internal/metrics")
+        content = result.content.decode()
+        self.assertIn('zulip_batch_size_bucket{batch="test_batch",le="10"}', content)
+
+    def test_metrics_endpoint(self) -> None:
+        record_stage_time("test_stage", 0.003)
+        flush_stage_histograms()
+
+        result = self.client_get("/api/internal/metrics")
+        self.assertEqual(result.status_code, 200)
+        content = result.content.decode()
+        self.assertIn("# TYPE zulip_stage_duration_seconds histogram", content)
+        self.assertIn('zulip_stage_duration_seconds_bucket{le="+Inf",stage="test_stage"}', content)
+        self.assertIn('zulip_stage_duration_seconds_count{stage="test_stage"}', content)
+
+        result = self.client_get("/api/internal/metrics", REMOTE_ADDR="3.3.3.3")
+        self.assert_json_error(result, "Access denied", status_code=403)
+
+    def test_send_message_stages(self) -> None:
+        stage_times_start = get_stage_times()
+        self.send_stream_message(self.example_user("hamlet"), "Denmark", "hello")
+        stage_times = get_stage_times()
+        for stage in ["recipient_info", "message_insert", "user_message_insert", "send_event"]:
+            self.assertGreater(stage_times[stage], stage_times_start.get(stage, 0))
@@ -20,7 +20,10 @@ def create_tornado_application(*, autoreload: bool = False) -> tornado.web.Appli
         r"/json/events",
         r"/api/v1/events",
         r"/api/v1/events/internal",
+        r"/api/internal/event_queue_stats",
         r"/api/internal/notify_tornado",
+        r"/api/internal/rebalance_event_queues",
+        r"/api/internal/receive_event_queues",
         r"/api/internal/web_reload_clients",
     )
 
@@ -1,5 +1,6 @@
 from collections import defaultdict
 from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass, field
 from functools import lru_cache
 from typing import Any
 from urllib.parse import urlsplit
@@ -15,6 +16,7 @@ from urllib3.util import Retry
 
 from zerver.lib.partial import partial
 from zerver.lib.queue import queue_json_publish_rollback_unsafe
+from zerver.lib.stage_timing import timed_stage
 from zerver.models import Client, Realm, UserProfile
 from zerver.tornado.sharding import (
     get_realm_tornado_ports,
@@ -186,29 +188,109 @@ def send_notification_http(port: int, data: Mapping[str, Any]) -> None:
 # with the schema verified in `zerver/lib/event_schema.py`.
 #
 # See https://zulip.readthedocs.io/en/latest/subsystems/events-system.html
+def get_port_user_map(
+    realm: Realm, users: Iterable[int] | Iterable[Mapping[str, Any]]
+) -> dict[int, list[int] | list[Mapping[str, Any]]]:
+    realm_ports = get_realm_tornado_ports(realm)
+    if len(realm_ports) == 1:
+        return {realm_ports[0]: list(users)}
+
+    port_user_map: dict[int, Any] = defaultdict(list)
+    for user in users:
+        user_id = user if isinstance(user, int) else user["id"]
+        port_user_map[get_user_id_tornado_port(realm_ports, user_id)].append(user)
+    return port_user_map
+
+
 def send_event_rollback_unsafe(
     realm: Realm, event: Mapping[str, Any], users: Iterable[int] | Iterable[Mapping[str, Any]]
 ) -> None:
     """`users` is a list of user IDs, or in some special cases like message
     send/update or embeds, dictionaries containing extra data."""
-    realm_ports = get_realm_tornado_ports(realm)
-    if len(realm_ports) == 1:
-        port_user_map = {realm_ports[0]: list(users)}
-    else:
-        port_user_map = defaultdict(list)
-        for user in users:
-            user_id = user if isinstance(user, int) else user["id"]
-            port_user_map[get_user_id_tornado_port(realm_ports, user_id)].append(user)
-
-    for port, port_users in port_user_map.items():
-        queue_json_publish_rollback_unsafe(
-            notify_tornado_queue_name(port),
-            dict(event=event, users=port_users),
-            partial(send_notification_http, port),
-        )
+    with timed_stage("send_event"):
+        for port, port_users in get_port_user_map(realm, users).items():
+            queue_json_publish_rollback_unsafe(
+                notify_tornado_queue_name(port),
+                dict(event=event, users=port_users),
+                partial(send_notification_http, port),
+            )
+
+
+@dataclass
+class EventBatch:
+    """Events sent via send_event_on_commit from consecutive
+    `on_commit` callbacks in the same savepoint, which are delivered
+    to each Tornado shard as a single notice, once the last of those
+    callbacks runs.
+
+    Because the batch only ever spans consecutive callbacks with the
+    same savepoints, rolling back a savepoint discards either all of
+    its callbacks or none of them, and events are delivered in the
+    same order, relative to other `on_commit` callbacks, as they
+    would be if sent individually.
+    """
+
+    run_on_commit: list[Any]
+    run_on_commit_length: int
+    savepoint_ids: set[str]
+    registered: int = 0
+    flushed: bool = False
+    pending: list[tuple[Realm, Mapping[str, Any], Any]] = field(default_factory=list)
+
+
+current_event_batch: EventBatch | None = None
+
+
+def send_event_batch_rollback_unsafe(batch: EventBatch) -> None:
+    batch.flushed = True
+    with timed_stage("send_event"):
+        port_notices: dict[int, list[dict[str, Any]]] = defaultdict(list)
+        for realm, event, users in batch.pending:
+            for port, port_users in get_port_user_map(realm, users).items():
+                port_notices[port].append(dict(event=event, users=port_users))
+
+        for port, notices in port_notices.items():
+            queue_json_publish_rollback_unsafe(
+                notify_tornado_queue_name(port),
+                # Batches of one are sent in the unbatched format.
+                notices[0] if len(notices) == 1 else dict(notices=notices),
+                partial(send_notification_http, port),
+            )
 
 
 def send_event_on_commit(
     realm: Realm, event: Mapping[str, Any], users: Iterable[int] | Iterable[Mapping[str, Any]]
 ) -> None:
-    transaction.on_commit(lambda: send_event_rollback_unsafe(realm, event, users))
+    global current_event_batch
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        send_event_rollback_unsafe(realm, event, users)
+        return
+
+    batch = current_event_batch
+    if (
+        batch is None
+        or batch.flushed
+        or batch.run_on_commit is not connection.run_on_commit
+        or batch.run_on_commit_length != len(connection.run_on_commit)
+        or batch.savepoint_ids != set(connection.savepoint_ids)
+    ):
+        batch = EventBatch(
+            run_on_commit=connection.run_on_commit,
+            run_on_commit_length=len(connection.run_on_commit),
+            savepoint_ids=set(connection.savepoint_ids),
+        )
+        current_event_batch = batch
+
+    batch.registered += 1
+    index = batch.registered
+
+    def send_event_in_batch() -> None:
+        batch.pending.append((realm, event, users))
+        # Only the callbacks which actually run add their event; the
+        # last one registered for the batch sends them all.
+        if index == batch.registered:
+            send_event_batch_rollback_unsafe(batch)
+
+    transaction.on_commit(send_event_in_batch)
+    batch.run_on_commit_length = len(connection.run_on_commit)
@@ -1,6 +1,8 @@
 # See https://zulip.readthedocs.io/en/latest/subsystems/events-system.html for
 # high-level documentation on how this system works.
 import copy
+import heapq
+import itertools
 import logging
 import os
 import random
@@ -22,17 +24,27 @@ from tornado import autoreload
 from typing_extensions import override
 
 from version import API_FEATURE_LEVEL, ZULIP_MERGE_BASE, ZULIP_VERSION
+from zerver.lib import cache_stats, stage_timing
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.narrow_helpers import narrow_dataclasses_from_tuples
-from zerver.lib.narrow_predicate import build_narrow_predicate
+from zerver.lib.narrow_predicate import (
+    channel_operators,
+    get_distinct_narrow_count,
+    get_shared_narrow_predicate,
+)
 from zerver.lib.notification_data import UserMessageNotificationsData
+from zerver.lib.partial import partial
+from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.queue import queue_json_publish_rollback_unsafe, retry_event
+from zerver.lib.stage_timing import record_batch_size, record_stage_time
 from zerver.middleware import async_request_timer_restart
 from zerver.models import CustomProfileField
 from zerver.tornado.descriptors import clear_descriptor_by_handler_id, set_descriptor_by_handler_id
+from zerver.tornado.django_api import send_notification_http
 from zerver.tornado.exceptions import BadEventQueueIdError
 from zerver.tornado.handlers import finish_handler, get_handler_by_id, handler_stats_string
+from zerver.tornado.sharding import notify_tornado_queue_name
 
 # The idle timeout used to be a week, but we found that in that
 # situation, queues from dead browser sessions would grow quite large
@@ -41,6 +53,21 @@ DEFAULT_EVENT_QUEUE_TIMEOUT_SECS = 60 * 10
 # We garbage-collect every minute; this is totally fine given that the
 # GC scan takes ~2ms with 1000 event queues.
 EVENT_QUEUE_GC_FREQ_MSECS = 1000 * 60 * 1
+# When TORNADO_EVENT_QUEUE_JOURNAL is enabled, queues which changed
+# since the last checkpoint are appended to the journal this often, so
+# that the work left to do at shutdown is only the most recent delta.
+EVENT_QUEUE_CHECKPOINT_FREQ_MSECS = 1000 * 30
+# The journal is rewritten as a compact snapshot once it holds this
+# many times more records than there are live queues.
+EVENT_QUEUE_JOURNAL_COMPACTION_FACTOR = 4
+# The first line of a journal, which distinguishes it from the JSON
+# written by dump_event_queues when the journal is disabled.
+EVENT_QUEUE_JOURNAL_HEADER = b"zulip-event-queue-journal\n"
+# After a shard rebalance hands off event queues to another Tornado
+# process, events for their users are forwarded to it for this long,
+# which is ample time for Django to pick up the new sharding
+# configuration and for already-queued events to drain.
+EVENT_QUEUE_FORWARDING_SECS = 60 * 10
 
 # Capped limit for how long a client can request an event queue
 # to live
@@ -52,6 +79,9 @@ MAX_QUEUE_TIMEOUT_SECS = 7 * 24 * 60 * 60
 # maximum timeout value is 55 seconds, to deal with crappy home
 # wireless routers that kill "inactive" http connections.
 HEARTBEAT_MIN_FREQ_SECS = 45
+# Heartbeats are scheduled in a timing wheel with one slot per second,
+# which must have more slots than the longest heartbeat interval.
+HEARTBEAT_WHEEL_SLOTS = 64
 
 
 def create_heartbeat_event() -> dict[str, str]:
@@ -59,6 +89,35 @@ def create_heartbeat_event() -> dict[str, str]:
 
 
 class ClientDescriptor:
+    # There may be tens of thousands of mostly idle queues per
+    # process, so we avoid the overhead of a per-instance __dict__.
+    __slots__ = (
+        "user_profile_id",
+        "realm_id",
+        "current_handler_id",
+        "current_client_name",
+        "event_queue",
+        "event_types",
+        "last_connection_time",
+        "apply_markdown",
+        "client_gravatar",
+        "slim_presence",
+        "all_public_streams",
+        "client_type_name",
+        "heartbeat_due",
+        "narrow",
+        "narrow_predicate",
+        "bulk_message_deletion",
+        "stream_typing_notifications",
+        "user_settings_object",
+        "pronouns_field_type_supported",
+        "linkifier_url_template",
+        "user_list_incomplete",
+        "include_deactivated_groups",
+        "archived_channels",
+        "queue_timeout",
+    )
+
     def __init__(
         self,
         user_profile_id: int,
@@ -101,9 +160,11 @@ class ClientDescriptor:
         self.slim_presence = slim_presence
         self.all_public_streams = all_public_streams
         self.client_type_name = client_type_name
-        self._timeout_handle: Any = None  # TODO: should be return type of ioloop.call_later
+        # The heartbeat_wheel tick at which a heartbeat is due, while
+        # a handler is connected.
+        self.heartbeat_due: int | None = None
         self.narrow = narrow
-        self.narrow_predicate = build_narrow_predicate(modern_narrow)
+        self.narrow_predicate = get_shared_narrow_predicate(modern_narrow)
         self.bulk_message_deletion = bulk_message_deletion
         self.stream_typing_notifications = stream_typing_notifications
         self.user_settings_object = user_settings_object
@@ -119,14 +180,14 @@ class ClientDescriptor:
             lifespan_secs = DEFAULT_EVENT_QUEUE_TIMEOUT_SECS
         self.queue_timeout = min(lifespan_secs, MAX_QUEUE_TIMEOUT_SECS)
 
-    def to_dict(self) -> dict[str, Any]:
+    def to_dict(self, shared_payloads: "SharedPayloadTable | None" = None) -> dict[str, Any]:
         # If you add a new key to this dict, make sure you add appropriate
         # migration code in from_dict or load_event_queues to account for
         # loading event queues that lack that key.
         return dict(
             user_profile_id=self.user_profile_id,
             realm_id=self.realm_id,
-            event_queue=self.event_queue.to_dict(),
+            event_queue=self.event_queue.to_dict(shared_payloads),
             queue_timeout=self.queue_timeout,
             event_types=self.event_types,
             last_connection_time=self.last_connection_time,
@@ -151,7 +212,9 @@ class ClientDescriptor:
         return f"ClientDescriptor<{self.event_queue.id}>"
 
     @classmethod
-    def from_dict(cls, d: MutableMapping[str, Any]) -> "ClientDescriptor":
+    def from_dict(
+        cls, d: MutableMapping[str, Any], shared_payloads: "SharedPayloadTable | None" = None
+    ) -> "ClientDescriptor":
         if "client_type" in d:
             # Temporary migration for the rename of client_type to client_type_name
             d["client_type_name"] = d["client_type"]
@@ -165,7 +228,7 @@ class ClientDescriptor:
         ret = cls(
             d["user_profile_id"],
             d["realm_id"],
-            EventQueue.from_dict(d["event_queue"]),
+            EventQueue.from_dict(d["event_queue"], shared_payloads),
             d["event_types"],
             d["client_type_name"],
             d["apply_markdown"],
@@ -194,6 +257,12 @@ class ClientDescriptor:
                 async_request_timer_restart(handler._request)
 
         self.event_queue.push(event)
+        mark_queue_dirty(self.event_queue.id)
+        if (
+            self.current_handler_id is None
+            and len(self.event_queue.queue) > settings.EVENT_QUEUE_MAX_EVENTS
+        ):
+            overflowed_queue_ids.add(self.event_queue.id)
         self.finish_current_handler()
 
     def finish_current_handler(self) -> bool:
@@ -203,7 +272,7 @@ class ClientDescriptor:
             finish_handler(
                 self.current_handler_id,
                 self.event_queue.id,
-                self.event_queue.contents(),
+                self.event_queue.contents(pre_encoded=True),
             )
         except Exception:
             logging.exception(
@@ -255,28 +324,23 @@ class ClientDescriptor:
     def accepts_messages(self) -> bool:
         return self.event_types is None or "message" in self.event_types
 
+    def expiry_time(self) -> float:
+        return self.last_connection_time + self.queue_timeout
+
     def expired(self, now: float) -> bool:
-        return (
-            self.current_handler_id is None
-            and now - self.last_connection_time >= self.queue_timeout
-        )
+        return self.current_handler_id is None and now >= self.expiry_time()
 
     def connect_handler(self, handler_id: int, client_name: str) -> None:
         self.current_handler_id = handler_id
         self.current_client_name = client_name
         set_descriptor_by_handler_id(handler_id, self)
         self.last_connection_time = time.time()
+        mark_queue_dirty(self.event_queue.id)
 
-        def timeout_callback() -> None:
-            self._timeout_handle = None
-            # All clients get heartbeat events
-            heartbeat_event = create_heartbeat_event()
-            self.add_event(heartbeat_event)
-
-        ioloop = tornado.ioloop.IOLoop.current()
+        # All clients get heartbeat events
         interval = HEARTBEAT_MIN_FREQ_SECS + random.randint(0, 10)
         if self.client_type_name != "API: heartbeat test":
-            self._timeout_handle = ioloop.call_later(interval, timeout_callback)
+            self.heartbeat_due = heartbeat_wheel.schedule(handler_id, self, interval)
 
     def disconnect_handler(self, client_closed: bool = False) -> None:
         if self.current_handler_id:
@@ -288,12 +352,11 @@ class ClientDescriptor:
                     self.user_profile_id,
                     self.current_client_name,
                 )
+            if self.heartbeat_due is not None:
+                heartbeat_wheel.cancel(self.current_handler_id, self.heartbeat_due)
         self.current_handler_id = None
         self.current_client_name = None
-        if self._timeout_handle is not None:
-            ioloop = tornado.ioloop.IOLoop.current()
-            ioloop.remove_timeout(self._timeout_handle)
-            self._timeout_handle = None
+        self.heartbeat_due = None
 
     def cleanup(self) -> None:
         # Before we can GC the event queue, we need to disconnect the
@@ -306,6 +369,50 @@ class ClientDescriptor:
         do_gc_event_queues({self.event_queue.id}, {self.user_profile_id}, {self.realm_id})
 
 
+class HeartbeatWheel:
+    """Schedules heartbeats for connected long-polls, in a timing wheel
+    with one slot per second, which a single periodic callback
+    advances; this avoids a Tornado timeout per connection, and
+    batches the heartbeats which are due at the same time."""
+
+    def __init__(self) -> None:
+        self.slots: list[dict[int, ClientDescriptor]] = [
+            {} for _ in range(HEARTBEAT_WHEEL_SLOTS)
+        ]
+        self.position = int(time.monotonic())
+
+    def schedule(self, handler_id: int, client: ClientDescriptor, delay_secs: int) -> int:
+        assert 0 < delay_secs < HEARTBEAT_WHEEL_SLOTS
+        due = self.position + delay_secs
+        self.slots[due % HEARTBEAT_WHEEL_SLOTS][handler_id] = client
+        return due
+
+    def cancel(self, handler_id: int, due: int) -> None:
+        self.slots[due % HEARTBEAT_WHEEL_SLOTS].pop(handler_id, None)
+
+    def advance(self, now: int | None = None) -> int:
+        if now is None:
+            now = int(time.monotonic())
+        if now - self.position > HEARTBEAT_WHEEL_SLOTS:
+            # Every slot is due; skip the empty revolutions in between.
+            self.position = now - HEARTBEAT_WHEEL_SLOTS
+        due_clients: list[ClientDescriptor] = []
+        while self.position < now:
+            self.position += 1
+            slot_index = self.position % HEARTBEAT_WHEEL_SLOTS
+            due_clients.extend(self.slots[slot_index].values())
+            self.slots[slot_index] = {}
+
+        for client in due_clients:
+            # Adding the event finishes the handler, which cancels its
+            # (already fired) heartbeat.
+            client.add_event(create_heartbeat_event())
+        return len(due_clients)
+
+
+heartbeat_wheel = HeartbeatWheel()
+
+
 def compute_full_event_type(event: Mapping[str, Any]) -> str:
     if event["type"] == "update_message_flags":
         if event["all"]:
@@ -315,7 +422,56 @@ def compute_full_event_type(event: Mapping[str, Any]) -> str:
     return event["type"]
 
 
+class SharedPayloadTable:
+    """The message payload of a message event is computed once per
+    message (see process_message_event) and shared by reference
+    between the events in every recipient's queue.  This table
+    preserves that sharing across serialization: each distinct
+    payload is written once, and referenced by index from events.
+
+    When loading events which were serialized without a table, it
+    also interns equal payloads, so that a message delivered to
+    thousands of queues is not held in memory thousands of times.
+    """
+
+    def __init__(self, payloads: list[dict[str, Any]] | None = None) -> None:
+        self.payloads: list[dict[str, Any]] = payloads if payloads is not None else []
+        self.index_by_object_id: dict[int, int] = {}
+        self.interned: dict[int, list[dict[str, Any]]] = {}
+
+    def encode_event(self, event: dict[str, Any]) -> dict[str, Any]:
+        if event["type"] != "message":
+            return event
+        payload = event["message"]
+        index = self.index_by_object_id.get(id(payload))
+        if index is None:
+            index = len(self.payloads)
+            self.payloads.append(payload)
+            self.index_by_object_id[id(payload)] = index
+        return {**event, "message": index}
+
+    def decode_event(self, event: dict[str, Any]) -> dict[str, Any]:
+        if event["type"] != "message":
+            return event
+        payload = event["message"]
+        if isinstance(payload, int):
+            event["message"] = self.payloads[payload]
+            return event
+
+        # Different clients may get different payloads for the same
+        # message (e.g. apply_markdown), so we compare by value.
+        candidates = self.interned.setdefault(payload["id"], [])
+        for candidate in candidates:
+            if candidate == payload:
+                event["message"] = candidate
+                return event
+        candidates.append(payload)
+        return event
+
+
 class EventQueue:
+    __slots__ = ("queue", "next_event_id", "newest_pruned_id", "id", "virtual_events")
+
     def __init__(self, id: str) -> None:
         # When extending this list of properties, one must be sure to
         # update to_dict and from_dict.
@@ -327,14 +483,18 @@ class EventQueue:
         self.id: str = id
         self.virtual_events: dict[str, dict[str, Any]] = {}
 
-    def to_dict(self) -> dict[str, Any]:
+    def to_dict(self, shared_payloads: SharedPayloadTable | None = None) -> dict[str, Any]:
         # If you add a new key to this dict, make sure you add appropriate
         # migration code in from_dict or load_event_queues to account for
         # loading event queues that lack that key.
+        if shared_payloads is not None:
+            queue = [shared_payloads.encode_event(event) for event in self.queue]
+        else:
+            queue = list(self.queue)
         d = dict(
             id=self.id,
             next_event_id=self.next_event_id,
-            queue=list(self.queue),
+            queue=queue,
             virtual_events=self.virtual_events,
         )
         if self.newest_pruned_id is not None:
@@ -342,11 +502,16 @@ class EventQueue:
         return d
 
     @classmethod
-    def from_dict(cls, d: dict[str, Any]) -> "EventQueue":
+    def from_dict(
+        cls, d: dict[str, Any], shared_payloads: SharedPayloadTable | None = None
+    ) -> "EventQueue":
         ret = cls(d["id"])
         ret.next_event_id = d["next_event_id"]
         ret.newest_pruned_id = d.get("newest_pruned_id")
-        ret.queue = deque(d["queue"])
+        if shared_payloads is not None:
+            ret.queue = deque(shared_payloads.decode_event(event) for event in d["queue"])
+        else:
+            ret.queue = deque(d["queue"])
         ret.virtual_events = d.get("virtual_events", {})
         return ret
 
@@ -407,7 +572,9 @@ class EventQueue:
             self.newest_pruned_id = self.queue[0]["id"]
             self.pop()
 
-    def contents(self, include_internal_data: bool = False) -> list[dict[str, Any]]:
+    def contents(
+        self, include_internal_data: bool = False, pre_encoded: bool = False
+    ) -> list[dict[str, Any]]:
         contents: list[dict[str, Any]] = []
         virtual_id_map: dict[str, dict[str, Any]] = {}
         for event_type in self.virtual_events:
@@ -431,13 +598,53 @@ class EventQueue:
 
         if include_internal_data:
             return contents
-        return prune_internal_data(contents)
+        return prune_internal_data(contents, pre_encoded=pre_encoded)
+
+
+class PreEncodedPayload(dict[str, Any]):
+    """A message payload which is shared between the events for every
+    recipient of a message, and which caches its JSON encoding, so
+    that it is encoded once per message, rather than once for every
+    get_events response which includes it.
+
+    Like any payload shared between queues, it must not be mutated
+    once it has been pushed to a queue.
+    """
+
+    __slots__ = ("encoded",)
+
+    def __init__(self, payload: Mapping[str, Any]) -> None:
+        super().__init__(payload)
+        self.encoded: bytes | None = None
+
+    def fragment(self) -> orjson.Fragment:
+        if self.encoded is None:
+            self.encoded = orjson.dumps(self, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        return orjson.Fragment(self.encoded)
 
 
-def prune_internal_data(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
+def prune_internal_data(
+    events: list[dict[str, Any]], pre_encoded: bool = False
+) -> list[dict[str, Any]]:
     """Prunes the internal_data data structures, which are not intended to
     be exposed to API clients.
+
+    With pre_encoded=True, the returned events are only suitable for
+    serializing to JSON: rather than a deep copy, each event is a
+    shallow copy, with message payloads spliced in as pre-encoded
+    JSON fragments.
     """
+    if pre_encoded:
+        pruned_events = []
+        for event in events:
+            event = dict(event)
+            if event["type"] == "message":
+                event.pop("internal_data", None)
+                if isinstance(event["message"], PreEncodedPayload):
+                    event["message"] = event["message"].fragment()
+            pruned_events.append(event)
+        return pruned_events
+
     events = copy.deepcopy(events)
     for event in events:
         if event["type"] == "message" and "internal_data" in event:
@@ -454,8 +661,54 @@ web_reload_clients: dict[str, Literal[True]] = {}
 clients: dict[str, ClientDescriptor] = {}
 # maps user id to list of client descriptors
 user_clients: dict[int, list[ClientDescriptor]] = {}
-# maps realm id to list of client descriptors with all_public_streams=True
+# maps realm id to list of message-receiving client descriptors with
+# all_public_streams=True, or with a narrow not limited to one channel
 realm_clients_all_streams: dict[int, list[ClientDescriptor]] = {}
+# maps realm id and lowercased channel name to list of message-receiving
+# client descriptors whose narrow is limited to that channel
+realm_clients_by_narrowed_stream: dict[int, dict[str, list[ClientDescriptor]]] = {}
+
+# Min-heap of (expiry time, queue id), with one entry per queue, so
+# that GC only examines queues which may have expired.  A queue's
+# entry may be earlier than its current expiry time, since reconnecting
+# pushes that back; GC then pushes the entry back, rather than every
+# long-poll adding an entry.  Entries for deleted queues are skipped
+# when popped.
+expiry_heap: list[tuple[float, str]] = []
+
+# Queue ids which exceeded settings.EVENT_QUEUE_MAX_EVENTS while their
+# client was away, to be garbage-collected once the current event has
+# been processed; see gc_overflowed_event_queues.
+overflowed_queue_ids: set[str] = set()
+
+# Queue ids which have been modified (or garbage-collected) since they
+# were last written to the event queue journal; only maintained when
+# settings.TORNADO_EVENT_QUEUE_JOURNAL is enabled.
+dirty_queue_ids: set[str] = set()
+# Number of records in the current journal file, and in it just after
+# it was last compacted, used to decide when to compact it again.
+journal_record_count = 0
+compacted_journal_record_count = 0
+
+# Maps the ids of users whose event queues were handed off to another
+# Tornado process, during a shard rebalance, to that process's port.
+# Until every Django process has loaded the new sharding
+# configuration, events for those users may still be routed here;
+# they are forwarded to the new port.
+forwarded_user_ports: dict[int, int] = {}
+forwarding_expires_at = 0.0
+# Forwarded notices held back, by port, until that port has confirmed
+# that it imported the handed-off queues.
+pending_forwarded_notices: dict[int, list[dict[str, Any]]] = {}
+# While queues are being handed off, a message can reach a process
+# twice: from a Django process still using the old sharding
+# configuration, and forwarded by the process which handed the queues
+# off (or, if the handoff failed, held and then processed locally).
+# Both copies are delivered to the realm's all_public_streams and
+# narrowed clients, so until the handoff window ends, we remember
+# which queues each message was delivered to.
+delivered_message_queue_ids: dict[int, set[str]] = {}
+message_dedup_expires_at = 0.0
 
 # list of registered gc hooks.
 # each one will be called with a user profile id, queue, and bool
@@ -464,14 +717,34 @@ realm_clients_all_streams: dict[int, list[ClientDescriptor]] = {}
 # that is about to be deleted
 gc_hooks: list[Callable[[int, ClientDescriptor, bool], None]] = []
 
+# The message payloads written to the current event queue journal
+# file, which its later records reference by index.  Like the file,
+# this is only reset when the journal is started afresh or compacted.
+journal_payloads = SharedPayloadTable()
+
 
 def clear_client_event_queues_for_testing() -> None:
+    global message_dedup_expires_at
     assert settings.TEST_SUITE
     clients.clear()
     web_reload_clients.clear()
     user_clients.clear()
     realm_clients_all_streams.clear()
+    realm_clients_by_narrowed_stream.clear()
     gc_hooks.clear()
+    dirty_queue_ids.clear()
+    expiry_heap.clear()
+    overflowed_queue_ids.clear()
+    forwarded_user_ports.clear()
+    pending_forwarded_notices.clear()
+    delivered_message_queue_ids.clear()
+    message_dedup_expires_at = 0.0
+    reset_journal_payloads()
+
+
+def mark_queue_dirty(queue_id: str) -> None:
+    if settings.TORNADO_EVENT_QUEUE_JOURNAL:
+        dirty_queue_ids.add(queue_id)
 
 
 def add_client_gc_hook(hook: Callable[[int, ClientDescriptor, bool], None]) -> None:
@@ -501,10 +774,37 @@ def get_client_descriptors_for_realm_all_streams(realm_id: int) -> list[ClientDe
     return realm_clients_all_streams.get(realm_id, [])
 
 
+def get_client_descriptors_for_realm_narrowed_stream(
+    realm_id: int, stream_name: str
+) -> list[ClientDescriptor]:
+    return realm_clients_by_narrowed_stream.get(realm_id, {}).get(stream_name.lower(), [])
+
+
+def get_narrowed_stream_name(client: ClientDescriptor) -> str | None:
+    # A client narrowed to a channel can only accept messages sent to
+    # it, so we index such clients by channel, to avoid considering
+    # them for every message sent in the realm.
+    for operator, operand in client.narrow:
+        if operator in channel_operators:
+            return operand.lower()
+    return None
+
+
+def schedule_queue_expiry(client: ClientDescriptor) -> None:
+    heapq.heappush(expiry_heap, (client.expiry_time(), client.event_queue.id))
+
+
 def add_to_client_dicts(client: ClientDescriptor) -> None:
+    schedule_queue_expiry(client)
     user_clients.setdefault(client.user_profile_id, []).append(client)
-    if client.all_public_streams or client.narrow != []:
-        realm_clients_all_streams.setdefault(client.realm_id, []).append(client)
+    if (client.all_public_streams or client.narrow != []) and client.accepts_messages():
+        stream_name = get_narrowed_stream_name(client)
+        if stream_name is not None:
+            realm_clients_by_narrowed_stream.setdefault(client.realm_id, {}).setdefault(
+                stream_name, []
+            ).append(client)
+        else:
+            realm_clients_all_streams.setdefault(client.realm_id, []).append(client)
 
 
 def allocate_client_descriptor(new_queue_data: MutableMapping[str, Any]) -> ClientDescriptor:
@@ -513,14 +813,18 @@ def allocate_client_descriptor(new_queue_data: MutableMapping[str, Any]) -> Clie
     client = ClientDescriptor.from_dict(new_queue_data)
     clients[queue_id] = client
     add_to_client_dicts(client)
+    mark_queue_dirty(queue_id)
     return client
 
 
 def do_gc_event_queues(
-    to_remove: AbstractSet[str], affected_users: AbstractSet[int], affected_realms: AbstractSet[int]
+    to_remove: AbstractSet[str],
+    affected_users: AbstractSet[int],
+    affected_realms: AbstractSet[int],
+    handed_off: bool = False,
 ) -> None:
     def filter_client_dict(
-        client_dict: MutableMapping[int, list[ClientDescriptor]], key: int
+        client_dict: MutableMapping[Any, list[ClientDescriptor]], key: int | str
     ) -> None:
         if key not in client_dict:
             return
@@ -537,16 +841,86 @@ def do_gc_event_queues(
     for realm_id in affected_realms:
         filter_client_dict(realm_clients_all_streams, realm_id)
 
+    for id in to_remove:
+        realm_id = clients[id].realm_id
+        stream_name = get_narrowed_stream_name(clients[id])
+        if stream_name is None or realm_id not in realm_clients_by_narrowed_stream:
+            continue
+        filter_client_dict(realm_clients_by_narrowed_stream[realm_id], stream_name)
+        if len(realm_clients_by_narrowed_stream[realm_id]) == 0:
+            del realm_clients_by_narrowed_stream[realm_id]
+
     for id in to_remove:
         if id in web_reload_clients:
             del web_reload_clients[id]
-        for cb in gc_hooks:
+        # Queues handed off to another Tornado process live on there,
+        # so must not trigger e.g. missed-message notifications.
+        for cb in [] if handed_off else gc_hooks:
             cb(
                 clients[id].user_profile_id,
                 clients[id],
                 clients[id].user_profile_id not in user_clients,
             )
         del clients[id]
+        # Journal a tombstone for the queue at the next checkpoint.
+        mark_queue_dirty(id)
+
+
+def gc_overflowed_event_queues() -> None:
+    # Rather than letting the queue of an absent client grow without
+    # bound, we garbage-collect it, running the usual GC hooks (so
+    # e.g. missed-message notifications are still sent); as with an
+    # expired queue, the client will get a BAD_EVENT_QUEUE_ID error on
+    # its next request, and re-register.
+    to_remove = {
+        id
+        for id in overflowed_queue_ids
+        if id in clients and clients[id].current_handler_id is None
+    }
+    overflowed_queue_ids.clear()
+    if not to_remove:
+        return
+    do_gc_event_queues(
+        to_remove,
+        {clients[id].user_profile_id for id in to_remove},
+        {clients[id].realm_id for id in to_remove},
+    )
+    logging.info(
+        "Tornado removed %d event queues with more than %d events",
+        len(to_remove),
+        settings.EVENT_QUEUE_MAX_EVENTS,
+    )
+
+
+def get_event_queue_stats(limit: int) -> dict[str, Any]:
+    now = time.time()
+    largest = heapq.nlargest(
+        limit,
+        clients.values(),
+        key=lambda client: len(client.event_queue.queue) + len(client.event_queue.virtual_events),
+    )
+    queues = [
+        dict(
+            queue_id=client.event_queue.id,
+            user_id=client.user_profile_id,
+            realm_id=client.realm_id,
+            client_type_name=client.client_type_name,
+            events=len(client.event_queue.queue) + len(client.event_queue.virtual_events),
+            # Message payloads may be shared with other queues, so
+            # this overestimates the memory that the queue retains.
+            bytes=len(orjson.dumps(client.event_queue.to_dict())),
+            connected=client.current_handler_id is not None,
+            idle_secs=int(now - client.last_connection_time),
+        )
+        for client in largest
+    ]
+    return dict(
+        queue_count=len(clients),
+        # Queues with equivalent narrows share a predicate; see
+        # get_shared_narrow_predicate.
+        distinct_narrow_count=get_distinct_narrow_count(),
+        queues=queues,
+    )
 
 
 def gc_event_queues(port: int) -> None:
@@ -556,30 +930,174 @@ def gc_event_queues(port: int) -> None:
     to_remove: set[str] = set()
     affected_users: set[int] = set()
     affected_realms: set[int] = set()
-    for id, client in clients.items():
+    examined = 0
+    not_expired: list[ClientDescriptor] = []
+    while expiry_heap and expiry_heap[0][0] <= start:
+        _, id = heapq.heappop(expiry_heap)
+        examined += 1
+        client = clients.get(id)
+        if client is None:
+            # The queue was since deleted.
+            continue
         if client.expired(start):
             to_remove.add(id)
             affected_users.add(client.user_profile_id)
             affected_realms.add(client.realm_id)
+        else:
+            # The queue was used since its entry was pushed, or has a
+            # long-poll in progress.
+            not_expired.append(client)
+    # Pushed back only after the loop, since a connected queue's
+    # expiry time may already have passed.
+    for client in not_expired:
+        schedule_queue_expiry(client)
 
     # We don't need to call e.g. finish_current_handler on the clients
     # being removed because they are guaranteed to be idle (because
     # they are expired) and thus not have a current handler.
     do_gc_event_queues(to_remove, affected_users, affected_realms)
+    gc_overflowed_event_queues()
+
+    if len(expiry_heap) > 2 * len(clients) + 1000:
+        # Entries for deleted queues have come to dominate the heap.
+        expiry_heap[:] = [(client.expiry_time(), id) for id, client in clients.items()]
+        heapq.heapify(expiry_heap)
+
+    if forwarded_user_ports and start > forwarding_expires_at:
+        forwarded_user_ports.clear()
+    if delivered_message_queue_ids and start > message_dedup_expires_at:
+        delivered_message_queue_ids.clear()
 
     if settings.PRODUCTION:
         logging.info(
-            "Tornado %d removed %d expired event queues owned by %d users in %.3fs."
-            "  Now %d active queues, %s",
+            "Tornado %d removed %d expired event queues owned by %d users"
+            " (of %d candidates) in %.3fs."
+            "  Now %d active queues with %d distinct narrows, %s",
             port,
             len(to_remove),
             len(affected_users),
+            examined,
             time.time() - start,
             len(clients),
+            get_distinct_narrow_count(),
             handler_stats_string(),
         )
 
 
+def get_event_queue_owners() -> dict[int, set[int]]:
+    owners: dict[int, set[int]] = {}
+    for client in clients.values():
+        owners.setdefault(client.realm_id, set()).add(client.user_profile_id)
+    return owners
+
+
+def export_event_queues(user_ports: Mapping[int, int]) -> dict[int, list[dict[str, Any]]]:
+    """Removes the event queues of the given users, whom the sharding
+    configuration now assigns to other Tornado processes, and returns
+    them serialized by destination port.  Events for those users are
+    held back until complete_event_queue_handoff is called for the
+    port, once it has imported the queues."""
+    global forwarding_expires_at, message_dedup_expires_at
+    exported: dict[int, list[dict[str, Any]]] = {}
+    to_remove: set[str] = set()
+    affected_users: set[int] = set()
+    affected_realms: set[int] = set()
+    for queue_id, client in clients.items():
+        port = user_ports.get(client.user_profile_id)
+        if port is None:
+            continue
+        # Finish any pending long-poll, so that the client's next
+        # request is routed to the queue's new home.
+        client.finish_current_handler()
+        exported.setdefault(port, []).append(client.to_dict())
+        to_remove.add(queue_id)
+        affected_users.add(client.user_profile_id)
+        affected_realms.add(client.realm_id)
+
+    for user_id in affected_users:
+        port = user_ports[user_id]
+        forwarded_user_ports[user_id] = port
+        pending_forwarded_notices.setdefault(port, [])
+    forwarding_expires_at = time.time() + EVENT_QUEUE_FORWARDING_SECS
+    message_dedup_expires_at = forwarding_expires_at
+
+    do_gc_event_queues(to_remove, affected_users, affected_realms, handed_off=True)
+    if to_remove:
+        # Drop the handed-off queues' expiry entries, so that if the
+        # handoff fails, the queues we take back have only one each.
+        expiry_heap[:] = [entry for entry in expiry_heap if entry[1] not in to_remove]
+        heapq.heapify(expiry_heap)
+    return exported
+
+
+def import_event_queues(queues: Iterable[MutableMapping[str, Any]]) -> int:
+    global message_dedup_expires_at
+    message_dedup_expires_at = time.time() + EVENT_QUEUE_FORWARDING_SECS
+    imported = 0
+    for queue_data in queues:
+        client = ClientDescriptor.from_dict(queue_data)
+        # The user's queues live here again, if they were previously
+        # handed off from this process.
+        forwarded_user_ports.pop(client.user_profile_id, None)
+        queue_id = client.event_queue.id
+        if queue_id in clients:
+            # The handoff request was retried.
+            continue
+        clients[queue_id] = client
+        add_to_client_dicts(client)
+        mark_queue_dirty(queue_id)
+        imported += 1
+    return imported
+
+
+def complete_event_queue_handoff(port: int) -> None:
+    for notice in pending_forwarded_notices.pop(port, []):
+        forward_notice(port, notice)
+
+
+def abort_event_queue_handoff(port: int, queues: Iterable[MutableMapping[str, Any]]) -> None:
+    # The other process could not take the queues, so we take them
+    # back, and deliver the events we held for them.  Their clients
+    # will be redirected to the new process, and re-register there.
+    for user_id, user_port in list(forwarded_user_ports.items()):
+        if user_port == port:
+            del forwarded_user_ports[user_id]
+    import_event_queues(queues)
+    for notice in pending_forwarded_notices.pop(port, []):
+        process_notification(notice)
+
+
+def forward_notice(port: int, notice: dict[str, Any]) -> None:
+    if port in pending_forwarded_notices:
+        pending_forwarded_notices[port].append(notice)
+        return
+    queue_json_publish_rollback_unsafe(
+        notify_tornado_queue_name(port), notice, partial(send_notification_http, port)
+    )
+
+
+def forward_notice_for_handed_off_users(notice: Mapping[str, Any]) -> Mapping[str, Any]:
+    """Forwards the part of the notice for users whose queues were
+    handed off to another Tornado process, and returns the part which
+    should be processed locally."""
+    local_users: list[Any] = []
+    port_users: dict[int, list[Any]] = {}
+    for user in notice["users"]:
+        user_id = user if isinstance(user, int) else user["id"]
+        port = forwarded_user_ports.get(user_id)
+        if port is None:
+            local_users.append(user)
+        else:
+            port_users.setdefault(port, []).append(user)
+    if not port_users:
+        return notice
+
+    for port, users in port_users.items():
+        # Marked, so that it is never forwarded back to us.
+        forward_notice(port, dict(event=notice["event"], users=users, forwarded=True))
+    return dict(notice, users=local_users)
+
+
 def persistent_queue_filename(port: int, last: bool = False) -> str:
     if settings.TORNADO_PROCESSES == 1:
         # Use non-port-aware, legacy version.
@@ -591,37 +1109,178 @@ def persistent_queue_filename(port: int, last: bool = False) -> str:
     return settings.JSON_PERSISTENT_QUEUE_FILENAME_PATTERN % ("." + str(port),)
 
 
+def reset_journal_payloads() -> None:
+    global journal_payloads
+    journal_payloads = SharedPayloadTable()
+
+
+def persistent_queue_journal_records(queue_id: str) -> list[bytes]:
+    # Each journal record is one line, holding one of:
+    # * [index, payload]: a message payload, which is written before
+    #   the first queue record which references it by index, as in
+    #   dump_event_queues;
+    # * [queue_id, state]: the full state of a queue; or
+    # * [queue_id, null]: a tombstone for a garbage-collected queue.
+    client = clients.get(queue_id)
+    if client is None:
+        return [orjson.dumps([queue_id, None], option=orjson.OPT_APPEND_NEWLINE)]
+    payloads = journal_payloads.payloads
+    first_new_index = len(payloads)
+    client_dict = client.to_dict(journal_payloads)
+    return [
+        *(
+            orjson.dumps([index, payloads[index]], option=orjson.OPT_APPEND_NEWLINE)
+            for index in range(first_new_index, len(payloads))
+        ),
+        orjson.dumps([queue_id, client_dict], option=orjson.OPT_APPEND_NEWLINE),
+    ]
+
+
+def compact_event_queue_journal(port: int) -> None:
+    global journal_record_count, compacted_journal_record_count
+    start = time.perf_counter()
+
+    filename = persistent_queue_filename(port)
+    # Payloads which are no longer in any queue are dropped along
+    # with the records which referenced them.
+    reset_journal_payloads()
+    records: list[bytes] = []
+    for queue_id in clients:
+        records.extend(persistent_queue_journal_records(queue_id))
+    with open(filename + ".tmp", "wb") as stored_queues:
+        stored_queues.write(EVENT_QUEUE_JOURNAL_HEADER)
+        stored_queues.writelines(records)
+    os.replace(filename + ".tmp", filename)
+    journal_record_count = compacted_journal_record_count = len(records)
+    dirty_queue_ids.clear()
+
+    logging.info(
+        "Tornado %d compacted event queue journal to %d queues in %.3fs",
+        port,
+        len(clients),
+        time.perf_counter() - start,
+    )
+
+
+def checkpoint_event_queues(port: int) -> None:
+    """Appends every queue which changed since the last checkpoint to
+    the journal, so that the cost of persisting the queues is
+    proportional to the number of changed queues, not all queues."""
+    global journal_record_count
+    if journal_record_count > EVENT_QUEUE_JOURNAL_COMPACTION_FACTOR * max(
+        compacted_journal_record_count, 1000
+    ):
+        compact_event_queue_journal(port)
+        return
+
+    start = time.perf_counter()
+    changed_queue_ids = list(dirty_queue_ids)
+    dirty_queue_ids.clear()
+    removed = 0
+    with open(persistent_queue_filename(port), "ab") as stored_queues:
+        if stored_queues.tell() == 0:
+            stored_queues.write(EVENT_QUEUE_JOURNAL_HEADER)
+            reset_journal_payloads()
+        records: list[bytes] = []
+        for queue_id in changed_queue_ids:
+            if queue_id not in clients:
+                removed += 1
+            records.extend(persistent_queue_journal_records(queue_id))
+        stored_queues.writelines(records)
+    journal_record_count += len(records)
+
+    if len(changed_queue_ids) > 0 or settings.PRODUCTION:
+        logging.info(
+            "Tornado %d checkpointed %d changed event queues (%d removed) in %.3fs",
+            port,
+            len(changed_queue_ids),
+            removed,
+            time.perf_counter() - start,
+        )
+
+
 def dump_event_queues(port: int) -> None:
+    if settings.TORNADO_EVENT_QUEUE_JOURNAL:
+        checkpoint_event_queues(port)
+        return
+
     start = time.perf_counter()
 
+    shared_payloads = SharedPayloadTable()
+    queues = [(qid, client.to_dict(shared_payloads)) for (qid, client) in clients.items()]
     with open(persistent_queue_filename(port), "wb") as stored_queues:
-        stored_queues.write(
-            orjson.dumps([(qid, client.to_dict()) for (qid, client) in clients.items()])
-        )
+        stored_queues.write(orjson.dumps(dict(payloads=shared_payloads.payloads, queues=queues)))
 
     if len(clients) > 0 or settings.PRODUCTION:
         logging.info(
-            "Tornado %d dumped %d event queues in %.3fs",
+            "Tornado %d dumped %d event queues with %d distinct message payloads in %.3fs",
             port,
             len(clients),
+            len(shared_payloads.payloads),
             time.perf_counter() - start,
         )
 
 
+def read_event_queue_journal(port: int, data: bytes) -> dict[str, Any]:
+    stored: dict[str, Any] = {}
+    payloads: dict[int, dict[str, Any]] = {}
+    for line in data.removeprefix(EVENT_QUEUE_JOURNAL_HEADER).splitlines():
+        try:
+            key, value = orjson.loads(line)
+        except ValueError:
+            # A partially-written final record, from a process which
+            # was killed mid-checkpoint; the previous record for that
+            # queue, if any, remains valid.
+            logging.warning("Tornado %d skipped a truncated event queue journal record", port)
+            continue
+        if isinstance(key, int):
+            payloads[key] = value
+        elif value is None:
+            stored.pop(key, None)
+        else:
+            # Payload references are resolved as we go, since a
+            # process appending to the journal after a restart numbers
+            # its payloads afresh.
+            for event in value["event_queue"]["queue"]:
+                if event["type"] == "message" and isinstance(event["message"], int):
+                    event["message"] = payloads[event["message"]]
+            stored[key] = value
+    return stored
+
+
 def load_event_queues(port: int) -> None:
     global clients
     start = time.perf_counter()
 
+    # The file may be either a single JSON object of every queue, as
+    # written by dump_event_queues, or the line-oriented journal
+    # written by checkpoint_event_queues; we support loading either,
+    # so that TORNADO_EVENT_QUEUE_JOURNAL can be toggled across a
+    # restart.
+    shared_payloads = SharedPayloadTable()
     try:
         with open(persistent_queue_filename(port), "rb") as stored_queues:
-            data = orjson.loads(stored_queues.read())
+            raw_data = stored_queues.read()
+        if raw_data.startswith(EVENT_QUEUE_JOURNAL_HEADER):
+            data = read_event_queue_journal(port, raw_data).items()
+        elif raw_data.startswith(b"{"):
+            stored = orjson.loads(raw_data)
+            shared_payloads = SharedPayloadTable(stored["payloads"])
+            data = stored["queues"]
+        else:
+            # TODO/compatibility: Queues dumped as a bare list,
+            # without a table of shared payloads.  Remove this once
+            # one can no longer directly upgrade from 9.x to main.
+            data = orjson.loads(raw_data)
     except FileNotFoundError:
         pass
     except orjson.JSONDecodeError:
         logging.exception("Tornado %d could not deserialize event queues", port, stack_info=True)
     else:
         try:
-            clients = {qid: ClientDescriptor.from_dict(client) for (qid, client) in data}
+            clients = {
+                qid: ClientDescriptor.from_dict(client, shared_payloads) for (qid, client) in data
+            }
         except Exception:
             logging.exception(
                 "Tornado %d could not deserialize event queues", port, stack_info=True
@@ -633,6 +1292,9 @@ def load_event_queues(port: int) -> None:
         # Put code for migrations due to event queue data format changes here
 
         add_to_client_dicts(client)
+        # The journal file is moved aside after loading, so every
+        # queue must be written to the new journal.
+        mark_queue_dirty(client.event_queue.id)
 
     if len(clients) > 0 or settings.PRODUCTION:
         logging.info(
@@ -699,6 +1361,28 @@ async def setup_event_queue(
     pc = tornado.ioloop.PeriodicCallback(lambda: gc_event_queues(port), EVENT_QUEUE_GC_FREQ_MSECS)
     pc.start()
 
+    heartbeat_pc = tornado.ioloop.PeriodicCallback(heartbeat_wheel.advance, 1000)
+    heartbeat_pc.start()
+
+    # Statistics are flushed to Redis between events, rather than
+    # blocking the IO loop while one is being handled.
+    stage_timing.flush_inline = False
+    stage_timing_pc = tornado.ioloop.PeriodicCallback(
+        stage_timing.flush_stage_histograms, stage_timing.STAGE_TIMING_FLUSH_INTERVAL * 1000
+    )
+    stage_timing_pc.start()
+    cache_stats.flush_inline = False
+    cache_stats_pc = tornado.ioloop.PeriodicCallback(
+        cache_stats.flush_cache_stats, cache_stats.CACHE_STATS_FLUSH_INTERVAL * 1000
+    )
+    cache_stats_pc.start()
+
+    if settings.TORNADO_EVENT_QUEUE_JOURNAL and not settings.TEST_SUITE:
+        checkpoint_pc = tornado.ioloop.PeriodicCallback(
+            lambda: checkpoint_event_queues(port), EVENT_QUEUE_CHECKPOINT_FREQ_MSECS
+        )
+        checkpoint_pc.start()
+
     send_restart_events()
     if send_reloads:
         send_web_reload_client_events(immediate=settings.DEVELOPMENT)
@@ -747,11 +1431,12 @@ def fetch_events(
                         event_id=last_event_id,
                     )
                 )
+            mark_queue_dirty(queue_id)
             was_connected = client.finish_current_handler()
 
         if not client.event_queue.empty() or dont_block:
             response: dict[str, Any] = dict(
-                events=client.event_queue.contents(),
+                events=client.event_queue.contents(pre_encoded=True),
             )
             if orig_queue_id is None:
                 response["queue_id"] = queue_id
@@ -1015,7 +1700,12 @@ def get_client_info_for_message_event(
     # bots) that are registered to get events for ALL streams.
     if "stream_name" in event_template and not event_template.get("invite_only"):
         realm_id = event_template["realm_id"]
-        for client in get_client_descriptors_for_realm_all_streams(realm_id):
+        for client in itertools.chain(
+            get_client_descriptors_for_realm_all_streams(realm_id),
+            get_client_descriptors_for_realm_narrowed_stream(
+                realm_id, event_template["stream_name"]
+            ),
+        ):
             send_to_clients[client.event_queue.id] = dict(
                 client=client,
                 flags=[],
@@ -1044,6 +1734,16 @@ def process_message_event(
     for high-level documentation on this subsystem.
     """
     send_to_clients = get_client_info_for_message_event(event_template, users)
+    if time.time() < message_dedup_expires_at:
+        delivered = delivered_message_queue_ids.setdefault(
+            event_template["message_dict"]["id"], set()
+        )
+        send_to_clients = {
+            queue_id: client_info
+            for queue_id, client_info in send_to_clients.items()
+            if queue_id not in delivered
+        }
+        delivered.update(send_to_clients)
 
     presence_idle_user_ids = set(event_template.get("presence_idle_user_ids", []))
     online_push_user_ids = set(event_template.get("online_push_user_ids", []))
@@ -1123,17 +1823,25 @@ def process_message_event(
     def get_client_payload(
         apply_markdown: bool, client_gravatar: bool, can_access_sender: bool
     ) -> dict[str, Any]:
-        return MessageDict.finalize_payload(
-            wide_dict,
-            apply_markdown=apply_markdown,
-            client_gravatar=client_gravatar,
-            can_access_sender=can_access_sender,
-            realm_host=realm_host,
+        # Each distinct payload is shared by all the clients which
+        # receive it, and is JSON-encoded at most once.
+        return PreEncodedPayload(
+            MessageDict.finalize_payload(
+                wide_dict,
+                apply_markdown=apply_markdown,
+                client_gravatar=client_gravatar,
+                can_access_sender=can_access_sender,
+                realm_host=realm_host,
+            )
         )
 
     # Extra user-specific data to include
     extra_user_data: dict[int, Any] = {}
 
+    # Deciding on and enqueueing push and email notifications, and
+    # then delivering the message to event queues, are timed as
+    # separate stages of sending a message.
+    stage_start = time.perf_counter()
     for user_data in users:
         user_profile_id: int = user_data["id"]
         flags: Collection[str] = user_data.get("flags", [])
@@ -1192,6 +1900,9 @@ def process_message_event(
             )
         )
 
+    record_stage_time("notification_enqueue", time.perf_counter() - stage_start)
+
+    stage_start = time.perf_counter()
     for client_data in send_to_clients.values():
         client = client_data["client"]
         flags = client_data["flags"]
@@ -1231,6 +1942,7 @@ def process_message_event(
             continue
 
         client.add_event(user_event)
+    record_stage_time("event_queue_delivery", time.perf_counter() - stage_start)
 
 
 def process_presence_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
@@ -1591,7 +2303,29 @@ def process_user_group_name_update_event(event: Mapping[str, Any], users: Iterab
                 client.add_event(user_group_event)
 
 
+def unpack_notices(notices: list[dict[str, Any]]) -> Iterable[dict[str, Any]]:
+    # send_event_on_commit sends consecutive events from a transaction
+    # to each shard as a single batched notice.
+    for notice in notices:
+        if "notices" in notice:
+            record_batch_size("tornado_notice", len(notice["notices"]))
+            yield from notice["notices"]
+        else:
+            record_batch_size("tornado_notice", 1)
+            yield notice
+
+
 def process_notification(notice: Mapping[str, Any]) -> None:
+    if "notices" in notice:
+        for unpacked_notice in unpack_notices([dict(notice)]):
+            process_notification(unpacked_notice)
+        return
+
+    if forwarded_user_ports and not notice.get("forwarded"):
+        notice = forward_notice_for_handed_off_users(notice)
+        if not notice["users"] and notice["event"]["type"] != "message":
+            return
+
     event: Mapping[str, Any] = notice["event"]
     users: list[int] | list[Mapping[str, Any]] = notice["users"]
     start_time = time.perf_counter()
@@ -1633,6 +2367,8 @@ def process_notification(notice: Mapping[str, Any]) -> None:
             client.cleanup()
     else:
         process_event(event, cast(list[int], users))
+    if overflowed_queue_ids:
+        gc_overflowed_event_queues()
     logging.debug(
         "Tornado: Event %s for %s users took %sms",
         event["type"],
@@ -1650,10 +2386,18 @@ def get_wrapped_process_notification(queue_name: str) -> Callable[[list[dict[str
         )
 
     def wrapped_process_notification(notices: list[dict[str, Any]]) -> None:
-        for notice in notices:
-            try:
-                process_notification(notice)
-            except Exception:
-                retry_event(queue_name, notice, failure_processor)
+        # Batches are unpacked here, rather than in
+        # process_notification, so that a failure processing one
+        # event only retries that event.
+        try:
+            for notice in unpack_notices(notices):
+                try:
+                    process_notification(notice)
+                except Exception:
+                    retry_event(queue_name, notice, failure_processor)
+        finally:
+            # Like a queue worker, Tornado treats each batch of events
+            # as a unit of work.
+            flush_per_request_caches()
 
     return wrapped_process_notification
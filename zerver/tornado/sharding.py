@@ -1,28 +1,75 @@
+import hashlib
 import json
 import os
 import re
+import time
 from re import Pattern
 
 from django.conf import settings
 
 from zerver.models import Realm, UserProfile
 
+SHARDING_CONFIG_PATH = "/etc/zulip/sharding.json"
+# How often to stat() the sharding configuration for changes; a
+# rebalance forces a reload, so this only bounds how long a process
+# which was not told about the change keeps routing with the old map.
+SHARDING_CONFIG_CHECK_INTERVAL_SECS = 5
+
 shard_map: dict[str, int | list[int]] = {}
 shard_regexes: list[tuple[Pattern[str], int | list[int]]] = []
-if os.path.exists("/etc/zulip/sharding.json"):
-    with open("/etc/zulip/sharding.json") as f:
-        data = json.loads(f.read())
-        shard_map = data.get(
-            "shard_map",
-            data,  # backwards compatibility
-        )
-        shard_regexes = [
-            (re.compile(regex, re.IGNORECASE), port)
-            for regex, port in data.get("shard_regexes", [])
-        ]
+# Opaque identifier for the loaded configuration, used to verify that
+# two Tornado processes handing off event queues agree on the map.
+shard_map_version = ""
+shard_map_mtime_ns: int | None = None
+last_shard_map_check = 0.0
+
+
+def load_sharding_config() -> str:
+    global shard_map, shard_regexes, shard_map_version, shard_map_mtime_ns
+    try:
+        with open(SHARDING_CONFIG_PATH, "rb") as f:
+            contents = f.read()
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+    except FileNotFoundError:
+        shard_map, shard_regexes = {}, []
+        shard_map_version, shard_map_mtime_ns = "", None
+        return shard_map_version
+
+    data = json.loads(contents)
+    shard_map = data.get(
+        "shard_map",
+        data,  # backwards compatibility
+    )
+    shard_regexes = [
+        (re.compile(regex, re.IGNORECASE), port) for regex, port in data.get("shard_regexes", [])
+    ]
+    shard_map_version = hashlib.sha256(contents).hexdigest()
+    shard_map_mtime_ns = mtime_ns
+    return shard_map_version
+
+
+def maybe_reload_sharding_config() -> None:
+    """Picks up a new sharding.json without a restart.  This is cheap
+    enough to call on every lookup, since it only stat()s the file
+    once every SHARDING_CONFIG_CHECK_INTERVAL_SECS."""
+    global last_shard_map_check
+    now = time.monotonic()
+    if now - last_shard_map_check < SHARDING_CONFIG_CHECK_INTERVAL_SECS:
+        return
+    last_shard_map_check = now
+    try:
+        mtime_ns: int | None = os.stat(SHARDING_CONFIG_PATH).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = None
+    if mtime_ns != shard_map_mtime_ns:
+        load_sharding_config()
+
+
+load_sharding_config()
 
 
 def get_realm_tornado_ports(realm: Realm) -> list[int]:
+    maybe_reload_sharding_config()
     if realm.host in shard_map:
         ports = shard_map[realm.host]
         return [ports] if isinstance(ports, int) else ports
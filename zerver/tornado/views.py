@@ -1,7 +1,10 @@
+import logging
 import time
 from collections.abc import Callable
 from typing import Annotated, Any, TypeVar
 
+import orjson
+import requests
 from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
@@ -17,15 +20,31 @@ from zerver.lib.response import AsynchronousResponse, json_success
 from zerver.lib.typed_endpoint import ApiParamConfig, DocumentationStatus, typed_endpoint
 from zerver.models import UserProfile
 from zerver.models.clients import get_client
+from zerver.models.realms import get_realm_by_id
 from zerver.models.users import get_user_profile_by_id
+from zerver.tornado import descriptors
 from zerver.tornado.descriptors import is_current_port
+from zerver.tornado.django_api import requests_client
 from zerver.tornado.event_queue import (
+    abort_event_queue_handoff,
     access_client_descriptor,
+    complete_event_queue_handoff,
+    export_event_queues,
     fetch_events,
+    get_event_queue_owners,
+    get_event_queue_stats,
+    import_event_queues,
     process_notification,
     send_web_reload_client_events,
 )
-from zerver.tornado.sharding import get_user_tornado_port, notify_tornado_queue_name
+from zerver.tornado.sharding import (
+    get_realm_tornado_ports,
+    get_tornado_url,
+    get_user_id_tornado_port,
+    get_user_tornado_port,
+    load_sharding_config,
+    notify_tornado_queue_name,
+)
 
 P = ParamSpec("P")
 T = TypeVar("T")
@@ -67,6 +86,77 @@ def web_reload_clients(
     )
 
 
+@internal_api_view(True)
+@typed_endpoint
+def event_queue_stats(request: HttpRequest, *, limit: Json[int] = 20) -> HttpResponse:
+    # Used by the report_event_queues management command.
+    stats = in_tornado_thread(get_event_queue_stats)(limit)
+    return json_success(request, stats)
+
+
+@internal_api_view(True)
+@typed_endpoint
+def rebalance_event_queues(request: HttpRequest, *, version: str) -> HttpResponse:
+    # Called on every Tornado process, by refresh-sharding-and-restart,
+    # once the new sharding.json is in place.  We hand off the queues
+    # of users which it assigns to another process directly to that
+    # process, so their clients keep their queues and pending events.
+    #
+    # The caller passes the version of sharding.json it expects every
+    # process to have, so that no two processes can disagree about
+    # where users belong, and bounce their queues back and forth.
+    #
+    # Django processes pick up the new sharding.json only within
+    # SHARDING_CONFIG_CHECK_INTERVAL_SECS.  Until then, they can still
+    # allocate queues for moved users here, after we have handed off
+    # their other queues; nginx already routes those clients to their
+    # new process, which replies with BAD_EVENT_QUEUE_ID, and they
+    # re-register there, as all clients did before queues were handed
+    # off.  Those queues are garbage-collected here as usual.
+    if load_sharding_config() != version:
+        raise JsonableError(_("Sharding configuration does not match."))
+    user_ports: dict[int, int] = {}
+    for realm_id, user_ids in in_tornado_thread(get_event_queue_owners)().items():
+        realm_ports = get_realm_tornado_ports(get_realm_by_id(realm_id))
+        for user_id in user_ids:
+            user_port = get_user_id_tornado_port(realm_ports, user_id)
+            if user_port != descriptors.current_port:
+                user_ports[user_id] = user_port
+
+    handed_off = 0
+    for port, queues in in_tornado_thread(export_event_queues)(user_ports).items():
+        try:
+            resp = requests_client().post(
+                get_tornado_url(port) + "/api/internal/receive_event_queues",
+                data={
+                    "secret": settings.SHARED_SECRET,
+                    "queues": orjson.dumps(queues),
+                },
+                timeout=30,
+            )
+            resp.raise_for_status()
+        except requests.exceptions.RequestException:
+            logging.exception("Failed to hand off %d event queues to port %d", len(queues), port)
+            in_tornado_thread(abort_event_queue_handoff)(port, queues)
+        else:
+            in_tornado_thread(complete_event_queue_handoff)(port)
+            handed_off += len(queues)
+    return json_success(request, {"handed_off_queues": handed_off, "version": version})
+
+
+@internal_api_view(True)
+@typed_endpoint
+def receive_event_queues(
+    request: HttpRequest, *, queues: Json[list[dict[str, Any]]]
+) -> HttpResponse:
+    # The sending process has checked that its sharding configuration
+    # is the version which rebalance-event-queues expects, and this
+    # process is checked against the same version when it rebalances,
+    # so we need not re-read sharding.json here.
+    imported = in_tornado_thread(import_event_queues)(queues)
+    return json_success(request, {"imported_queues": imported})
+
+
 @typed_endpoint
 def cleanup_event_queue(
     request: HttpRequest, user_profile: UserProfile, *, queue_id: str
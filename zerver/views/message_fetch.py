@@ -29,6 +29,7 @@ from zerver.lib.narrow import (
 )
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
+from zerver.lib.soft_deactivation import add_missing_deferred_messages
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
 from zerver.lib.topic import DB_TOPIC_NAME, MATCH_TOPIC
 from zerver.lib.topic_sqlalchemy import topic_column_sa
@@ -210,6 +211,12 @@ def get_messages_backend(
         assert log_data is not None
         log_data["extra"] = "[{}]".format(",".join(verbose_operators))
 
+    if user_profile is not None:
+        # The queries below are based on UserMessage rows, so create
+        # any that were deferred before entering the read-only
+        # transaction.
+        add_missing_deferred_messages(user_profile)
+
     with transaction.atomic(durable=True):
         # We're about to perform a search, and then get results from
         # it; this is done across multiple queries.  To prevent race
@@ -0,0 +1,155 @@
+from collections.abc import Iterable
+
+from django.http import HttpRequest, HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+)
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import Collector, CollectorRegistry
+from typing_extensions import override
+
+from zerver.lib.alert_words import get_alert_word_automaton_builds
+from zerver.lib.cache_stats import get_cache_counters, get_cache_stats
+from zerver.lib.exceptions import AccessDeniedError
+from zerver.lib.rate_limiter import is_local_addr
+from zerver.lib.stage_timing import (
+    BATCH_SIZE_BUCKET_LABELS,
+    STAGE_TIME_BUCKET_LABELS,
+    BatchSizeHistogram,
+    StageHistogram,
+    get_batch_size_histograms,
+    get_stage_histograms,
+)
+
+
+def cumulative_buckets(
+    histogram: StageHistogram | BatchSizeHistogram,
+) -> list[tuple[str, float]]:
+    if isinstance(histogram, BatchSizeHistogram):
+        labels = BATCH_SIZE_BUCKET_LABELS
+    else:
+        labels = STAGE_TIME_BUCKET_LABELS
+    buckets: list[tuple[str, float]] = []
+    cumulative_count = 0
+    for label, count in zip(labels, histogram.bucket_counts, strict=True):
+        cumulative_count += count
+        buckets.append((label, cumulative_count))
+    return buckets
+
+
+class StageTimingCollector(Collector):
+    @override
+    def collect(self) -> Iterable[Metric]:
+        metric = HistogramMetricFamily(
+            "zulip_stage_duration_seconds",
+            "Time spent in each timed stage of sending messages",
+            labels=["stage"],
+        )
+        for stage, histogram in sorted(get_stage_histograms().items()):
+            metric.add_metric([stage], cumulative_buckets(histogram), histogram.total_time)
+        yield metric
+
+        batch_sizes = HistogramMetricFamily(
+            "zulip_batch_size",
+            "Number of items in each batch, such as events in a batched notice to Tornado",
+            labels=["batch"],
+        )
+        for batch, batch_size_histogram in sorted(get_batch_size_histograms().items()):
+            batch_sizes.add_metric(
+                [batch],
+                cumulative_buckets(batch_size_histogram),
+                batch_size_histogram.total_size,
+            )
+        yield batch_sizes
+
+
+class CacheStatsCollector(Collector):
+    @override
+    def collect(self) -> Iterable[Metric]:
+        gets = CounterMetricFamily(
+            "zulip_cache_gets",
+            "Keys read from memcached, by key family and whether they were found",
+            labels=["family", "result"],
+        )
+        sets = CounterMetricFamily(
+            "zulip_cache_sets", "Keys written to memcached, by key family", labels=["family"]
+        )
+        set_bytes = CounterMetricFamily(
+            "zulip_cache_set_bytes",
+            "Pickled size of the values written to memcached, sampled, by key family",
+            labels=["family"],
+        )
+        deletes = CounterMetricFamily(
+            "zulip_cache_deletes", "Keys deleted from memcached, by key family", labels=["family"]
+        )
+        # Not a counter, since a delete can be followed by no miss,
+        # which brings this down.
+        unexplained_misses = GaugeMetricFamily(
+            "zulip_cache_unexplained_misses",
+            "Misses not explained by deletes, a sign of evictions, by key family",
+            labels=["family"],
+        )
+        latency = HistogramMetricFamily(
+            "zulip_cache_request_duration_seconds",
+            "Time spent in memcached requests involving each key family",
+            labels=["family"],
+        )
+        for family, stats in sorted(get_cache_stats().items()):
+            gets.add_metric([family, "hit"], stats.hits)
+            gets.add_metric([family, "miss"], stats.misses)
+            sets.add_metric([family], stats.sets)
+            set_bytes.add_metric([family], stats.set_bytes)
+            deletes.add_metric([family], stats.deletes)
+            unexplained_misses.add_metric([family], stats.unexplained_misses())
+            latency.add_metric(
+                [family], cumulative_buckets(stats.latency), stats.latency.total_time
+            )
+        yield from [gets, sets, set_bytes, deletes, unexplained_misses, latency]
+
+        events = CounterMetricFamily(
+            "zulip_cache_events",
+            "Events, such as hits and misses, in caches other than memcached",
+            labels=["cache", "event"],
+        )
+        for (cache, event), count in sorted(get_cache_counters().items()):
+            events.add_metric([cache, event], count)
+        yield events
+
+
+class AlertWordAutomatonCollector(Collector):
+    @override
+    def collect(self) -> Iterable[Metric]:
+        # Per-realm metrics would be too many on large servers; the
+        # largest automaton is what determines the cost of sending.
+        builds = get_alert_word_automaton_builds()
+        yield GaugeMetricFamily(
+            "zulip_alert_word_automatons",
+            "Realms whose alert word automaton has been built",
+            value=len(builds),
+        )
+        yield GaugeMetricFamily(
+            "zulip_alert_word_automaton_max_words",
+            "Most distinct alert words in any realm's most recently built automaton",
+            value=max((build.word_count for build in builds), default=0),
+        )
+        yield GaugeMetricFamily(
+            "zulip_alert_word_automaton_max_bytes",
+            "Most memory used by any realm's most recently built alert word automaton",
+            value=max((build.total_size for build in builds), default=0),
+        )
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    # Scraped by Prometheus on the same host; nginx also only allows
+    # local access to /api/internal/.
+    if not is_local_addr(request.META["REMOTE_ADDR"]):
+        raise AccessDeniedError
+
+    registry = CollectorRegistry()
+    registry.register(StageTimingCollector())
+    registry.register(CacheStatsCollector())
+    registry.register(AlertWordAutomatonCollector())
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
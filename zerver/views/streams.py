@@ -24,6 +24,7 @@ from zerver.actions.default_streams import (
 )
 from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.message_send import (
+    RenderingCache,
     do_send_messages,
     internal_prep_private_message,
     internal_prep_stream_message,
@@ -772,6 +773,7 @@ def send_messages_for_new_subscribers(
 
     realm = user_profile.realm
     mention_backend = MentionBackend(realm.id)
+    rendering_cache: RenderingCache = {}
 
     # Inform the user if someone else subscribed them to stuff,
     # or if a new stream was created with the "announce" option.
@@ -807,6 +809,7 @@ def send_messages_for_new_subscribers(
                     recipient_user=recipient_user,
                     content=msg,
                     mention_backend=mention_backend,
+                    rendering_cache=rendering_cache,
                 )
             )
 
@@ -5,7 +5,11 @@ from django.utils.translation import gettext as _
 from django.utils.translation import override as override_language
 from pydantic import Json
 
-from zerver.actions.message_send import do_send_messages, internal_prep_private_message
+from zerver.actions.message_send import (
+    RenderingCache,
+    do_send_messages,
+    internal_prep_private_message,
+)
 from zerver.actions.user_groups import (
     add_subgroups_to_user_group,
     bulk_add_members_to_user_groups,
@@ -287,6 +291,7 @@ def notify_for_user_group_subscription_changes(
 ) -> None:
     realm = acting_user.realm
     mention_backend = MentionBackend(realm.id)
+    rendering_cache: RenderingCache = {}
 
     notifications = []
     notification_bot = get_system_bot(settings.NOTIFICATION_BOT, realm.id)
@@ -318,6 +323,7 @@ def notify_for_user_group_subscription_changes(
                 recipient_user=recipient_user,
                 content=message,
                 mention_backend=mention_backend,
+                rendering_cache=rendering_cache,
             )
         )
 
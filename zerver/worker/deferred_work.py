@@ -12,6 +12,7 @@ from django.utils.translation import gettext as _
 from django.utils.translation import override as override_language
 from typing_extensions import override
 
+from zerver.actions.message_edit import do_continue_message_move
 from zerver.actions.message_flags import do_mark_stream_messages_as_read
 from zerver.actions.message_send import internal_send_private_message
 from zerver.actions.realm_export import notify_realm_export
@@ -107,6 +108,26 @@ class DeferredWorker(QueueProcessingWorker):
                 total_messages,
                 event["stream_recipient_id"],
             )
+        elif event["type"] == "continue_message_move":
+            user_profile = get_user_profile_by_id(event["user_profile_id"])
+            logger.info(
+                "Continuing move of messages by user %s from stream %s, after message %s",
+                user_profile.id,
+                event["stream_id"],
+                event["message_id"],
+            )
+            do_continue_message_move(
+                user_profile,
+                event["message_id"],
+                event["stream_id"],
+                event["orig_topic_name"],
+                event["new_stream_id"],
+                event["topic_name"],
+                event["propagate_mode"],
+                event["send_notification_to_old_thread"],
+                event["send_notification_to_new_thread"],
+                event["move_continuation"],
+            )
         elif event["type"] == "clear_push_device_tokens":
             logger.info(
                 "Clearing push device tokens for user_profile_id %s",
@@ -3,7 +3,6 @@ import base64
 import email
 import email.policy
 import logging
-from collections.abc import Mapping
 from email.message import EmailMessage
 from typing import Any
 
@@ -12,21 +11,31 @@ from typing_extensions import override
 from zerver.lib.email_mirror import (
     decode_stream_email_address,
     is_missed_message_address,
+    prep_message,
     rate_limit_mirror_by_realm,
+    send_stream_messages,
 )
-from zerver.lib.email_mirror import process_message as mirror_email
 from zerver.lib.exceptions import RateLimitedError
-from zerver.worker.base import QueueProcessingWorker, WorkerTimeoutError, assign_queue
+from zerver.lib.message import SendMessageRequest
+from zerver.worker.base import LoopQueueProcessingWorker, WorkerTimeoutError, assign_queue
 
 logger = logging.getLogger(__name__)
 
 
 @assign_queue("email_mirror")
-class MirrorWorker(QueueProcessingWorker):
+class MirrorWorker(LoopQueueProcessingWorker):
+    """Emails arriving in a burst (e.g. a mailing list delivering to a
+    channel's address) are mirrored as a batch: each email to a channel
+    address is parsed and rendered separately, by prep_message, but the
+    resulting messages are saved in a single transaction, by one
+    send_stream_messages call.  An email which fails is still handled
+    on its own, as if it were consumed by itself, without failing the
+    rest of the batch."""
+
     MAX_CONSUME_SECONDS = 5
+    batch_size = 20
 
-    @override
-    def consume(self, event: Mapping[str, Any]) -> None:
+    def prep_event(self, event: dict[str, Any]) -> SendMessageRequest | None:
         rcpt_to = event["rcpt_to"]
         content = base64.b64decode(event["msg_base64"])
         msg = email.message_from_bytes(
@@ -46,15 +55,62 @@ class MirrorWorker(QueueProcessingWorker):
                     msg["From"],
                     recipient_realm.subdomain,
                 )
-                return
+                return None
 
+        return prep_message(msg, rcpt_to)
+
+    def send_events(
+        self,
+        prepped: list[tuple[dict[str, Any], SendMessageRequest]],
+        unprocessed: list[dict[str, Any]],
+    ) -> None:
+        """Sends the prepared emails, removing each from unprocessed
+        once it has been sent or its failure has been handled."""
         try:
-            mirror_email(msg, rcpt_to=rcpt_to)
-        except WorkerTimeoutError:  # nocoverage
-            logging.error(
-                "Timed out ingesting message-id %s to %s (%d bytes) -- dropping!",
-                msg["Message-ID"] or "<?>",
-                rcpt_to,
-                len(content),
-            )
+            send_stream_messages([send_request for event, send_request in prepped])
+        except WorkerTimeoutError:
+            raise
+        except Exception as e:
+            if len(prepped) == 1:
+                self._handle_consume_exception([prepped[0][0]], e)
+                unprocessed.remove(prepped[0][0])
+                return
+            # One email which cannot be sent rolls back the whole
+            # transaction; send each separately, so that only that
+            # email is lost.
+            for event, send_request in prepped:
+                self.send_events([(event, send_request)], unprocessed)
             return
+        for event, send_request in prepped:
+            unprocessed.remove(event)
+
+    @override
+    def consume_batch(self, events: list[dict[str, Any]]) -> None:
+        prepped: list[tuple[dict[str, Any], SendMessageRequest]] = []
+        unprocessed = list(events)
+        try:
+            for event in events:
+                try:
+                    send_request = self.prep_event(event)
+                except WorkerTimeoutError:
+                    raise
+                except Exception as e:
+                    self._handle_consume_exception([event], e)
+                    unprocessed.remove(event)
+                    continue
+                if send_request is not None:
+                    prepped.append((event, send_request))
+                else:
+                    # Rate-limited, rejected, or mirrored right away.
+                    unprocessed.remove(event)
+
+            if prepped:
+                self.send_events(prepped, unprocessed)
+        except WorkerTimeoutError:
+            # Only the emails which were not yet mirrored are lost.
+            for event in unprocessed:
+                logging.error(
+                    "Timed out ingesting email to %s (%d bytes) -- dropping!",
+                    event["rcpt_to"],
+                    len(base64.b64decode(event["msg_base64"])),
+                )
@@ -0,0 +1,55 @@
+import zlib
+from collections.abc import Callable
+from timeit import timeit
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandError, CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message_cache import MessageDict, extract_message_dict, stringify_message_dict
+from zerver.models import Message
+
+
+class Command(ZulipBaseCommand):
+    help = """Compares the size and speed of the encoding of message dicts in
+the cache with plain zlib-compressed JSON, using the most recent messages."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--count", help="Number of messages to encode", default=1000, type=int)
+        parser.add_argument("--reps", help="Iterations of each timing", default=5, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        count = options["count"]
+        message_ids = list(Message.objects.order_by("-id").values_list("id", flat=True)[:count])
+        if len(message_ids) < count:
+            raise CommandError("Not enough messages in the database.")
+        message_dicts = MessageDict.ids_to_dict(message_ids)
+
+        def json_encode(message_dict: dict[str, Any]) -> bytes:
+            return zlib.compress(orjson.dumps(message_dict))
+
+        def json_decode(message_bytes: bytes) -> dict[str, Any]:
+            return orjson.loads(zlib.decompress(message_bytes))
+
+        for name, encode, decode in [
+            ("zlib+json", json_encode, json_decode),
+            ("cache", stringify_message_dict, extract_message_dict),
+        ]:
+            encoded = [encode(message_dict) for message_dict in message_dicts]
+            total_bytes = sum(len(message_bytes) for message_bytes in encoded)
+            encode_time = self.time_best(encode, message_dicts, options["reps"])
+            decode_time = self.time_best(decode, encoded, options["reps"])
+            print(
+                f"{name:<10}: {total_bytes / count:7.1f} bytes/message, "
+                f"encode {encode_time * 1000 * 1000 / count:6.1f}ms/1000 messages, "
+                f"decode {decode_time * 1000 * 1000 / count:6.1f}ms/1000 messages"
+            )
+
+    def time_best(self, function: Callable[[Any], Any], items: list[Any], reps: int) -> float:
+        return min(
+            timeit(lambda: [function(item) for item in items], number=1) for _ in range(reps)
+        )
@@ -0,0 +1,93 @@
+import time
+from functools import partial
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.tornado.event_queue import (
+    ClientDescriptor,
+    allocate_client_descriptor,
+    clear_client_event_queues_for_testing,
+    get_client_info_for_message_event,
+)
+
+
+class Command(ZulipBaseCommand):
+    help = """Times finding the event queues which accept a channel message, with
+queues indexed by the channel they are narrowed to, and by checking the
+narrow of every narrowed queue in the realm, as was done before that index.
+
+The queues are created in this process, not in Tornado."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--queues",
+            help="Numbers of narrowed queues to time",
+            default=[100, 1000, 10000],
+            nargs="+",
+            type=int,
+        )
+        parser.add_argument(
+            "--channels",
+            help="Number of channels the queues are narrowed to",
+            default=100,
+            type=int,
+        )
+        parser.add_argument("--reps", help="Iterations of each lookup", default=100, type=int)
+
+    def allocate_queues(self, count: int, channels: int) -> list[ClientDescriptor]:
+        clear_client_event_queues_for_testing()
+        return [
+            allocate_client_descriptor(
+                dict(
+                    all_public_streams=False,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="website",
+                    event_types=None,
+                    last_connection_time=time.time(),
+                    narrow=[["channel", f"channel {i % channels}"]],
+                    queue_timeout=600,
+                    realm_id=0,
+                    user_profile_id=i,
+                )
+            )
+            for i in range(count)
+        ]
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        event_template = dict(realm_id=0, stream_name="channel 0")
+        event = dict(
+            type="message",
+            message=dict(type="stream", display_recipient="channel 0", subject="test"),
+            flags=[],
+        )
+
+        def indexed() -> list[ClientDescriptor]:
+            client_info = get_client_info_for_message_event(event_template, users=[])
+            clients = [info["client"] for info in client_info.values()]
+            return [client for client in clients if client.accepts_event(event)]
+
+        def unindexed(all_narrowed: list[ClientDescriptor]) -> list[ClientDescriptor]:
+            return [client for client in all_narrowed if client.accepts_event(event)]
+
+        try:
+            for count in options["queues"]:
+                all_narrowed = self.allocate_queues(count, options["channels"])
+                lookups = [
+                    ("unindexed", partial(unindexed, all_narrowed)),
+                    ("indexed", indexed),
+                ]
+                assert {client.event_queue.id for client in indexed()} == {
+                    client.event_queue.id for client in unindexed(all_narrowed)
+                }
+                for name, lookup in lookups:
+                    best = min(timeit(lookup, number=1) for _ in range(options["reps"]))
+                    print(f"{count:>6} queues, {name:<9}: {best * 1000 * 1000:8.1f}us/message")
+        finally:
+            clear_client_event_queues_for_testing()
@@ -0,0 +1,68 @@
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import CommandError, CommandParser
+from django.db import transaction
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.user_message import bulk_copy_ums, bulk_insert_ums_values
+from zerver.models import Message, UserMessage, UserProfile
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(ZulipBaseCommand):
+    help = """Times inserting UserMessage rows with INSERT and with COPY.
+
+Every run happens in a transaction which is rolled back."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--counts",
+            help="Numbers of recipients to time",
+            default=[1000, 10000, 100000],
+            nargs="+",
+            type=int,
+        )
+        parser.add_argument("--reps", help="Iterations of each insert", default=3, type=int)
+
+    def time_insert(self, method: str, rows: list[tuple[int, int, int]]) -> float:
+        duration = 0.0
+        try:
+            with transaction.atomic(durable=True):
+                # Make room for the rows, without conflicts.
+                UserMessage.objects.filter(
+                    message_id__in={message_id for _, message_id, _ in rows}
+                ).delete()
+                if method == "copy":
+                    duration = timeit(lambda: bulk_copy_ums(iter(rows)), number=1)
+                else:
+                    duration = timeit(lambda: bulk_insert_ums_values(rows), number=1)
+                raise Rollback
+        except Rollback:
+            pass
+        return duration
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        user_ids = list(UserProfile.objects.values_list("id", flat=True))
+        max_count = max(options["counts"])
+        message_ids = list(
+            Message.objects.order_by("-id").values_list("id", flat=True)[
+                : max_count // len(user_ids) + 1
+            ]
+        )
+        if len(user_ids) * len(message_ids) < max_count:
+            raise CommandError("Not enough messages in the database to generate rows.")
+        all_rows = [(user_id, message_id, 0) for message_id in message_ids for user_id in user_ids]
+
+        for count in options["counts"]:
+            rows = all_rows[:count]
+            for method in ("insert", "copy"):
+                durations = [self.time_insert(method, rows) for _ in range(options["reps"])]
+                best = min(durations)
+                print(f"{count:>7} rows, {method:<6}: {best:.3f}s = {count / best:.0f} rows/s")
@@ -238,7 +238,7 @@ MIDDLEWARE = [
     "zerver.middleware.LogRequests",
     "zerver.middleware.JsonErrorHandler",
     "zerver.middleware.RateLimitMiddleware",
-    "zerver.middleware.FlushDisplayRecipientCache",
+    "zerver.middleware.FlushPerRequestCaches",
     "django.middleware.common.CommonMiddleware",
     "zerver.middleware.LocaleMiddleware",
     "zerver.middleware.HostDomainMiddleware",
@@ -208,6 +208,12 @@ REMOTE_POSTGRES_SSLMODE = ""
 
 TORNADO_PORTS: list[int] = []
 USING_TORNADO = True
+# Persist Tornado event queues as an append-only journal of changed
+# queues, rather than a single dump of every queue at shutdown.
+TORNADO_EVENT_QUEUE_JOURNAL = False
+# Event queues whose client is away are garbage-collected early once
+# they hold more than this many events; the client will re-register.
+EVENT_QUEUE_MAX_EVENTS = 10000
 
 # ToS/Privacy templates
 POLICIES_DIRECTORY: str = "zerver/policies_absent"
@@ -442,6 +448,11 @@ DEBUG_ERROR_REPORTING = False
 # this is disabled in production, but we need it in development.
 POST_MIGRATION_CACHE_FLUSHING = False
 
+# The maximum number of memcached entries each process keeps its own
+# copy of, for the hottest key families; 0 disables these copies.
+# See LOCAL_CACHE_KEY_FAMILIES in zerver/lib/cache.py.
+LOCAL_CACHE_SIZE = 0
+
 # Settings for APNS.  Only needed on push.zulipchat.com or if
 # rebuilding the mobile app with a different push notifications
 # server.
@@ -675,6 +686,12 @@ CUSTOM_AUTHENTICATION_WRAPPER_FUNCTION: Callable[..., Any] | None = None
 # notification.
 RESOLVE_TOPIC_UNDO_GRACE_PERIOD_SECONDS = 60
 
+# Moves of more messages than this are done in batches of this size,
+# with all but the first batch moved by the deferred_work queue
+# processor, so that moving a huge topic doesn't hold row locks on it
+# for minutes.
+MOVE_MESSAGES_BATCH_SIZE = 1000
+
 # For realm imports during registration, maximum size of file
 # that can be uploaded.
 MAX_WEB_DATA_IMPORT_SIZE_MB = 1024
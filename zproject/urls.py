@@ -20,9 +20,12 @@ from zerver.lib.rest import rest_path
 from zerver.lib.url_redirects import DOCUMENTATION_REDIRECTS
 from zerver.tornado.views import (
     cleanup_event_queue,
+    event_queue_stats,
     get_events,
     get_events_internal,
     notify,
+    rebalance_event_queues,
+    receive_event_queues,
     web_reload_clients,
 )
 from zerver.views.alert_words import add_alert_words, list_alert_words, remove_alert_words
@@ -84,6 +87,7 @@ from zerver.views.message_flags import (
     update_message_flags_for_narrow,
 )
 from zerver.views.message_send import render_message_backend, send_message_backend, zcommand_backend
+from zerver.views.metrics import metrics
 from zerver.views.muted_users import mute_user, unmute_user
 from zerver.views.onboarding_steps import mark_onboarding_step_as_read
 from zerver.views.presence import (
@@ -764,7 +768,11 @@ for app_name in settings.EXTRA_INSTALLED_APPS:
 # and Tornado processes
 urls += [
     path("api/internal/email_mirror_message", email_mirror_message),
+    path("api/internal/event_queue_stats", event_queue_stats),
+    path("api/internal/metrics", metrics),
     path("api/internal/notify_tornado", notify),
+    path("api/internal/rebalance_event_queues", rebalance_event_queues),
+    path("api/internal/receive_event_queues", receive_event_queues),
     path("api/internal/tusd", handle_tusd_hook),
     path("api/internal/web_reload_clients", web_reload_clients),
     path("api/v1/events/internal", get_events_internal),